@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Account, Person
+
+
+class Command(BaseCommand):
+    """
+    Recalculate blind indexes of encrypted fields, e.g. for rows created before the indexes existed or after
+    BLIND_INDEX_KEY was changed.
+    """
+    help = 'Fill blind indexes of encrypted emails of accounts and people.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows updated in one query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Account, Person):
+            fields = list(model.blind_indexes.values())
+            batch = []
+            count = 0
+            for instance in model.objects.only('pk', *model.blind_indexes).iterator(chunk_size=batch_size):
+                instance.update_blind_indexes()
+                batch.append(instance)
+                if len(batch) == batch_size:
+                    model.objects.bulk_update(batch, fields)
+                    count += len(batch)
+                    batch = []
+            model.objects.bulk_update(batch, fields)
+            count += len(batch)
+            self.stdout.write(f'{model.__name__}: {count} rows updated')
@@ -0,0 +1,39 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Person
+
+
+class Command(BaseCommand):
+    """
+    Merge people with the same identity and fill their fingerprints.
+    * Only people without an account - receivers typed in by senders - are merged, people of accounts are kept
+      as they are and their fingerprints are cleared.
+    * The oldest person of each group is kept, references to the others are moved to it.
+    """
+    help = 'Merge duplicate people and fill fingerprints of people created before they existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows updated in one query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        groups = defaultdict(list)
+        accountless = Person.objects.filter(account__isnull=True).order_by('created_at')
+        for person in accountless.iterator(chunk_size=batch_size):
+            groups[person.identity_fingerprint()].append(person)
+
+        merged = 0
+        people = []
+        with transaction.atomic():
+            cleared = Person.objects.filter(account__isnull=False, fingerprint__isnull=False).update(fingerprint=None)
+            for fingerprint, group in groups.items():
+                merged += Person.objects.merge(group[0], group[1:])
+                if group[0].fingerprint != fingerprint:
+                    group[0].fingerprint = fingerprint
+                    people.append(group[0])
+            Person.objects.bulk_update(people, ['fingerprint'], batch_size=batch_size)
+        self.stdout.write(f'{merged} duplicates merged, {len(people)} fingerprints updated, {cleared} cleared')
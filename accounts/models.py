@@ -1,12 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 import pgcrypto
 from couriers.models import Courier
-from helpers.models import TrackingModel
+from helpers.functions import person_fingerprint
+from helpers.models import BlindIndexModel, BlindIndexQuerySet, TrackingModel
 import uuid
 
 
-class AccountManager(BaseUserManager):
+class AccountManager(BaseUserManager.from_queryset(BlindIndexQuerySet)):
     """
     Account manager responsible for creating account instances through the CLI.
     """
@@ -50,16 +51,87 @@ class AccountManager(BaseUserManager):
         return user
 
 
-class Person(TrackingModel):
+class PersonQuerySet(BlindIndexQuerySet):
+    """
+    QuerySet of people able to match people by their identity fingerprint.
+    """
+    def resolve(self, email, first_name, last_name, phone_number):
+        """
+        Retrieve the person with the given identity with a single indexed lookup, or create them.
+
+        :return: Person instance
+        """
+        fingerprint = person_fingerprint(email, first_name, last_name, phone_number)
+        return self.get_or_create(fingerprint=fingerprint, defaults={
+            'email': email,
+            'first_name': first_name,
+            'last_name': last_name,
+            'phone_number': phone_number,
+        })[0]
+
+    def resolve_many(self, identities):
+        """
+        Retrieve people with the given identities with one query, missing people are created with one insert.
+
+        :param identities: list of dictionaries with email, first_name, last_name and phone_number keys
+        :return: dictionary of identity fingerprints and Person instances
+        """
+        identities = {person_fingerprint(**identity): identity for identity in identities}
+        people = {person.fingerprint: person for person in self.filter(fingerprint__in=identities)}
+        missing = [self.model(**identity) for fingerprint, identity in identities.items() if fingerprint not in people]
+        for person in missing:
+            person.fingerprint = person.identity_fingerprint()
+            person.update_blind_indexes()
+        if missing:
+            self.bulk_create(missing, ignore_conflicts=True)
+            # People created by a concurrent transaction in the meantime are not inserted, read all of them back
+            people.update({person.fingerprint: person
+                           for person in self.filter(fingerprint__in=[person.fingerprint for person in missing])})
+        return people
+
+    def merge(self, person, duplicates):
+        """
+        Merge duplicates into a person - all references to the duplicates are moved to the person
+        and the duplicates are deleted.
+        * Models with rows unique per person merge them themselves by their merge_people(person, ids) method.
+
+        :param person: Person instance that is kept
+        :param duplicates: Person instances or QuerySet of people that are merged into the person
+        :return: Number of merged people
+        """
+        ids = [duplicate.pk for duplicate in duplicates if duplicate.pk != person.pk]
+        if not ids:
+            return 0
+        with transaction.atomic():
+            for relation in self.model._meta.related_objects:
+                if hasattr(relation.related_model, 'merge_people'):
+                    relation.related_model.merge_people(person, ids)
+                elif relation.many_to_one or relation.one_to_one:
+                    relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': ids}) \
+                        .update(**{relation.field.name: person})
+            self.filter(pk__in=ids).delete()
+        return len(ids)
+
+
+class Person(BlindIndexModel, TrackingModel):
     """
     Person model responsible for holding personal data of people.
-    * All personal data is encrypted on the database level.
+    * All personal data is encrypted on the database level, email is looked up through its blind index.
+    * People without an account are deduplicated by the fingerprint of their identity, people of accounts have no
+      fingerprint and are never merged.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     first_name = pgcrypto.EncryptedCharField(models.CharField(max_length=60))
     last_name = pgcrypto.EncryptedCharField(models.CharField(max_length=60))
     phone_number = pgcrypto.EncryptedCharField(models.CharField(max_length=15))
     email = pgcrypto.EncryptedEmailField(verbose_name="email", max_length=60)
+    email_index = models.CharField(max_length=64, null=True, editable=False, db_index=True)
+    fingerprint = models.CharField(max_length=64, null=True, unique=True, editable=False)
+
+    blind_indexes = {'email': 'email_index'}
+    identity_fields = ('email', 'first_name', 'last_name', 'phone_number')
+
+    objects = PersonQuerySet.as_manager()
 
     class Meta:
         db_table = "person"
@@ -67,14 +139,31 @@ class Person(TrackingModel):
     def __str__(self):
         return '{} {}'.format(self.first_name, self.last_name)
 
+    def identity_fingerprint(self):
+        """
+        Calculate fingerprint from the current identity of the person.
 
-class Account(AbstractBaseUser, TrackingModel):
+        :return: Hex digest of the fingerprint
+        """
+        return person_fingerprint(self.email, self.first_name, self.last_name, self.phone_number)
+
+    def save(self, *args, **kwargs):
+        if self.fingerprint is not None:
+            self.fingerprint = self.identity_fingerprint()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and set(update_fields) & set(self.identity_fields):
+                kwargs['update_fields'] = set(update_fields) | {'fingerprint'}
+        super().save(*args, **kwargs)
+
+
+class Account(AbstractBaseUser, BlindIndexModel, TrackingModel):
     """
     Account model responsible for holding credentials of users.
-    * All personal data is encrypted on the database level.
+    * All personal data is encrypted on the database level, email is looked up through its blind index.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     email = pgcrypto.EncryptedEmailField(verbose_name="email", max_length=60, unique=True)
+    email_index = models.CharField(max_length=64, null=True, unique=True, editable=False)
     is_admin = models.BooleanField(default=False)
     is_active = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
@@ -84,6 +173,8 @@ class Account(AbstractBaseUser, TrackingModel):
 
     USERNAME_FIELD = 'email'
 
+    blind_indexes = {'email': 'email_index'}
+
     objects = AccountManager()
 
     class Meta:
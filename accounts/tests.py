@@ -1,7 +1,18 @@
+import io
+
+from django.core import mail
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import SimpleTestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from accounts.models import Account, Person
+from helpers.classes import EmailDispatcher
+from helpers.functions import blind_index
+from jobs.outbox import send_pending
+
 sample_account = {
     "email": "test@test.com",
     "password": "Testovacie123",
@@ -17,6 +28,12 @@ class TestRegister(APITestCase):
         response = self.client.post(reverse('account_api:accounts'), sample_account)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_verification_email(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        send_pending(10)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [sample_account['email']])
+
 
 class TestAuth(APITestCase):
     """ Test authentication """
@@ -93,4 +110,106 @@ class TestPatch(APITestCase):
         response = self.client.patch(reverse('account_api:account_detail', kwargs={'account_id': 'me'}),
                                      {'first_name': 'Marian'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, self.expected_result)
\ No newline at end of file
+        self.assertEqual(response.data, self.expected_result)
+
+
+class TestBlindIndex(APITestCase):
+    """ Test lookups of encrypted emails """
+    def test_lookup(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        account = Account.objects.get(email=sample_account['email'])
+        self.assertEqual(account.email_index, blind_index(sample_account['email']))
+        self.assertEqual(account.person.email_index, account.email_index)
+        self.assertIn('email_index', str(Account.objects.filter(email=sample_account['email']).query))
+        self.assertFalse(Account.objects.filter(email='other@test.com').exists())
+        self.assertEqual(Person.objects.filter(email__in=[sample_account['email']]).count(), 1)
+
+    def test_lookup_q(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        lookups = [
+            Q(email=sample_account['email']),
+            Q(email='other@test.com') | Q(person__email=sample_account['email']),
+            ~Q(email='other@test.com') & Q(is_admin=False),
+        ]
+        for lookup in lookups:
+            self.assertIn('email_index', str(Account.objects.filter(lookup).query))
+            self.assertEqual(Account.objects.filter(lookup).count(), 1)
+        self.assertIn('email_index', str(Account.objects.filter(person__email=sample_account['email']).query))
+        self.assertTrue(Account.objects.filter(person__email__in=[sample_account['email']]).exists())
+        self.assertFalse(Account.objects.exclude(person__email=sample_account['email']).exists())
+
+    def test_update(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        account = Account.objects.get(email=sample_account['email'])
+        account.email = 'changed@test.com'
+        account.save(update_fields=['email'])
+        self.assertTrue(Account.objects.filter(email='changed@test.com').exists())
+        self.assertFalse(Account.objects.filter(email=sample_account['email']).exists())
+
+
+class TestPersonFingerprint(APITestCase):
+    """ Test matching people by their identity """
+    def test_resolve(self):
+        person = Person.objects.resolve('jozef@test.com', 'Jozef', 'Mrkva', '0905 265 859')
+        same = Person.objects.resolve(' Jozef@Test.com', 'jozef ', 'MRKVA', '0905265859')
+        other = Person.objects.resolve('jozef@test.com', 'Jozef', 'Mrkva', '0905265850')
+        self.assertEqual(person.pk, same.pk)
+        self.assertNotEqual(person.pk, other.pk)
+
+    def test_account_person(self):
+        receiver = Person.objects.resolve(sample_account['email'], sample_account['first_name'],
+                                          sample_account['last_name'], sample_account['phone_number'])
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        account = Account.objects.get(email=sample_account['email'])
+        self.assertNotEqual(account.person_id, receiver.pk)
+        self.assertIsNone(account.person.fingerprint)
+
+    def test_deduplicate(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        identity = {field: sample_account[field] for field in Person.identity_fields}
+        kept = Person.objects.create(**identity)
+        Person.objects.create(**identity)
+        call_command('deduplicate_people', stdout=io.StringIO())
+        account = Account.objects.get(email=sample_account['email'])
+        self.assertEqual(Person.objects.count(), 2)
+        self.assertIsNone(Person.objects.get(pk=account.person_id).fingerprint)
+        self.assertEqual(Person.objects.get(pk=kept.pk).fingerprint, kept.identity_fingerprint())
+
+    def test_merge(self):
+        person = Person.objects.create(email='jozef@test.com', first_name='Jozef', last_name='Mrkva',
+                                       phone_number='0905265859')
+        duplicate = Person.objects.create(email='jozef@test.com', first_name='Jozef', last_name='Mrkva',
+                                          phone_number='0905265850')
+        account = Account.objects.create(email='jozef@test.com', password='Testovacie123', person=duplicate)
+        self.assertEqual(Person.objects.merge(person, [duplicate]), 1)
+        account.refresh_from_db()
+        self.assertEqual(account.person_id, person.pk)
+        self.assertFalse(Person.objects.filter(pk=duplicate.pk).exists())
+
+
+class TestEmailDispatcher(SimpleTestCase):
+    """ Test sending emails by the worker pool """
+
+    def test_send(self):
+        dispatcher = EmailDispatcher(workers=2, queue_size=10, batch_size=3)
+        for i in range(7):
+            self.assertTrue(dispatcher.send(f'Email {i}', '<p>Hello</p>', 'test@test.com', 'poslito@test.com'))
+        dispatcher.join()
+        messages = [message for message in mail.outbox if message.subject.startswith('Email ')]
+        self.assertEqual(sorted(message.subject for message in messages), [f'Email {i}' for i in range(7)])
+        self.assertEqual(messages[0].body, 'Hello')
+        self.assertEqual(len(dispatcher.threads), 2)
+
+    def test_invalid_email(self):
+        dispatcher = EmailDispatcher(workers=1, queue_size=10, batch_size=2)
+        for subject in ('Email 1', 'Invalid\nheader', 'Email 2', 'Invalid\nheader', 'Email 3'):
+            self.assertTrue(dispatcher.send(subject, '<p>Hello</p>', 'test@test.com', 'poslito@test.com'))
+        dispatcher.join()
+        subjects = sorted(message.subject for message in mail.outbox if message.subject.startswith('Email '))
+        self.assertEqual(subjects, ['Email 1', 'Email 2', 'Email 3'])
+        self.assertTrue(dispatcher.threads[0].is_alive())
+
+    def test_full_queue(self):
+        dispatcher = EmailDispatcher(workers=0, queue_size=1, queue_timeout=0)
+        self.assertTrue(dispatcher.send('Email', '<p>Hello</p>', 'test@test.com', 'poslito@test.com'))
+        self.assertFalse(dispatcher.send('Email', '<p>Hello</p>', 'test@test.com', 'poslito@test.com'))
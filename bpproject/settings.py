@@ -33,11 +33,13 @@ URL = ENV_VARS.get('URL')
 ALLOWED_HOSTS = json.loads(ENV_VARS.get('ALLOWED_HOST'))
 CORS_ORIGIN_ALLOW_ALL = True
 ASGI_APPLICATION = "bpproject.asgi.application"
+REDIS_HOST = ENV_VARS.get('REDIS_HOST', 'localhost')
+REDIS_PORT = int(ENV_VARS.get('REDIS_PORT', 6379))
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [(ENV_VARS.get('REDIS_HOST'), ENV_VARS.get('REDIS_PORT'))],
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
         },
     },
 }
@@ -50,6 +52,7 @@ INSTALLED_APPS = [
     'accounts',
     'routes',
     'couriers',
+    'jobs',
 
     # Django apps
     'channels',
@@ -209,6 +212,15 @@ EMAIL_HOST_USER = 'apikey'
 EMAIL_HOST_PASSWORD = SENDGRID_API_KEY
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
+# Emails are sent by EMAIL_WORKERS threads of every process over persistent connections, at most EMAIL_QUEUE_SIZE
+# emails wait in the queue and senders wait EMAIL_QUEUE_TIMEOUT seconds for room in a full queue
+EMAIL_WORKERS = int(ENV_VARS.get('EMAIL_WORKERS', 4))
+EMAIL_QUEUE_SIZE = int(ENV_VARS.get('EMAIL_QUEUE_SIZE', 1000))
+EMAIL_QUEUE_TIMEOUT = float(ENV_VARS.get('EMAIL_QUEUE_TIMEOUT', 5))
+EMAIL_BATCH_SIZE = int(ENV_VARS.get('EMAIL_BATCH_SIZE', 50))
+EMAIL_RETRIES = int(ENV_VARS.get('EMAIL_RETRIES', 3))
+EMAIL_RETRY_DELAY = float(ENV_VARS.get('EMAIL_RETRY_DELAY', 1))
+EMAIL_IDLE_TIMEOUT = float(ENV_VARS.get('EMAIL_IDLE_TIMEOUT', 30))
 
 LOGGING = {
     'version': 1,
@@ -266,6 +278,95 @@ LOGGING = {
 
 GOOGLE_API_KEY = ENV_VARS.get('GOOGLE_API_KEY')
 
+# Routing backend answering distance and route queries - Google Maps API or the local road graph of an OSM extract
+ROUTING_BACKEND = ENV_VARS.get('ROUTING_BACKEND', 'deliveries.routing.google.GoogleRoutingBackend')
+ROUTING_GRAPH_PATH = ENV_VARS.get('ROUTING_GRAPH_PATH')  # .osm file used by deliveries.routing.local.LocalRoutingBackend
+
+# Two-tier (in-process LRU + database) cache of Google Distance Matrix results between two places
+DISTANCE_CACHE_SIZE = int(ENV_VARS.get('DISTANCE_CACHE_SIZE', 10000))
+DISTANCE_CACHE_TTL = timedelta(seconds=int(ENV_VARS.get('DISTANCE_CACHE_TTL', 60 * 60 * 24 * 30)))
+# Serve expired entries for up to DISTANCE_CACHE_STALE_TTL while they are refreshed in the background
+DISTANCE_CACHE_STALE_WHILE_REVALIDATE = (ENV_VARS.get('DISTANCE_CACHE_STALE_WHILE_REVALIDATE') == 'True')
+DISTANCE_CACHE_STALE_TTL = timedelta(seconds=int(ENV_VARS.get('DISTANCE_CACHE_STALE_TTL', 60 * 60 * 24 * 7)))
+
+# Background job worker - python manage.py run_jobs
+JOBS_POLL_INTERVAL = float(ENV_VARS.get('JOBS_POLL_INTERVAL', 1))  # in seconds
+JOBS_BATCH_SIZE = int(ENV_VARS.get('JOBS_BATCH_SIZE', 10))
+JOBS_MAX_ATTEMPTS = int(ENV_VARS.get('JOBS_MAX_ATTEMPTS', 5))
+JOBS_RETRY_DELAY = int(ENV_VARS.get('JOBS_RETRY_DELAY', 30))  # in seconds, doubled after every failed attempt
+# in seconds, claimed jobs are claimed again after the lease if the worker died while running them
+JOBS_LEASE_TIMEOUT = int(ENV_VARS.get('JOBS_LEASE_TIMEOUT', 300))
+
+# Emails are written to the email outbox in the transaction that caused them and sent by
+# python manage.py send_outbox, if disabled they are sent by the email workers of the web process after commit
+EMAIL_OUTBOX = (ENV_VARS.get('EMAIL_OUTBOX', 'True') == 'True')
+EMAIL_OUTBOX_BATCH_SIZE = int(ENV_VARS.get('EMAIL_OUTBOX_BATCH_SIZE', 50))
+
+# Courier positions are broadcast to the group of the map tile the courier is in, listeners subscribe to the tiles
+# of their viewport
+COURIER_TILE_ZOOM = int(ENV_VARS.get('COURIER_TILE_ZOOM', 12))
+COURIER_TILES_MAX = int(ENV_VARS.get('COURIER_TILES_MAX', 64))  # maximum number of tiles of one viewport
+# Legacy stream of positions of all couriers - set to True to also broadcast every position to group_ALL
+# for old clients that do not subscribe to a viewport, every position then costs one more group send
+COURIER_GLOBAL_GROUP = (ENV_VARS.get('COURIER_GLOBAL_GROUP', 'False') == 'True')
+
+# Positions of one courier are coalesced - the latest one is published every COURIER_POSITION_INTERVAL seconds,
+# or once the courier moves COURIER_POSITION_DISTANCE meters, but at most once per COURIER_POSITION_MIN_INTERVAL
+COURIER_POSITION_INTERVAL = float(ENV_VARS.get('COURIER_POSITION_INTERVAL', 5))
+COURIER_POSITION_MIN_INTERVAL = float(ENV_VARS.get('COURIER_POSITION_MIN_INTERVAL', 1))
+COURIER_POSITION_DISTANCE = float(ENV_VARS.get('COURIER_POSITION_DISTANCE', 50))
+
+# Websocket connections reuse users and delivery access data cached for WS_AUTH_CACHE_TTL seconds
+WS_AUTH_CACHE_SIZE = int(ENV_VARS.get('WS_AUTH_CACHE_SIZE', 10000))
+WS_AUTH_CACHE_TTL = int(ENV_VARS.get('WS_AUTH_CACHE_TTL', 300))
+
+# Last positions of couriers are shared by all processes in Redis under keys starting with COURIER_LOCATION_KEY,
+# with COURIER_LOCATION_STORE=local each process indexes only its own couriers in a grid of COURIER_LOCATION_CELL
+# degrees, positions expire after COURIER_LOCATION_TTL seconds, nearest couriers are searched within
+# COURIER_LOCATION_RADIUS meters
+COURIER_LOCATION_STORE = ENV_VARS.get('COURIER_LOCATION_STORE', 'redis')
+COURIER_LOCATION_KEY = ENV_VARS.get('COURIER_LOCATION_KEY', 'courier_locations')
+COURIER_LOCATION_CELL = float(ENV_VARS.get('COURIER_LOCATION_CELL', 0.01))
+COURIER_LOCATION_TTL = int(ENV_VARS.get('COURIER_LOCATION_TTL', 60))
+COURIER_LOCATION_RADIUS = float(ENV_VARS.get('COURIER_LOCATION_RADIUS', 20000))
+COURIER_NEAREST_MAX = int(ENV_VARS.get('COURIER_NEAREST_MAX', 100))  # maximum number of couriers of one query
+
+# Positions of couriers of deliveries are buffered and written to the delivery tracks every TRACK_FLUSH_INTERVAL
+# seconds, or once TRACK_FLUSH_POINTS positions are buffered
+TRACK_FLUSH_INTERVAL = float(ENV_VARS.get('TRACK_FLUSH_INTERVAL', 10))
+TRACK_FLUSH_POINTS = int(ENV_VARS.get('TRACK_FLUSH_POINTS', 1000))
+
+# Serialized routes are cached in the routes cache for ROUTES_CACHE_TTL seconds or until a route changes - the
+# generation invalidating them is kept in the database, so a per-process cache is invalidated by writes of all
+# processes. Set ROUTES_CACHE_BACKEND and ROUTES_CACHE_LOCATION to share cached responses, e.g. memcached
+ROUTES_CACHE_TTL = int(ENV_VARS.get('ROUTES_CACHE_TTL', 60 * 60))
+ROUTES_CACHE_BACKEND = ENV_VARS.get('ROUTES_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'routes': {
+        'BACKEND': ROUTES_CACHE_BACKEND,
+        'LOCATION': ENV_VARS.get('ROUTES_CACHE_LOCATION', 'routes'),
+    },
+}
+if ROUTES_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['routes']['OPTIONS'] = {'MAX_ENTRIES': int(ENV_VARS.get('ROUTES_CACHE_SIZE', 10000))}
+
+# Polylines of routes are stored simplified at each of ROUTE_TOLERANCES meters, comma separated,
+# clients pick one by the tolerance or zoom level of their map
+ROUTE_TOLERANCES = [float(tolerance) for tolerance in ENV_VARS.get('ROUTE_TOLERANCES', '5,20,100,500').split(',')]
+
+# Search of routes passing near a point, maximum radius in meters and maximum number of routes of one query
+ROUTES_NEAR_MAX_RADIUS = float(ENV_VARS.get('ROUTES_NEAR_MAX_RADIUS', 5000))
+ROUTES_NEAR_MAX = int(ENV_VARS.get('ROUTES_NEAR_MAX', 100))
+
+# Maximum number of deliveries created by one bulk request
+DELIVERY_BULK_MAX = int(ENV_VARS.get('DELIVERY_BULK_MAX', 500))
+
+# Key of the HMAC blind indexes of encrypted fields, after changing it run python manage.py backfill_blind_indexes
+BLIND_INDEX_KEY = ENV_VARS.get('BLIND_INDEX_KEY', SECRET_KEY)
+
 if ENV_VARS.get('DEVELOPMENT') == 'True':
     GDAL_LIBRARY_PATH = os.path.join(BASE_DIR, ENV_VARS.get('GDAL_PATH'))
     GEOS_LIBRARY_PATH = os.path.join(BASE_DIR, ENV_VARS.get('GEOS_PATH'))
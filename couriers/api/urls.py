@@ -1,12 +1,14 @@
 from django.urls import path
 
 from couriers.api.views import (
-    CouriersView, ListClosestDeliveryView,
+    CouriersView, ListClosestDeliveryView, NearestCouriersView, PositionStatsView,
 )
 
 app_name = 'accounts'
 
 urlpatterns = [
+    path('position_stats/', PositionStatsView.as_view(), name="position_stats"),
+    path('nearest/', NearestCouriersView.as_view(), name="nearest"),
     path('closest_deliveries/', ListClosestDeliveryView.as_view(), name="closest_deliveries"),
     path('', CouriersView.as_view(), name="couriers"),
 ]
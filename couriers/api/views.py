@@ -1,18 +1,24 @@
-from django.contrib.gis.db.models.functions import Distance
+import math
+
+import redis
 from django.contrib.gis.geos import Point
-from django.db.models import Q
+from django.contrib.gis.measure import D
 from rest_framework import status
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
 
+from bpproject.settings import COURIER_NEAREST_MAX
 from couriers.permissions import IsCourier
-from deliveries.api.google_api import get_distance_for_sort
+from couriers.websockets.coalescer import get_stats
+from couriers.websockets.locations import locations, vehicle_types_for
+from deliveries.api.google_api import get_distances_for_sort
 from deliveries.api.serializers import SafeDeliverySerializer
 from deliveries.models import Delivery
 from couriers.api.serializers import CourierSerializer
-from helpers.enums import SizeType
+from helpers.enums import SizeType, VEHICLE_SIZES
+from helpers.models import KNNDistance
 
 
 class CouriersView(APIView):
@@ -51,53 +57,114 @@ class ListClosestDeliveryView(GenericAPIView):
 
     def get_queryset(self):
         """
-        Get query set of 'ready' deliveries
+        Get query set of 'ready' deliveries the vehicle of the courier can carry.
+        * Conditions match the partial indexes of Delivery, so only the index of the vehicle type is searched.
+
         :return: query set of deliveries in the 'ready' state
         """
+        sizes = VEHICLE_SIZES[self.request.user.courier.vehicle_type]
         qs = Delivery.objects.filter(state='ready')
+        if len(sizes) < len(SizeType.values):
+            qs = qs.filter(item_size__in=sizes)
         return qs
 
-    def get_route_distance(self, delivery):
-        """
-        Get route distance from courier to delivery pick up place
-
-        :param delivery: delivery object
-        :return: route distance for driving between coordinates and pick up place of delivery - positive integer in meters
-        """
-        return get_distance_for_sort(delivery, self.latitude, self.longitude)
-
     def sort_based_on_route_distance(self, deliveries):
         """
         Sort deliveries based on their route distance
+        * Route distances of all deliveries are retrieved in one batched request.
+
         :param deliveries: the deliveries query set
         :return: sorted array of deliveries based on route distance
         """
-        return sorted(deliveries, key=self.get_route_distance)
+        distances = get_distances_for_sort(deliveries, self.latitude, self.longitude)
+        return [delivery for _, delivery in sorted(zip(distances, deliveries), key=lambda pair: pair[0])]
 
     def get(self, request):
         """
         List 10 ready deliveries ordered by closest to coordinates given as query params.
         Size of delivery must be equal or smaller that size of courier vehicle to be retrieved.
+        * Deliveries are ordered by the KNN distance operator, which reads the closest rows from the index
+          instead of calculating the distance of every ready delivery.
 
         :param request: HTTP GET request with query params:
-                        longitude and latitude of courier - example: /?lon=52,25486&lat=24,6589 .
-        :return: list of delivery objects with safe info of the delivery
+                        longitude and latitude of courier - example: /?lon=52,25486&lat=24,6589 ,
+                        optional radius in meters to search deliveries in.
+        :return: HTTP Response - 200 with list of delivery objects with safe info of the delivery,
+                 400 if invalid query params
         """
-        vehicle_type = request.user.courier.vehicle_type
         qs = self.get_queryset()
-        if vehicle_type == SizeType.SMALL:
-            qs = qs.filter(Q(item__size=SizeType.SMALL))
-        elif vehicle_type == SizeType.MEDIUM:
-            qs = qs.filter(Q(item__size=SizeType.SMALL) | Q(item__size=SizeType.MEDIUM))
-        self.longitude = self.request.query_params.get('lon', '0,0')
-        self.latitude = self.request.query_params.get('lat', '0,0')
-        self.longitude = float(self.longitude.replace(',', '.'))
-        self.latitude = float(self.latitude.replace(',', '.'))
+        try:
+            self.longitude = float(self.request.query_params.get('lon', '0,0').replace(',', '.'))
+            self.latitude = float(self.request.query_params.get('lat', '0,0').replace(',', '.'))
+            radius = self.request.query_params.get('radius')
+            radius = float(radius) if radius else None
+        except ValueError:
+            return Response({'error': "Invalid lat, lon or radius parameter"}, status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= self.latitude <= 90 and -180 <= self.longitude <= 180) \
+                or not (radius is None or 0 <= radius < math.inf):
+            return Response({'error': "Parameter lat, lon or radius out of range"}, status.HTTP_400_BAD_REQUEST)
         courier_location = Point(self.longitude, self.latitude, srid=4326)
-        qs = qs.select_related('pickup_place').annotate(
-            distance=Distance('pickup_place__coordinates', courier_location)
+        if radius is not None:
+            qs = qs.filter(pickup_coordinates__dwithin=(courier_location, D(m=radius)))
+        qs = qs.select_related('pickup_place', 'delivery_place', 'item').annotate(
+            distance=KNNDistance('pickup_coordinates', courier_location)
         ).order_by('distance')[:10]
         serializer = self.get_serializer(qs, many=True)
         closest_deliveries = self.sort_based_on_route_distance(serializer.data)
         return Response(closest_deliveries)
 
+
+class PositionStatsView(APIView):
+    """
+    View for monitoring of courier positions received over websockets by this process.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Retrieve counters of received, published and merged courier positions.
+
+        :param request: HTTP GET request
+        :return: HTTP Response - 200 with the counters, 401 if not authenticated, 403 if not staff
+        """
+        return Response(get_stats())
+
+
+class NearestCouriersView(APIView):
+    """
+    View to retrieve couriers closest to a point from their live positions.
+    * Positions are shared by all server processes through Redis, only couriers who sent a position recently
+      are found.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        List k couriers ordered by distance to coordinates given as query params.
+        If size is given, only couriers with vehicle able to carry an item of the size are retrieved.
+
+        :param request: HTTP GET request with query params:
+                        longitude and latitude of the point - example: /?lon=52,25486&lat=24,6589 ,
+                        optional k - maximum number of couriers, 10 by default,
+                        optional size - SizeType of the item.
+        :return: HTTP Response - 200 with list of couriers with their position, distance in meters and time
+                 of the position, 400 if invalid query params, 401 if not authenticated,
+                 503 if the positions are not available
+        """
+        try:
+            longitude = float(request.query_params.get('lon', '').replace(',', '.'))
+            latitude = float(request.query_params.get('lat', '').replace(',', '.'))
+            k = int(request.query_params.get('k', 10))
+        except ValueError:
+            return Response({'error': "Invalid lat, lon or k parameter"}, status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or not (0 < k <= COURIER_NEAREST_MAX):
+            return Response({'error': "Parameter lat, lon or k out of range"}, status.HTTP_400_BAD_REQUEST)
+        size = request.query_params.get('size')
+        if size is not None and size not in SizeType.values:
+            return Response({'error': f"Size must be one of {', '.join(SizeType.values)}"},
+                            status.HTTP_400_BAD_REQUEST)
+        vehicle_types = vehicle_types_for(size) if size else None
+        try:
+            return Response(locations.nearest(latitude, longitude, k, vehicle_types))
+        except redis.RedisError:
+            return Response({'error': "Courier positions are not available"}, status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -7,3 +7,9 @@ class CouriersConfig(AppConfig):
     """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'couriers'
+
+    def ready(self):
+        """
+        Connect invalidation of websocket caches to model changes.
+        """
+        import couriers.websockets.cache  # noqa: F401
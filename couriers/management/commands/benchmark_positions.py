@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import functools
+import importlib
+import time
+import uuid
+from unittest import mock
+
+import msgpack
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from accounts.models import Account
+from couriers.models import Courier
+from couriers.websockets.routing import websocket_urlpatterns
+from helpers.enums import SizeType
+
+VIEWPORT = {'south': 48.1, 'west': 17.0, 'north': 48.2, 'east': 17.2}
+BINARY_SUBPROTOCOL = 'poslito.msgpack'
+
+
+def disable_coalescing():
+    """
+    Make every position of a courier be broadcast at once, on revisions without coalescing nothing is changed.
+
+    :return: context manager patching the default intervals of PositionCoalescer
+    """
+    try:
+        coalescer = importlib.import_module('couriers.websockets.coalescer')
+    except ImportError:
+        return contextlib.nullcontext()
+    init = functools.partialmethod(coalescer.PositionCoalescer.__init__, interval=0, min_interval=0)
+    return mock.patch.object(coalescer.PositionCoalescer, '__init__', init)
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the courier websocket consumer in a single process with an in-memory channel layer.
+    * Clients talk to the consumer only through its websocket routes, so the command can be copied to an older
+      revision and run there to compare the throughput of both revisions.
+    """
+    help = 'Measure courier positions broadcast per second by one worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000,
+                            help='Number of positions sent by the courier.')
+        parser.add_argument('--listeners', type=int, default=10,
+                            help='Number of clients receiving the positions.')
+        parser.add_argument('--coalesce', action='store_true',
+                            help='Keep position coalescing on, by default every position is broadcast.')
+        parser.add_argument('--binary', action='store_true',
+                            help='Connect with the binary subprotocol instead of JSON.')
+
+    def handle(self, *args, **options):
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                              'CONFIG': {'capacity': options['messages'] + 100}}}
+        coalescing = contextlib.nullcontext() if options['coalesce'] else disable_coalescing()
+        with override_settings(CHANNEL_LAYERS=layers), coalescing:
+            received, size, elapsed = asyncio.run(self.run(options['messages'], options['listeners'],
+                                                           options['binary']))
+        self.stdout.write(f'{options["messages"]} positions sent, {received} delivered to '
+                          f'{options["listeners"]} listeners in {elapsed:.2f} s')
+        self.stdout.write(f'{size / max(received, 1):.0f} bytes per delivered position')
+        self.stdout.write(f'{options["messages"] / elapsed:.0f} positions/s, {received / elapsed:.0f} deliveries/s')
+
+    @staticmethod
+    async def connect(application, user, binary):
+        """
+        Open a websocket connection of a user.
+
+        :return: connected WebsocketCommunicator
+        """
+        subprotocols = [BINARY_SUBPROTOCOL] if binary else None
+        communicator = WebsocketCommunicator(application, '/ws/couriers/', subprotocols=subprotocols)
+        communicator.scope['user'] = user
+        connected, subprotocol = await communicator.connect()
+        if not connected:
+            raise CommandError('Websocket connection was rejected')
+        if binary and subprotocol != BINARY_SUBPROTOCOL:
+            await communicator.disconnect()
+            raise CommandError('Binary subprotocol is not supported by this revision')
+        return communicator
+
+    @staticmethod
+    async def drain(communicator, count):
+        """
+        Receive messages until count positions arrived or the connection goes quiet.
+
+        :return: tuple of the number of received positions, their size in bytes and the time the last one arrived
+        """
+        received, size, last = 0, 0, time.perf_counter()
+        while received < count:
+            try:
+                message = await communicator.receive_from(timeout=5)
+            except asyncio.TimeoutError:
+                break
+            if isinstance(message, bytes) or 'courier_id' in message:
+                received, size, last = received + 1, size + len(message), time.perf_counter()
+        return received, size, last
+
+    async def run(self, messages, listeners, binary):
+        """
+        Send positions of one courier and wait until every listener received them.
+
+        :return: tuple of the number of positions received by listeners, their size in bytes and elapsed seconds
+        """
+        application = URLRouter(websocket_urlpatterns)
+        courier = Account(id=uuid.uuid4(), courier=Courier(id=uuid.uuid4(), vehicle_type=SizeType.MEDIUM))
+        sockets = [await self.connect(application, AnonymousUser(), binary) for _ in range(listeners)]
+        for socket in sockets:
+            await socket.send_json_to({'viewport': VIEWPORT})
+            await socket.receive_json_from()
+        sender = await self.connect(application, courier, binary)
+
+        start = time.perf_counter()
+        receivers = [asyncio.ensure_future(self.drain(socket, messages)) for socket in sockets]
+        for i in range(messages):
+            latitude = 48.15 + i % 100 * 0.0001
+            if binary:
+                await sender.send_to(bytes_data=msgpack.packb([latitude, 17.1]))
+            else:
+                await sender.send_json_to({'latitude': latitude, 'longitude': 17.1})
+        results = await asyncio.gather(*receivers)
+        received = sum(count for count, _, _ in results)
+        size = sum(size for _, size, _ in results)
+        elapsed = max([last for _, _, last in results], default=time.perf_counter()) - start
+
+        for socket in sockets + [sender]:
+            await socket.disconnect()
+        return received, size, elapsed
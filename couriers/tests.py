@@ -1,10 +1,35 @@
 import json
+import random
+import uuid
 
+import msgpack
+import redis
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils.http import urlencode
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from accounts.models import Account
+from bpproject.settings import REDIS_HOST, REDIS_PORT
+from couriers.models import Courier
+from couriers.websockets.cache import delivery_cache, delivery_key, user_cache
+from couriers.websockets.coalescer import PositionCoalescer
+from couriers.websockets.consumers import BINARY_SUBPROTOCOL, decode_position, encode_position
+from couriers.websockets.locations import LocationStore, RedisLocationStore, vehicle_types_for
+from couriers.websockets.routing import websocket_urlpatterns
+from couriers.websockets.tiles import position_tile, viewport_tiles
+from deliveries.models import Delivery
+from deliveries.routing.road_graph import haversine
+from helpers.classes import TTLCache
+from helpers.enums import DeliveryState, SizeType
+
 sample_account = {
     "email": "test@test.com",
     "password": "Testovacie123",
@@ -130,6 +155,17 @@ class TestClosestDeliveries(APITestCase):
         self.assertEqual(response.data[0]['item']['name'], 'Ponozky')
         self.assertEqual(response.data[0]['state'], 'ready')
 
+    def test_get_radius(self):
+        self.prepare()
+        location = {"lat": 48.42568196973426, "lon": 17.583197128156495}
+        response = self.client.get(reverse("couriers_api:closest_deliveries"), {**location, "radius": 1000})
+        self.assertEqual(len(response.data), 0)
+        response = self.client.get(reverse("couriers_api:closest_deliveries"), {**location, "radius": 1000000})
+        self.assertEqual(len(response.data), 2)
+        for radius in ('-1', 'nan', 'inf', 'abc'):
+            response = self.client.get(reverse("couriers_api:closest_deliveries"), {**location, "radius": radius})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class TestAcceptDelivery(APITestCase):
     """ Test starting delivery with sending message over WS"""
@@ -173,4 +209,231 @@ class TestAcceptDelivery(APITestCase):
         safe_id = self.prepare()
         response = self.client.patch(reverse('core_api:delivery_state', kwargs={'safe_delivery_id': safe_id}),
                                      json.dumps({"state": "assigned"}), content_type='application/json')
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestTiles(SimpleTestCase):
+    """ Test map tiles of courier positions """
+
+    def test_position_tile(self):
+        self.assertEqual(position_tile(48.1486, 17.1077, 3), '120')
+        self.assertTrue(position_tile(48.1486, 17.1077, 12).startswith('120'))
+
+    def test_viewport_tiles(self):
+        tiles = viewport_tiles({'south': 48.1, 'west': 17.0, 'north': 48.2, 'east': 17.2}, 12)
+        self.assertEqual(len(tiles), 9)
+        self.assertIn(position_tile(48.1486, 17.1077, 12), tiles)
+        self.assertEqual(len(viewport_tiles({'south': -10, 'west': 179, 'north': 10, 'east': -179}, 4)), 4)
+        with self.assertRaises(ValueError):
+            viewport_tiles({'south': 0, 'west': 0, 'north': 40, 'east': 40}, 12)
+        with self.assertRaises(ValueError):
+            viewport_tiles({'south': 0, 'west': 0}, 12)
+
+
+class TestPositionCoalescer(SimpleTestCase):
+    """ Test coalescing of courier positions """
+
+    def test_offer(self):
+        coalescer = PositionCoalescer(interval=5, min_interval=1, distance=50)
+        first = {'latitude': 48.1486, 'longitude': 17.1077}
+        near = {'latitude': 48.1487, 'longitude': 17.1077}
+        far = {'latitude': 48.1500, 'longitude': 17.1077}
+        far_near = {'latitude': 48.1501, 'longitude': 17.1077}
+        self.assertEqual(coalescer.offer(first, 0), first)
+        self.assertIsNone(coalescer.offer(near, 0.5))
+        self.assertIsNone(coalescer.offer(far, 0.8))  # kept until the minimum interval elapses
+        self.assertEqual(coalescer.offer(far, 2), far)
+        self.assertIsNone(coalescer.offer(far_near, 3))
+        self.assertEqual(coalescer.delay(3), 4)
+        self.assertEqual(coalescer.flush(7), far_near)
+        self.assertIsNone(coalescer.flush(8))
+
+
+class TestBinaryFrames(SimpleTestCase):
+    """ Test binary frames of courier positions """
+
+    def test_encode(self):
+        courier_id = uuid.uuid4()
+        position = {'courier_id': str(courier_id), 'latitude': 48.1486, 'longitude': 17.1077}
+        frame = encode_position(position)
+        self.assertEqual(msgpack.unpackb(frame), [courier_id.bytes, 48.1486, 17.1077])
+        self.assertLess(len(frame), len(json.dumps(position)) / 2)
+
+    def test_decode(self):
+        self.assertEqual(decode_position(msgpack.packb([48.1486, 17.1077])),
+                         {'latitude': 48.1486, 'longitude': 17.1077})
+        self.assertIsNone(decode_position(msgpack.packb([48.1486])))
+        self.assertIsNone(decode_position(msgpack.packb(48.1486)))
+        self.assertIsNone(decode_position(b'\xc1'))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class TestConsumer(SimpleTestCase):
+    """ Test courier websocket consumer """
+
+    async def connect(self, user, subprotocols=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/couriers/',
+                                             subprotocols=subprotocols)
+        communicator.scope['user'] = user
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, subprotocol
+
+    async def test_positions(self):
+        courier = Account(id=uuid.uuid4(), courier=Courier(id=uuid.uuid4(), vehicle_type=SizeType.MEDIUM))
+        listener, _ = await self.connect(AnonymousUser())
+        await listener.send_json_to({'viewport': {'south': 48.1, 'west': 17.0, 'north': 48.2, 'east': 17.2}})
+        self.assertIn('subscribed', await listener.receive_json_from())
+        await listener.send_json_to({'latitude': 48.15, 'longitude': 17.1})
+        self.assertEqual(await listener.receive_json_from(), {'errors': ['Only courier can post to websocket']})
+
+        sender, _ = await self.connect(courier)
+        await sender.send_json_to({'latitude': 48.15, 'longitude': 17.1})
+        self.assertEqual(await listener.receive_json_from(),
+                         {'latitude': 48.15, 'longitude': 17.1, 'courier_id': str(courier.id)})
+        await sender.send_json_to({'latitude': 100, 'longitude': 17.1})
+        self.assertIn('errors', await sender.receive_json_from())
+        await sender.disconnect()
+        await listener.disconnect()
+
+    async def test_binary(self):
+        courier = Account(id=uuid.uuid4(), courier=Courier(id=uuid.uuid4(), vehicle_type=SizeType.MEDIUM))
+        listener, subprotocol = await self.connect(AnonymousUser(), [BINARY_SUBPROTOCOL])
+        self.assertEqual(subprotocol, BINARY_SUBPROTOCOL)
+        await listener.send_json_to({'viewport': {'south': 48.1, 'west': 17.0, 'north': 48.2, 'east': 17.2}})
+        await listener.receive_json_from()
+        sender, _ = await self.connect(courier, [BINARY_SUBPROTOCOL])
+        await sender.send_to(bytes_data=msgpack.packb([48.15, 17.1]))
+        self.assertEqual(msgpack.unpackb(await listener.receive_from()), [courier.id.bytes, 48.15, 17.1])
+        await sender.disconnect()
+        await listener.disconnect()
+
+
+class TestLocationStore(SimpleTestCase):
+    """ Test index of live courier positions """
+
+    def test_nearest(self):
+        store = LocationStore(cell=0.01, ttl=60, radius=5000)
+        store.update('a', 48.1486, 17.1077, 'small', now=0)
+        store.update('b', 48.1500, 17.1077, 'large', now=0)
+        store.update('c', 48.1600, 17.1077, 'medium', now=0)
+        store.update('far', 49.0, 17.1077, 'large', now=0)
+        nearest = store.nearest(48.1486, 17.1077, k=2, now=1)
+        self.assertEqual([courier['courier_id'] for courier in nearest], ['a', 'b'])
+        self.assertEqual(nearest[0]['distance'], 0)
+        nearest = store.nearest(48.1486, 17.1077, k=10, vehicle_types=vehicle_types_for('medium'), now=1)
+        self.assertEqual([courier['courier_id'] for courier in nearest], ['b', 'c'])
+        store.update('a', 48.1700, 17.1077, 'small', now=2)
+        self.assertEqual(store.nearest(48.1486, 17.1077, k=1, now=3)[0]['courier_id'], 'b')
+
+    def test_expiry(self):
+        store = LocationStore(cell=0.01, ttl=60, radius=5000)
+        store.update('a', 48.1486, 17.1077, 'small', now=0)
+        self.assertEqual(len(store.nearest(48.1486, 17.1077, now=61)), 0)
+        store.update('b', 48.1486, 17.1077, 'small', now=100)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(len(store.cells), 1)
+
+    def test_matches_scan(self):
+        store = LocationStore(cell=0.01, ttl=60, radius=3000)
+        rng = random.Random(1)
+        positions = {str(i): (48 + rng.random(), 17 + rng.random()) for i in range(2000)}
+        positions['east'] = (0.0, 179.999)
+        for courier_id, (latitude, longitude) in positions.items():
+            store.update(courier_id, latitude, longitude, 'medium', now=0)
+        for latitude, longitude in [(48.5, 17.5), (48.0, 17.0), (0.0, -179.999)]:
+            expected = sorted((haversine(latitude, longitude, *position), courier_id)
+                              for courier_id, position in positions.items())
+            expected = [courier_id for distance, courier_id in expected if distance <= 3000][:5]
+            nearest = store.nearest(latitude, longitude, k=5, now=0)
+            self.assertEqual([courier['courier_id'] for courier in nearest], expected)
+
+
+class TestRedisLocationStore(SimpleTestCase):
+    """ Test index of live courier positions shared through Redis """
+
+    def setUp(self):
+        client = redis.Redis(REDIS_HOST, REDIS_PORT, decode_responses=True)
+        self.store = RedisLocationStore(client, key='test_courier_locations', ttl=60, radius=5000)
+        self.addCleanup(self.store.clear)
+
+    def test_nearest(self):
+        self.store.update('a', 48.1486, 17.1077, 'small', now=0)
+        self.store.update('b', 48.1500, 17.1077, 'large', now=0)
+        self.store.update('c', 48.1600, 17.1077, 'medium', now=0)
+        self.store.update('far', 49.0, 17.1077, 'large', now=0)
+        nearest = self.store.nearest(48.1486, 17.1077, k=2, now=1)
+        self.assertEqual([courier['courier_id'] for courier in nearest], ['a', 'b'])
+        self.assertLess(nearest[0]['distance'], 1)
+        self.assertAlmostEqual(nearest[1]['latitude'], 48.15, places=4)
+        nearest = self.store.nearest(48.1486, 17.1077, k=10, vehicle_types=vehicle_types_for('medium'), now=1)
+        self.assertEqual([courier['courier_id'] for courier in nearest], ['b', 'c'])
+        self.store.update('a', 48.1700, 17.1077, 'small', now=2)
+        self.assertEqual(self.store.nearest(48.1486, 17.1077, k=1, now=3)[0]['courier_id'], 'b')
+
+    def test_filtered_batches(self):
+        for i in range(20):
+            self.store.update(f'small{i}', 48.1486, 17.1077 + i / 10000, 'small', now=0)
+        self.store.update('large', 48.1600, 17.1077, 'large', now=0)
+        nearest = self.store.nearest(48.1486, 17.1077, k=2, vehicle_types=vehicle_types_for('large'), now=1)
+        self.assertEqual([courier['courier_id'] for courier in nearest], ['large'])
+
+    def test_expiry(self):
+        self.store.update('a', 48.1486, 17.1077, 'small', now=0)
+        self.assertEqual(len(self.store.nearest(48.1486, 17.1077, now=61)), 0)
+        self.store.update('b', 48.1486, 17.1077, 'small', now=100)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual([courier['courier_id'] for courier in self.store.nearest(48.1486, 17.1077, now=100)], ['b'])
+        self.store.remove('b')
+        self.assertEqual(len(self.store), 0)
+
+
+class TestDeliveryCache(TransactionTestCase):
+    """ Test caching of deliveries tracked over websockets """
+
+    def test_invalidation(self):
+        delivery = Delivery.objects.create()
+        delivery_cache.set(delivery_key(delivery.pk), (DeliveryState.READY, None))
+        with transaction.atomic():
+            delivery.save()
+            # Connections before the commit still see the committed state
+            self.assertIsNotNone(delivery_cache.get(delivery_key(delivery.pk)))
+        self.assertIsNone(delivery_cache.get(delivery_key(delivery.pk)))
+
+    def test_key(self):
+        delivery_id = uuid.uuid4()
+        self.assertEqual(delivery_key(str(delivery_id).upper()), str(delivery_id))
+        self.assertEqual(delivery_key(delivery_id.hex), str(delivery_id))
+        with self.assertRaises(ValueError):
+            delivery_key('abc')
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    async def test_stale(self):
+        delivery = await database_sync_to_async(Delivery.objects.create)(state=DeliveryState.ASSIGNED)
+        # Entry cached before the delivery was assigned in another process
+        delivery_cache.set(delivery_key(delivery.pk), (DeliveryState.READY, None))
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns),
+                                             f'/ws/couriers/{delivery.pk.hex.upper()}/')
+        communicator.scope['user'] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(delivery_cache.get(delivery_key(delivery.pk)), (DeliveryState.ASSIGNED, None))
+        await communicator.disconnect()
+
+
+class TestWebsocketCache(APITestCase):
+    """ Test caching of websocket users """
+
+    def test_expiry(self):
+        cache = TTLCache(10, 0)
+        cache.set('key', 'value')
+        self.assertIsNone(cache.get('key'))
+
+    def test_invalidation(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+        account = Account.objects.get(email=sample_account['email'])
+        user_cache.set(str(account.pk), account)
+        self.assertIs(user_cache.get(str(account.pk)), account)
+        account.save()
+        self.assertIsNone(user_cache.get(str(account.pk)))
@@ -0,0 +1,62 @@
+import uuid
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import Account
+from bpproject.settings import WS_AUTH_CACHE_SIZE, WS_AUTH_CACHE_TTL
+from couriers.models import Courier
+from deliveries.models import Delivery
+from helpers.classes import TTLCache
+
+# user ID -> Account instance of authenticated websocket users
+user_cache = TTLCache(WS_AUTH_CACHE_SIZE, WS_AUTH_CACHE_TTL)
+# delivery ID -> (state, courier ID) of deliveries tracked over websockets, keys are normalized by delivery_key
+delivery_cache = TTLCache(WS_AUTH_CACHE_SIZE, WS_AUTH_CACHE_TTL)
+
+
+def delivery_key(delivery_id):
+    """
+    Normalize a delivery ID to the canonical form of a UUID, so IDs written in upper case or without hyphens
+    share one entry of the delivery cache.
+
+    :param delivery_id: delivery ID, e.g. from the URL of a websocket
+    :return: canonical string of the UUID
+    :raises ValueError: if the ID is not a valid UUID
+    """
+    return str(uuid.UUID(str(delivery_id)))
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_user(sender, instance, **kwargs):
+    """
+    Drop cached account after it changed, e.g. the user registered as a courier.
+    * Other processes keep their entry until it expires.
+    """
+    user_cache.delete(str(instance.pk))
+
+
+@receiver(post_save, sender=Courier)
+def invalidate_courier(sender, instance, **kwargs):
+    """
+    Drop cached accounts of a courier after it changed, e.g. its vehicle type.
+    * Other processes keep their entry until it expires.
+    """
+    for account_id in Account.objects.filter(courier=instance).values_list('id', flat=True):
+        user_cache.delete(str(account_id))
+
+
+@receiver(post_save, sender=Delivery)
+@receiver(post_delete, sender=Delivery)
+def invalidate_delivery(sender, instance, **kwargs):
+    """
+    Drop cached delivery after it changed, e.g. its state or courier.
+    * The entry is dropped once the change is committed, so a connection in between doesn't cache the old state
+      again.
+    * Other processes keep their entry until it expires, consumers re-read the delivery before rejecting
+      a connection or a position, so only allowed deliveries are served from a stale entry.
+    """
+    key = delivery_key(instance.pk)
+    transaction.on_commit(lambda: delivery_cache.delete(key))
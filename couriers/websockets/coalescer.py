@@ -0,0 +1,98 @@
+import threading
+from collections import Counter
+
+from bpproject.settings import (COURIER_POSITION_INTERVAL, COURIER_POSITION_MIN_INTERVAL,
+                                COURIER_POSITION_DISTANCE)
+from deliveries.routing.road_graph import haversine
+
+stats = Counter()
+stats_lock = threading.Lock()
+
+
+def record(event):
+    """
+    Increment a position counter.
+
+    :param event: name of the counter - received, published or merged
+    """
+    with stats_lock:
+        stats[event] += 1
+
+
+def get_stats():
+    """
+    Retrieve counters of courier positions in this process.
+    * merged positions were replaced by a newer position of the same courier before they were published.
+
+    :return: dictionary of counter names and their values
+    """
+    with stats_lock:
+        return {event: stats[event] for event in ('received', 'published', 'merged')}
+
+
+class PositionCoalescer:
+    """
+    Coalescing stage of the positions of one courier - only the latest position is kept and it is published
+    once COURIER_POSITION_INTERVAL elapsed, or sooner if the courier moved more than COURIER_POSITION_DISTANCE.
+    * Positions are never published more often than once per COURIER_POSITION_MIN_INTERVAL.
+    """
+    def __init__(self, interval=COURIER_POSITION_INTERVAL, min_interval=COURIER_POSITION_MIN_INTERVAL,
+                 distance=COURIER_POSITION_DISTANCE):
+        """
+        Initialize coalescer.
+
+        :param interval: seconds after which the latest position is always published
+        :param min_interval: minimum seconds between two published positions
+        :param distance: distance in meters from the last published position that publishes a position sooner
+        """
+        self.interval = interval
+        self.min_interval = min_interval
+        self.distance = distance
+        self.pending = None
+        self.published = None
+        self.published_at = None
+
+    def offer(self, position, now):
+        """
+        Receive a new position of the courier.
+
+        :param position: dictionary with 'latitude' and 'longitude' keys
+        :param now: current monotonic time in seconds
+        :return: position to publish right away or None if it is kept pending
+        """
+        record('received')
+        if self.pending is not None:
+            record('merged')
+        self.pending = position
+        if self.published is None:
+            return self.flush(now)
+        elapsed = now - self.published_at
+        if elapsed >= self.interval:
+            return self.flush(now)
+        moved = haversine(self.published['latitude'], self.published['longitude'],
+                          position['latitude'], position['longitude'])
+        if moved >= self.distance and elapsed >= self.min_interval:
+            return self.flush(now)
+        return None
+
+    def delay(self, now):
+        """
+        Calculate time until the pending position has to be published.
+
+        :param now: current monotonic time in seconds
+        :return: seconds to wait
+        """
+        return max(0.0, self.published_at + self.interval - now)
+
+    def flush(self, now):
+        """
+        Take the pending position for publishing.
+
+        :param now: current monotonic time in seconds
+        :return: pending position or None if there is none
+        """
+        position, self.pending = self.pending, None
+        if position is not None:
+            self.published, self.published_at = position, now
+            record('published')
+        return position
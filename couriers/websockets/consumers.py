@@ -1,9 +1,20 @@
+import asyncio
 import json
+import time
+import uuid
 
-from channels.generic.websocket import JsonWebsocketConsumer
-from asgiref.sync import async_to_sync
+import msgpack
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.core.exceptions import ValidationError
 
+from bpproject.settings import COURIER_GLOBAL_GROUP
+from couriers.websockets.cache import delivery_cache, delivery_key
+from couriers.websockets.coalescer import PositionCoalescer
+from couriers.websockets.locations import locations
+from couriers.websockets.tiles import position_tile, tile_group, viewport_tiles
+from couriers.websockets.tracks import track_writer
 from deliveries.models import Delivery
 from helpers.enums import DeliveryState
 
@@ -14,18 +25,65 @@ FORMAT_ERROR_MESSAGE = {'errors': ["Incorrect position format, make sure the mes
                             'longitude': 25.4568
                         }}
 
+# Clients negotiating this subprotocol send and receive positions in binary frames, see encode_position
+BINARY_SUBPROTOCOL = 'poslito.msgpack'
+
 
+@database_sync_to_async
 def get_delivery(delivery_id):
     """
-    Retrieve delivery instance from databse.
+    Retrieve state and courier of a delivery from databse.
+
+    :param delivery_id: ID of the delivery to retrieve.
+    :return: tuple of state and courier ID of the delivery
+    """
+    return Delivery.objects.values_list('state', 'courier_id').get(id=delivery_id)
+
+
+async def get_cached_delivery(delivery_id, refresh=False):
+    """
+    Retrieve state and courier of a delivery from the cache, or from database if not cached.
 
     :param delivery_id: ID of the delivery to retrieve.
-    :return: Delivery model instance
+    :param refresh: True to read the delivery from database even if it is cached
+    :return: tuple of state and courier ID of the delivery
     """
-    delivery = Delivery.objects.get(id=delivery_id)
+    try:
+        key = delivery_key(delivery_id)
+    except ValueError:
+        # Not cached, database raises the validation error of the ID
+        return await get_delivery(delivery_id)
+    delivery = None if refresh else delivery_cache.get(key)
+    if delivery is None:
+        delivery = await get_delivery(key)
+        delivery_cache.set(key, delivery)
     return delivery
 
 
+def encode_position(position):
+    """
+    Encode position of a courier into a binary frame.
+
+    :param position: Position of the courier with courier_id
+    :return: msgpack array of the 16 bytes of the courier ID, latitude and longitude
+    """
+    return msgpack.packb([uuid.UUID(position['courier_id']).bytes, position['latitude'], position['longitude']])
+
+
+def decode_position(frame):
+    """
+    Decode position sent by a courier in a binary frame.
+
+    :param frame: msgpack array of latitude and longitude
+    :return: Position of the courier or None if the frame is malformed
+    """
+    try:
+        latitude, longitude = msgpack.unpackb(frame)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        return None
+    return {'latitude': latitude, 'longitude': longitude}
+
+
 def validate_message(message):
     """
     Validate if message is properly formatted and contains valid coordinates.
@@ -45,11 +103,21 @@ def validate_message(message):
     return True
 
 
-class CourierConsumer(JsonWebsocketConsumer):
+class CourierConsumer(AsyncJsonWebsocketConsumer):
     """
     Websocket consumer to manage messages sent by couriers.
+    * Positions are broadcast to the group of the delivery, the group of the map tile of the courier
+      and group_ALL only if the legacy COURIER_GLOBAL_GROUP stream is enabled - it is disabled by default.
+    * Listeners receive positions of couriers on their map by subscribing to a viewport.
+    * Positions sent by the courier are stored in the location index and coalesced before they are broadcast,
+      see PositionCoalescer.
+    * Positions sent by the courier of a delivery are written to the track of the delivery in bulk, see TrackWriter.
+    * Clients negotiating BINARY_SUBPROTOCOL exchange positions in binary frames, errors are always sent as JSON.
+      Broadcast positions are encoded once per broadcast, not once per listener.
+    * The consumer runs on the event loop, the database is touched only by delivery lookups - on connect if
+      the delivery is not cached, and again before a connection or a position is rejected.
     """
-    def connect(self):
+    async def connect(self):
         """
         Receive a websocket connection and decide which groups it belongs to.
         """
@@ -60,16 +128,47 @@ class CourierConsumer(JsonWebsocketConsumer):
             self.group_name = 'group_%s' % self.group_id
         except KeyError:
             self.group_name = 'group_ALL'
-        self.accept()
+        self.tiles = set()
+        self.coalescer = PositionCoalescer()
+        self.flush_task = None
+        self.binary = BINARY_SUBPROTOCOL in self.scope.get('subprotocols', ())
+        await self.accept(BINARY_SUBPROTOCOL if self.binary else None)
         if self.group_name == 'group_ALL':
-            self.join_all_group()
-        elif self.join_delivery_group():
-            if self.delivery.courier == self.scope['user']:
-                self.join_all_group()
+            await self.join_all_group()
+        elif await self.join_delivery_group():
+            if await self.is_delivery_courier(self.scope['user']):
+                await self.join_all_group()
         else:
-            self.close()
+            await self.close()
 
-    def join_delivery_group(self):
+    async def load_delivery(self, allowed):
+        """
+        Retrieve state and courier of the delivery of the connection.
+        * Only allowed deliveries are served from the cache, otherwise the delivery is read again from database -
+          the cached entry can be stale if the delivery changed in another process.
+
+        :param allowed: function of the state and courier ID of the delivery deciding whether it is allowed
+        :return: True if the delivery is allowed
+        """
+        delivery = await get_cached_delivery(self.group_id)
+        if not allowed(*delivery):
+            delivery = await get_cached_delivery(self.group_id, refresh=True)
+        self.delivery_courier_id = delivery[1]
+        return allowed(*delivery)
+
+    async def is_delivery_courier(self, user):
+        """
+        Check whether a user is the courier of the delivery of the connection.
+
+        :param user: Account instance or AnonymousUser
+        :return: True if the user is the courier of the delivery
+        """
+        if user.is_anonymous or not user.courier_id:
+            return False
+        return self.delivery_courier_id == user.id or \
+            await self.load_delivery(lambda state, courier_id: courier_id == user.id)
+
+    async def join_delivery_group(self):
         """
         Attempt to join delivery group.
 
@@ -77,51 +176,80 @@ class CourierConsumer(JsonWebsocketConsumer):
         """
         try:
             # Try to join delivery group
-            self.delivery = get_delivery(self.group_id)
-            if not (self.delivery.state == DeliveryState.DELIVERING or self.delivery.state == DeliveryState.ASSIGNED):
-                self.send_json({
+            if not await self.load_delivery(
+                    lambda state, courier_id: state == DeliveryState.DELIVERING or state == DeliveryState.ASSIGNED):
+                await self.send_json({
                     'errors': ['Delivery is not being transported']
                 })
                 return False
             else:
                 # Join delivery group
-                async_to_sync(self.channel_layer.group_add)(
+                await self.channel_layer.group_add(
                     self.group_name,
                     self.channel_name
                 )
                 return True
         except Delivery.DoesNotExist:
-            self.send_json({
+            await self.send_json({
                 'errors': ['Delivery with given ID does not exist']
             })
             return False
         except ValidationError as e:
-            self.send_json({
+            await self.send_json({
                 'errors': e.messages
             })
             return False
 
-    def join_all_group(self):
+    async def join_all_group(self):
         """
         Join global group.
         """
-        async_to_sync(self.channel_layer.group_add)(
+        if not COURIER_GLOBAL_GROUP:
+            return
+        await self.channel_layer.group_add(
             'group_ALL',
             self.channel_name
         )
 
-    def disconnect(self, close_code):
+    async def subscribe_viewport(self, viewport):
+        """
+        Replace subscribed tiles with the tiles covering a viewport - global group is left after the first
+        subscription.
+
+        :param viewport: dictionary with 'south', 'west', 'north' and 'east' coordinates of the viewport
+        """
+        try:
+            tiles = set(viewport_tiles(viewport))
+        except ValueError as e:
+            await self.send_json({
+                'errors': [str(e)]
+            })
+            return
+        changes = [self.channel_layer.group_discard(tile_group(key), self.channel_name) for key in self.tiles - tiles]
+        changes += [self.channel_layer.group_add(tile_group(key), self.channel_name) for key in tiles - self.tiles]
+        if COURIER_GLOBAL_GROUP and not self.tiles:
+            changes.append(self.channel_layer.group_discard('group_ALL', self.channel_name))
+        await asyncio.gather(*changes)
+        self.tiles = tiles
+        await self.send_json({
+            'subscribed': sorted(tiles)
+        })
+
+    async def disconnect(self, close_code):
         """
         Leave groups before disconnecting.
 
         :param close_code: Websocket status code on closing the connection.
         """
-        async_to_sync(self.channel_layer.group_discard)(
-            self.group_name,
-            self.channel_name
+        if getattr(self, 'coalescer', None):
+            await self.flush_pending()
+        await asyncio.gather(
+            self.channel_layer.group_discard(self.group_name, self.channel_name),
+            *(self.channel_layer.group_discard(tile_group(key), self.channel_name)
+              for key in getattr(self, 'tiles', ())),
         )
 
-    def receive(self, text_data=None, bytes_data=None, **kwargs):
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
         """
         Receive message from socket.
 
@@ -131,59 +259,105 @@ class CourierConsumer(JsonWebsocketConsumer):
         """
         if text_data:
             try:
-                self.receive_json(self.decode_json(text_data), **kwargs)
+                content = await self.decode_json(text_data)
             except json.decoder.JSONDecodeError:
-                self.send_json({'errors': ['Not a valid JSON']})
+                await self.send_json({'errors': ['Not a valid JSON']})
+                return
+            await self.receive_json(content, **kwargs)
+        elif bytes_data and self.binary:
+            content = decode_position(bytes_data)
+            if content is None:
+                await self.send_json(FORMAT_ERROR_MESSAGE)
+                return
+            await self.receive_json(content, **kwargs)
         else:
-            self.send_json({
+            await self.send_json({
                 'errors': ['Not text section in websocket message']
             })
 
-    def receive_json(self, content, **kwargs):
+    async def receive_json(self, content, **kwargs):
         """
         Receive JSON content of a message from socket.
 
         :param content: Text section of the message.
         :param kwargs: Additional arguments
         """
+        if isinstance(content, dict) and 'viewport' in content:
+            await self.subscribe_viewport(content['viewport'])
+            return
         user = self.scope["user"]
-        if user.is_anonymous or not user.courier:
-            self.send_json({
+        if user.is_anonymous or not user.courier_id:
+            await self.send_json({
                 'errors': ['Only courier can post to websocket']
             })
-        elif self.group_name != 'group_ALL' and self.delivery.courier != user:
-            self.send_json({
+        elif self.group_name != 'group_ALL' and not await self.is_delivery_courier(user):
+            await self.send_json({
                 'errors': ['Only courier of this delivery can post to websocket']
             })
         else:
             if not validate_message(content):
-                self.send_json(FORMAT_ERROR_MESSAGE)
+                await self.send_json(FORMAT_ERROR_MESSAGE)
                 return
             content["courier_id"] = str(user.id)
-            # Send couriers position to delivery group
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
-                {
-                    'type': 'courier_position',
-                    'message': content
-                }
-            )
+            await locations.aupdate(content["courier_id"], content['latitude'], content['longitude'],
+                                    user.courier.vehicle_type)
             if self.group_name != 'group_ALL':
-                # Send couriers position to group ALL
-                async_to_sync(self.channel_layer.group_send)(
-                    'group_ALL',
-                    {
-                        'type': 'courier_position',
-                        'message': content
-                    }
-                )
+                await track_writer.add(self.group_id, content['latitude'], content['longitude'], time.time())
+            position = self.coalescer.offer(content, time.monotonic())
+            if position is not None:
+                await self.publish(position)
+            elif self.flush_task is None:
+                self.flush_task = asyncio.ensure_future(self.delayed_flush(self.coalescer.delay(time.monotonic())))
 
-    def courier_position(self, event):
+    async def delayed_flush(self, delay):
+        """
+        Publish the pending position of the courier after a delay.
+
+        :param delay: Seconds to wait
+        """
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        await self.flush_pending()
+
+    async def flush_pending(self):
+        """
+        Publish the pending position of the courier, if there is one.
+        """
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        position = self.coalescer.flush(time.monotonic())
+        if position is not None:
+            await self.publish(position)
+
+    async def publish(self, position):
+        """
+        Broadcast position of the courier to the groups of its tile and delivery concurrently.
+
+        :param position: Position of the courier with courier_id
+        """
+        groups = [tile_group(position_tile(position['latitude'], position['longitude']))]
+        if self.group_name != 'group_ALL':
+            # Send couriers position to delivery group
+            groups.append(self.group_name)
+        if COURIER_GLOBAL_GROUP:
+            # Send couriers position to group ALL
+            groups.append('group_ALL')
+        event = {
+            'type': 'courier_position',
+            'text': await self.encode_json(position),
+            'bytes': encode_position(position)
+        }
+        await asyncio.gather(*(self.channel_layer.group_send(group, event) for group in groups))
+
+    async def courier_position(self, event):
         """
         Send message from group to socket.
 
-        :param event: Wrapper of the message.
+        :param event: Wrapper of the message with the position encoded as JSON text and as a binary frame.
         """
-        content = event['message']
         # Send message to WebSocket
-        self.send_json(content)
+        if self.binary:
+            await self.send(bytes_data=event['bytes'])
+        else:
+            await self.send(text_data=event['text'])
@@ -5,32 +5,50 @@ from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import UntypedToken
 from accounts.models import Account
 from channels.middleware import BaseMiddleware
 from channels.auth import AuthMiddlewareStack
-from django.db import close_old_connections
 from urllib.parse import parse_qs
-from jwt import decode as jwt_decode
-from django.conf import settings
+
+from couriers.websockets.cache import user_cache
 
 
 @database_sync_to_async
-def get_user(validated_token):
+def get_user(user_id):
     """
-    Retrieve user from database based on validated JWT token.
+    Retrieve user from database.
+    * database_sync_to_async closes old database connections around the query.
+    * Courier of the user is loaded with the user, so it can be used on the event loop.
 
-    :param validated_token: JWT token that is valid
+    :param user_id: ID of the user from a validated JWT token
     :return: User the owns the token or AnonymousUser if not found
     """
     try:
-        user = get_user_model().objects.get(id=validated_token["user_id"])
+        user = get_user_model().objects.select_related('courier').get(id=user_id)
         return user
 
     except Account.DoesNotExist:
         return AnonymousUser()
 
 
+async def get_cached_user(user_id):
+    """
+    Retrieve user from the cache, or from database if not cached.
+
+    :param user_id: ID of the user from a validated JWT token
+    :return: User the owns the token or AnonymousUser if not found
+    """
+    user_id = str(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await get_user(user_id)
+        if not user.is_anonymous:
+            user_cache.set(user_id, user)
+    return user
+
+
 class JwtAuthMiddleware(BaseMiddleware):
     """
     Middleware to authenticate user when opening a websocket connection.
@@ -42,10 +60,8 @@ class JwtAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
         """
         Authenticate user before moving on to the parent call method.
+        * Token is verified only once and users of reconnecting sockets are served from the cache.
         """
-        # Close old database connections to prevent usage of timed out connections
-        close_old_connections()
-
         try:
             # Get the token
             token = parse_qs(scope["query_string"].decode("utf8"))["token"][0]
@@ -56,7 +72,7 @@ class JwtAuthMiddleware(BaseMiddleware):
         # Try to authenticate the user
         try:
             # This will automatically validate the token and raise an error if token is invalid
-            UntypedToken(token)
+            validated_token = UntypedToken(token)
         except (InvalidToken, TokenError):
             # Token is invalid
             await send({
@@ -71,9 +87,7 @@ class JwtAuthMiddleware(BaseMiddleware):
             )
             return None
         else:
-            #  Then token is valid, decode it
-            decoded_data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            # Will return a dictionary like -
+            # Payload of the token is already decoded, e.g.
             # {
             #     "token_type": "access",
             #     "exp": 1568770772,
@@ -82,7 +96,7 @@ class JwtAuthMiddleware(BaseMiddleware):
             # }
 
             # Get the user using ID
-            scope["user"] = await get_user(validated_token=decoded_data)
+            scope["user"] = await get_cached_user(validated_token[api_settings.USER_ID_CLAIM])
         return await super().__call__(scope, receive, send)
 
 
@@ -0,0 +1,353 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+import redis
+from asgiref.sync import sync_to_async
+
+from bpproject.settings import (COURIER_LOCATION_CELL, COURIER_LOCATION_KEY, COURIER_LOCATION_RADIUS,
+                                COURIER_LOCATION_STORE, COURIER_LOCATION_TTL, REDIS_HOST, REDIS_PORT)
+from deliveries.routing.road_graph import haversine
+from helpers.enums import VEHICLE_SIZES
+
+logger = logging.getLogger('poslito')
+
+METERS_PER_DEGREE = 111320
+# Redis GEO sets only index latitudes up to this value
+GEO_MAX_LATITUDE = 85.05112878
+# Removes up to ARGV[2] couriers whose position is older than ARGV[1] from the positions, times and vehicles keys
+PURGE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+    redis.call('ZREM', KEYS[2], unpack(expired))
+    redis.call('HDEL', KEYS[3], unpack(expired))
+end
+return #expired
+"""
+
+
+def vehicle_types_for(size):
+    """
+    Get vehicle types able to carry an item of a size.
+
+    :param size: SizeType of the item
+    :return: set of vehicle types
+    """
+    return {vehicle_type for vehicle_type, sizes in VEHICLE_SIZES.items() if size in sizes}
+
+
+class LocationStore:
+    """
+    Thread safe in-process index of the last known positions of couriers.
+    * Positions are bucketed into a grid of cells of cell degrees, queries search the cells in rings
+      around the point until no closer courier can be found.
+    * Positions older than ttl seconds are ignored by queries and purged once every ttl seconds.
+    * Only positions received by this process are found, used when COURIER_LOCATION_STORE is local.
+    """
+    def __init__(self, cell=COURIER_LOCATION_CELL, ttl=COURIER_LOCATION_TTL, radius=COURIER_LOCATION_RADIUS):
+        """
+        Initialize store.
+
+        :param cell: Size of grid cells in degrees
+        :param ttl: Number of seconds a position of a courier stays valid
+        :param radius: Maximum distance of couriers found by queries in meters
+        """
+        self.cell = cell
+        self.columns = round(360 / cell)
+        self.ttl = ttl
+        self.radius = radius
+        # courier ID -> (latitude, longitude, vehicle type, timestamp, cell)
+        self.positions = {}
+        # cell -> set of courier IDs
+        self.cells = {}
+        self.purged_at = 0
+        self.lock = threading.Lock()
+
+    def cell_of(self, latitude, longitude):
+        """
+        Get the grid cell of coordinates - columns wrap around the antimeridian.
+
+        :return: tuple of row and column of the cell
+        """
+        return math.floor(latitude / self.cell), math.floor((longitude + 180) / self.cell) % self.columns
+
+    def update(self, courier_id, latitude, longitude, vehicle_type, now=None):
+        """
+        Store the last position of a courier.
+
+        :param courier_id: ID of the courier
+        :param latitude: Latitude of the courier
+        :param longitude: Longitude of the courier
+        :param vehicle_type: SizeType of the vehicle of the courier
+        :param now: Time of the position as a unix timestamp, current time if None
+        """
+        now = time.time() if now is None else now
+        cell = self.cell_of(latitude, longitude)
+        with self.lock:
+            previous = self.positions.get(courier_id)
+            if previous is not None and previous[4] != cell:
+                self._discard(previous[4], courier_id)
+            self.positions[courier_id] = (latitude, longitude, vehicle_type, now, cell)
+            self.cells.setdefault(cell, set()).add(courier_id)
+            if now - self.purged_at >= self.ttl:
+                self._purge(now)
+
+    async def aupdate(self, courier_id, latitude, longitude, vehicle_type):
+        """
+        Store the last position of a courier from a coroutine.
+        """
+        self.update(courier_id, latitude, longitude, vehicle_type)
+
+    def remove(self, courier_id):
+        """
+        Remove the position of a courier.
+
+        :param courier_id: ID of the courier
+        """
+        with self.lock:
+            previous = self.positions.pop(courier_id, None)
+            if previous is not None:
+                self._discard(previous[4], courier_id)
+
+    def clear(self):
+        """
+        Remove all positions.
+        """
+        with self.lock:
+            self.positions.clear()
+            self.cells.clear()
+
+    def _discard(self, cell, courier_id):
+        couriers = self.cells.get(cell)
+        if couriers is not None:
+            couriers.discard(courier_id)
+            if not couriers:
+                del self.cells[cell]
+
+    def _purge(self, now):
+        for courier_id, position in list(self.positions.items()):
+            if now - position[3] > self.ttl:
+                del self.positions[courier_id]
+                self._discard(position[4], courier_id)
+        self.purged_at = now
+
+    def _ring(self, row, column, distance):
+        """
+        Get cells at a Chebyshev distance from a cell.
+        """
+        if distance == 0:
+            return [(row, column)]
+        cells = []
+        for offset in range(-distance, distance + 1):
+            cells.append((row - distance, (column + offset) % self.columns))
+            cells.append((row + distance, (column + offset) % self.columns))
+        for offset in range(-distance + 1, distance):
+            cells.append((row + offset, (column - distance) % self.columns))
+            cells.append((row + offset, (column + distance) % self.columns))
+        return cells
+
+    def nearest(self, latitude, longitude, k=10, vehicle_types=None, now=None):
+        """
+        Find the k nearest couriers with a valid position within radius of a point.
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param k: Maximum number of couriers
+        :param vehicle_types: Collection of accepted vehicle types, all if None
+        :param now: Current time as a unix timestamp, current time if None
+        :return: list of dictionaries with courier_id, latitude, longitude, vehicle_type, distance in meters
+                 and updated_at, ordered by distance
+        """
+        now = time.time() if now is None else now
+        row, column = self.cell_of(latitude, longitude)
+        # Lower bound of the width of cells within radius - longitudes get closer towards the poles
+        max_latitude = min(abs(latitude) + self.radius / METERS_PER_DEGREE + self.cell, 90)
+        cell_width = max(self.cell * METERS_PER_DEGREE * math.cos(math.radians(max_latitude)), 1)
+        rings = math.ceil(self.radius / cell_width) + 1
+        # max heap of (-distance, courier ID, position) of the k nearest couriers
+        found = []
+
+        def consider(courier_id):
+            position = self.positions[courier_id]
+            if now - position[3] > self.ttl:
+                return
+            if vehicle_types is not None and position[2] not in vehicle_types:
+                return
+            distance = haversine(latitude, longitude, position[0], position[1])
+            if distance > self.radius:
+                return
+            if len(found) < k:
+                heapq.heappush(found, (-distance, courier_id, position))
+            elif distance < -found[0][0]:
+                heapq.heapreplace(found, (-distance, courier_id, position))
+
+        with self.lock:
+            if k <= 0:
+                pass
+            elif (2 * rings + 1) ** 2 >= len(self.cells) or 2 * rings + 1 >= self.columns:
+                # Fewer occupied cells than cells to search, scan all of them
+                for courier_id in self.positions:
+                    consider(courier_id)
+            else:
+                for distance in range(rings + 1):
+                    # Couriers in the ring are at least distance - 1 whole cells away
+                    if len(found) == k and (distance - 1) * cell_width > -found[0][0]:
+                        break
+                    for cell in self._ring(row, column, distance):
+                        for courier_id in self.cells.get(cell, ()):
+                            consider(courier_id)
+        return [{
+            'courier_id': courier_id,
+            'latitude': position[0],
+            'longitude': position[1],
+            'vehicle_type': position[2],
+            'distance': -distance,
+            'updated_at': datetime.fromtimestamp(position[3], timezone.utc),
+        } for distance, courier_id, position in sorted(found, reverse=True)]
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class RedisLocationStore:
+    """
+    Index of the last known positions of couriers shared by all processes through Redis.
+    * Positions are kept in a GEO set, their unix timestamps in a sorted set and vehicle types in a hash,
+      queries search the GEO set with GEOSEARCH, so Redis 6.2 or newer is required.
+    * Positions older than ttl seconds are ignored by queries and purged once every ttl seconds by each process.
+    * Positions with a latitude beyond GEO_MAX_LATITUDE are not stored.
+    """
+    PURGE_BATCH = 1000
+
+    def __init__(self, client, key=COURIER_LOCATION_KEY, ttl=COURIER_LOCATION_TTL, radius=COURIER_LOCATION_RADIUS):
+        """
+        Initialize store.
+
+        :param client: Redis client decoding responses
+        :param key: Prefix of the Redis keys
+        :param ttl: Number of seconds a position of a courier stays valid
+        :param radius: Maximum distance of couriers found by queries in meters
+        """
+        self.client = client
+        self.positions_key = f'{key}:positions'
+        self.times_key = f'{key}:times'
+        self.vehicles_key = f'{key}:vehicles'
+        self.keys = [self.positions_key, self.times_key, self.vehicles_key]
+        self.ttl = ttl
+        self.radius = radius
+        self.purged_at = 0
+        self.purge_script = client.register_script(PURGE_SCRIPT)
+
+    def update(self, courier_id, latitude, longitude, vehicle_type, now=None):
+        """
+        Store the last position of a courier.
+
+        :param courier_id: ID of the courier
+        :param latitude: Latitude of the courier
+        :param longitude: Longitude of the courier
+        :param vehicle_type: SizeType of the vehicle of the courier
+        :param now: Time of the position as a unix timestamp, current time if None
+        """
+        if abs(latitude) > GEO_MAX_LATITUDE:
+            return
+        now = time.time() if now is None else now
+        with self.client.pipeline() as pipeline:
+            pipeline.geoadd(self.positions_key, [longitude, latitude, courier_id])
+            pipeline.zadd(self.times_key, {courier_id: now})
+            pipeline.hset(self.vehicles_key, courier_id, vehicle_type)
+            pipeline.execute()
+        if now - self.purged_at >= self.ttl:
+            self.purged_at = now
+            self.purge_script(keys=self.keys, args=[f'({now - self.ttl}', self.PURGE_BATCH])
+
+    async def aupdate(self, courier_id, latitude, longitude, vehicle_type):
+        """
+        Store the last position of a courier from a coroutine without blocking the event loop.
+        * Errors of Redis are logged, the position is lost.
+        """
+        try:
+            await sync_to_async(self.update, thread_sensitive=False)(courier_id, latitude, longitude, vehicle_type)
+        except redis.RedisError:
+            logger.exception("Position of courier %s not stored", courier_id)
+
+    def remove(self, courier_id):
+        """
+        Remove the position of a courier.
+
+        :param courier_id: ID of the courier
+        """
+        with self.client.pipeline() as pipeline:
+            pipeline.zrem(self.positions_key, courier_id)
+            pipeline.zrem(self.times_key, courier_id)
+            pipeline.hdel(self.vehicles_key, courier_id)
+            pipeline.execute()
+
+    def clear(self):
+        """
+        Remove all positions.
+        """
+        self.client.delete(*self.keys)
+
+    def nearest(self, latitude, longitude, k=10, vehicle_types=None, now=None):
+        """
+        Find the k nearest couriers with a valid position within radius of a point.
+        * Couriers are searched in batches growing until k valid couriers are found or the radius is exhausted.
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param k: Maximum number of couriers
+        :param vehicle_types: Collection of accepted vehicle types, all if None
+        :param now: Current time as a unix timestamp, current time if None
+        :return: list of dictionaries with courier_id, latitude, longitude, vehicle_type, distance in meters
+                 and updated_at, ordered by distance
+        """
+        now = time.time() if now is None else now
+        if k <= 0 or abs(latitude) > GEO_MAX_LATITUDE:
+            return []
+        count = k
+        while True:
+            results = self.client.geosearch(self.positions_key, longitude=longitude, latitude=latitude,
+                                            radius=self.radius, unit='m', sort='ASC', count=count,
+                                            withdist=True, withcoord=True)
+            if not results:
+                return []
+            courier_ids = [courier_id for courier_id, _, _ in results]
+            with self.client.pipeline(transaction=False) as pipeline:
+                pipeline.zmscore(self.times_key, courier_ids)
+                pipeline.hmget(self.vehicles_key, courier_ids)
+                times, vehicles = pipeline.execute()
+            found = [{
+                'courier_id': courier_id,
+                'latitude': coordinates[1],
+                'longitude': coordinates[0],
+                'vehicle_type': vehicle_type,
+                'distance': distance,
+                'updated_at': datetime.fromtimestamp(timestamp, timezone.utc),
+            } for (courier_id, distance, coordinates), timestamp, vehicle_type in zip(results, times, vehicles)
+                if timestamp is not None and now - timestamp <= self.ttl
+                and (vehicle_types is None or vehicle_type in vehicle_types)]
+            if len(found) >= k or len(results) < count:
+                return found[:k]
+            count *= 4
+
+    def __len__(self):
+        return self.client.zcard(self.times_key)
+
+
+def location_store():
+    """
+    Create the store of courier positions selected by COURIER_LOCATION_STORE.
+
+    :return: RedisLocationStore shared by all processes, LocationStore of this process if the store is local
+    """
+    if COURIER_LOCATION_STORE == 'local':
+        return LocationStore()
+    return RedisLocationStore(redis.Redis(REDIS_HOST, REDIS_PORT, decode_responses=True))
+
+
+# Positions of couriers
+locations = location_store()
@@ -0,0 +1,84 @@
+import math
+
+from bpproject.settings import COURIER_TILE_ZOOM, COURIER_TILES_MAX
+
+MAX_LATITUDE = 85.05112878  # web mercator tiles do not cover the poles
+
+
+def tile_xy(latitude, longitude, zoom=COURIER_TILE_ZOOM):
+    """
+    Find the web mercator tile containing a position.
+
+    :param latitude: latitude of the position
+    :param longitude: longitude of the position
+    :param zoom: zoom level of the tile grid
+    :return: tuple of x and y coordinates of the tile
+    """
+    count = 2 ** zoom
+    latitude = min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE)
+    sin = math.sin(math.radians(latitude))
+    x = int((longitude + 180) / 360 * count)
+    y = int((0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * count)
+    return min(max(x, 0), count - 1), min(max(y, 0), count - 1)
+
+
+def quadkey(x, y, zoom=COURIER_TILE_ZOOM):
+    """
+    Encode tile coordinates as a quadkey - tiles of one area share the prefix of their quadkeys.
+
+    :param x: x coordinate of the tile
+    :param y: y coordinate of the tile
+    :param zoom: zoom level of the tile grid
+    :return: string of zoom digits 0-3
+    """
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
+
+
+def position_tile(latitude, longitude, zoom=COURIER_TILE_ZOOM):
+    """
+    Find quadkey of the tile containing a position.
+
+    :return: quadkey of the tile
+    """
+    return quadkey(*tile_xy(latitude, longitude, zoom), zoom)
+
+
+def viewport_tiles(viewport, zoom=COURIER_TILE_ZOOM):
+    """
+    Find tiles covering a viewport of a map.
+    * Viewports crossing the antimeridian have west greater than east.
+
+    :param viewport: dictionary with 'south', 'west', 'north' and 'east' keys
+    :param zoom: zoom level of the tile grid
+    :return: list of quadkeys of the tiles
+    :raise ValueError: if the viewport is invalid or covers more than COURIER_TILES_MAX tiles
+    """
+    try:
+        south, west, north, east = (float(viewport[side]) for side in ('south', 'west', 'north', 'east'))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Viewport has to contain south, west, north and east coordinates')
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError('Viewport coordinates are out of range')
+    left, top = tile_xy(north, west, zoom)
+    right, bottom = tile_xy(south, east, zoom)
+    if west <= east:
+        columns = list(range(left, right + 1))
+    else:
+        columns = list(range(left, 2 ** zoom)) + list(range(0, right + 1))
+    if len(columns) * (bottom - top + 1) > COURIER_TILES_MAX:
+        raise ValueError('Viewport is too large, zoom in to see couriers')
+    return [quadkey(x, y, zoom) for x in columns for y in range(top, bottom + 1)]
+
+
+def tile_group(key):
+    """
+    Name of the channel layer group of a tile.
+
+    :param key: quadkey of the tile
+    :return: group name
+    """
+    return f'tile_{key}'
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from channels.db import database_sync_to_async
+from django.contrib.gis.geos import LineString
+from django.db import DatabaseError
+
+from bpproject.settings import TRACK_FLUSH_INTERVAL, TRACK_FLUSH_POINTS
+from deliveries.models import DeliveryTrackSegment
+
+logger = logging.getLogger('poslito')
+
+
+@database_sync_to_async
+def write_segments(tracks):
+    """
+    Write buffered positions to the database with one multi-row insert, one segment per delivery.
+
+    :param tracks: dictionary of delivery ID -> list of (longitude, latitude, timestamp) ordered by time
+    """
+    segments = []
+    for delivery_id, positions in tracks.items():
+        if len(positions) == 1:
+            # Line needs two points, replay drops the repeated position
+            positions = positions * 2
+        segments.append(DeliveryTrackSegment(
+            delivery_id=delivery_id,
+            started_at=datetime.fromtimestamp(positions[0][2], timezone.utc),
+            path=LineString(positions, srid=4326),
+        ))
+    try:
+        DeliveryTrackSegment.objects.bulk_create(segments)
+    except DatabaseError as e:
+        logger.error(f'Writing {len(segments)} track segments failed: {e}')
+
+
+class TrackWriter:
+    """
+    Buffer of positions of couriers that writes them to the tracks of their deliveries in bulk.
+    * Positions are written every interval seconds, or once max_points positions are buffered.
+    * Buffered positions are lost if the process is killed before they are written.
+    """
+    def __init__(self, interval=TRACK_FLUSH_INTERVAL, max_points=TRACK_FLUSH_POINTS):
+        """
+        Initialize writer.
+
+        :param interval: Maximum number of seconds a position stays in the buffer
+        :param max_points: Maximum number of buffered positions
+        """
+        self.interval = interval
+        self.max_points = max_points
+        # delivery ID -> list of (longitude, latitude, timestamp)
+        self.tracks = defaultdict(list)
+        self.points = 0
+        self.flush_task = None
+
+    async def add(self, delivery_id, latitude, longitude, timestamp):
+        """
+        Buffer a position of the courier of a delivery.
+
+        :param delivery_id: ID of the delivery
+        :param latitude: Latitude of the courier
+        :param longitude: Longitude of the courier
+        :param timestamp: Time of the position as a unix timestamp
+        """
+        self.tracks[delivery_id].append((longitude, latitude, timestamp))
+        self.points += 1
+        if self.points >= self.max_points:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.delayed_flush())
+
+    async def delayed_flush(self):
+        """
+        Write buffered positions after the interval.
+        """
+        await asyncio.sleep(self.interval)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Write all buffered positions.
+        """
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        tracks, self.tracks, self.points = self.tracks, defaultdict(list), 0
+        if tracks:
+            await write_segments(tracks)
+
+
+# Positions of couriers connected to this process waiting to be written
+track_writer = TrackWriter()
@@ -0,0 +1,176 @@
+import csv
+import io
+
+from django.contrib.gis.geos import Point
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from accounts.models import Account, Person
+from deliveries.api.google_api import get_distances
+from deliveries.api.serializers import DeliverySerializer
+from deliveries.api.statistics import record_created_many
+from deliveries.api.timeline import create_timelines
+from deliveries.models import Delivery, Item, Place
+from deliveries.routing.base import RoutingError
+from helpers.functions import blind_index, calculate_price, person_fingerprint
+from jobs.queue import enqueue_many
+
+
+def read_csv(stream, encoding='utf-8-sig'):
+    """
+    Read rows of a CSV file - the first line is the header with names of the columns.
+
+    :param stream: file-like object with the content of the file
+    :param encoding: encoding of the file, a byte order mark written by spreadsheets is skipped by default
+    :return: list of dictionaries of column names and values
+    """
+    try:
+        return list(csv.DictReader(io.StringIO(stream.read().decode(encoding))))
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ParseError(f'CSV parse error - {e}')
+
+
+class CSVParser(BaseParser):
+    """
+    Parser of text/csv request bodies into a list of rows, see read_csv.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return []
+        return read_csv(stream)
+
+
+def nest(row):
+    """
+    Convert dotted keys of a flat row to nested dictionaries - {'item.name': ...} to {'item': {'name': ...}}.
+    * Empty values are left out, so optional fields of empty CSV cells get their defaults.
+
+    :param row: dictionary of a row
+    :return: nested dictionary
+    """
+    nested = {}
+    for key, value in row.items():
+        if value is None or value == '':
+            continue
+        *parents, name = str(key).split('.')
+        target = nested
+        for parent in parents:
+            target = target.setdefault(parent, {})
+            if not isinstance(target, dict):
+                break
+        else:
+            target[name] = value
+    return nested
+
+
+def resolve_distances(rows):
+    """
+    Retrieve route distances and durations of validated rows with one batched matrix request per pickup place.
+
+    :param rows: list of validated data of deliveries
+    :return: dictionary of (pickup place ID, delivery place ID) -> tuple of distance and duration objects,
+             or error message if the route can't be found
+    """
+    origins = {}
+    for data in rows:
+        origin, destinations = origins.setdefault(data['pickup_place']['place_id'], (data['pickup_place'], {}))
+        destinations[data['delivery_place']['place_id']] = data['delivery_place']
+    distances = {}
+    for origin_id, (origin, destinations) in origins.items():
+        destinations = list(destinations.values())
+        try:
+            pairs = get_distances(origin, destinations)
+        except RoutingError as e:
+            pairs = [str(e)] * len(destinations)
+        for destination, pair in zip(destinations, pairs):
+            distances[origin_id, destination['place_id']] = pair or 'No route between the places'
+    return distances
+
+
+def resolve_places(places):
+    """
+    Retrieve places by their IDs with one query, missing places are created with one insert.
+
+    :param places: list of validated data of places
+    :return: dictionary of place IDs and Place instances
+    """
+    places = {place['place_id']: place for place in places}
+    existing = Place.objects.in_bulk(list(places))
+    missing = [
+        Place(coordinates=Point(place['longitude'], place['latitude'], srid=4326),
+              **{field: value for field, value in place.items() if field not in ('latitude', 'longitude')})
+        for place_id, place in places.items() if place_id not in existing
+    ]
+    Place.objects.bulk_create(missing, ignore_conflicts=True)
+    existing.update({place.place_id: place for place in missing})
+    return existing
+
+
+def create_deliveries(rows, sender):
+    """
+    Create deliveries of a sender from many rows at once, they start in the 'ready' state.
+    * All rows are validated first, only valid rows with a route between their places are created.
+    * Receivers, their accounts and places are resolved with set based queries, items, deliveries and timeline rows
+      are inserted with one query each.
+    * Routes and receiver emails are created by background jobs once the deliveries are committed.
+
+    :param rows: list of deliveries - dictionaries in the format of the body of a new delivery, nested or
+                 with dotted keys
+    :param sender: Person instance of the sender
+    :return: list of results of the rows - dictionaries with the index of the row, HTTP status and the created
+             delivery or errors
+    """
+    results = [None] * len(rows)
+    valid = []
+    for index, row in enumerate(rows):
+        serializer = DeliverySerializer(data=nest(row) if isinstance(row, dict) else row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'row': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+
+    distances = resolve_distances([data for _, data in valid])
+    routable = []
+    for index, data in valid:
+        distance = distances[data['pickup_place']['place_id'], data['delivery_place']['place_id']]
+        if isinstance(distance, str):
+            results[index] = {'row': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': {'error': distance}}
+        else:
+            routable.append((index, data, distance))
+
+    if routable:
+        people = Person.objects.resolve_many([data['receiver'] for _, data, _ in routable])
+        accounts = dict(Account.objects.filter(email__in={data['receiver']['email'] for _, data, _ in routable})
+                        .values_list('email_index', 'id'))
+        places = resolve_places([place for _, data, _ in routable
+                                 for place in (data['pickup_place'], data['delivery_place'])])
+        items = Item.objects.bulk_create([Item(**data['item']) for _, data, _ in routable])
+        deliveries = []
+        for (index, data, (distance, duration)), item in zip(routable, items):
+            pickup_place = places[data['pickup_place']['place_id']]
+            deliveries.append(Delivery(
+                item=item,
+                sender=sender,
+                receiver=people[person_fingerprint(**data['receiver'])],
+                receiver_account_id=accounts.get(blind_index(data['receiver']['email'])),
+                pickup_place=pickup_place,
+                delivery_place=places[data['delivery_place']['place_id']],
+                route_distance=distance['value'],
+                expected_duration=duration['value'],
+                price=calculate_price(distance['value'], item.size, item.weight),
+                pickup_coordinates=pickup_place.coordinates,
+                item_size=item.size,
+            ))
+        Delivery.objects.bulk_create(deliveries)
+        serialized = create_timelines(deliveries)
+        record_created_many(deliveries)
+        payloads = [{'delivery_id': str(delivery.id)} for delivery in deliveries]
+        enqueue_many('create_route', payloads)
+        enqueue_many('delivery_start_receiver_email', payloads)
+        for (index, _, _), data in zip(routable, serialized):
+            data['user_is'] = 'sender'
+            results[index] = {'row': index, 'status': status.HTTP_201_CREATED, 'delivery': data}
+    return results
@@ -0,0 +1,196 @@
+import logging
+import threading
+from collections import Counter
+
+from django.db import connection
+from django.utils import timezone
+
+from bpproject.settings import (DISTANCE_CACHE_SIZE, DISTANCE_CACHE_TTL, DISTANCE_CACHE_STALE_WHILE_REVALIDATE,
+                                DISTANCE_CACHE_STALE_TTL)
+from deliveries.models import PlaceDistance
+from helpers.classes import LRUCache
+
+logger = logging.getLogger('poslito')
+
+memory_cache = LRUCache(DISTANCE_CACHE_SIZE)
+stats = Counter()
+stats_lock = threading.Lock()
+refreshing = set()
+refreshing_lock = threading.Lock()
+
+
+def record(event):
+    """
+    Increment a cache counter.
+
+    :param event: name of the counter - memory_hit, database_hit, stale_hit, miss or refresh
+    """
+    with stats_lock:
+        stats[event] += 1
+
+
+def get_stats():
+    """
+    Retrieve the hit and miss counters of the distance cache in this process.
+
+    :return: dictionary of counter names and their values
+    """
+    with stats_lock:
+        return dict(stats)
+
+
+def is_fresh(fetched_at, now):
+    """
+    Check if a cache entry has not expired yet.
+
+    :param fetched_at: time the entry was retrieved from the routing backend
+    :param now: current time
+    :return: True if the entry is fresh, otherwise False
+    """
+    return now - fetched_at < DISTANCE_CACHE_TTL
+
+
+def is_servable_stale(fetched_at, now):
+    """
+    Check if an expired cache entry can still be served while it is refreshed.
+
+    :param fetched_at: time the entry was retrieved from the routing backend
+    :param now: current time
+    :return: True if the entry can be served, otherwise False
+    """
+    return DISTANCE_CACHE_STALE_WHILE_REVALIDATE and now - fetched_at < DISTANCE_CACHE_TTL + DISTANCE_CACHE_STALE_TTL
+
+
+def store(origin_id, destination_id, distance, duration):
+    """
+    Save distance and duration between two places to both cache tiers.
+
+    :param origin_id: Google place ID of the starting location
+    :param destination_id: Google place ID of the end location
+    :param distance: distance object with numerical and string representations
+    :param duration: duration object with numerical and string representations
+    """
+    entry, _ = PlaceDistance.objects.update_or_create(
+        origin_place_id=origin_id,
+        destination_place_id=destination_id,
+        defaults={'distance': distance, 'duration': duration}
+    )
+    memory_cache.set((origin_id, destination_id), (distance, duration, entry.updated_at))
+
+
+def refresh(origin, destination, fetch):
+    """
+    Refresh an expired cache entry in a background thread.
+    * Only one refresh of the same place pair runs at a time.
+
+    :param origin: starting place - dictionary with 'place_id' key
+    :param destination: end place - dictionary with 'place_id' key
+    :param fetch: function retrieving distance and duration from the routing backend
+    """
+    origin_id, destination_id = origin['place_id'], destination['place_id']
+    key = (origin_id, destination_id)
+    with refreshing_lock:
+        if key in refreshing:
+            return
+        refreshing.add(key)
+
+    def run():
+        try:
+            store(origin_id, destination_id, *fetch(origin, destination))
+            record('refresh')
+        except Exception:
+            logger.exception(f'Refreshing distance between {origin_id} and {destination_id} failed')
+        finally:
+            with refreshing_lock:
+                refreshing.discard(key)
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_cached_distance(origin, destination, fetch):
+    """
+    Retrieve distance and duration between two places from the in-process cache, then from the database
+    and only then from the routing backend.
+    * If stale-while-revalidate is enabled, expired entries are served while they are refreshed in the background.
+
+    :param origin: starting place - dictionary with 'place_id' key
+    :param destination: end place - dictionary with 'place_id' key
+    :param fetch: function retrieving distance and duration of two places from the routing backend
+    :return: tuple of distance and duration objects with numerical and string representations
+    """
+    origin_id, destination_id = origin['place_id'], destination['place_id']
+    now = timezone.now()
+    key = (origin_id, destination_id)
+    cached = memory_cache.get(key)
+    if cached:
+        distance, duration, fetched_at = cached
+        if is_fresh(fetched_at, now):
+            record('memory_hit')
+            return distance, duration
+        if is_servable_stale(fetched_at, now):
+            record('stale_hit')
+            refresh(origin, destination, fetch)
+            return distance, duration
+
+    entry = PlaceDistance.objects.filter(origin_place_id=origin_id, destination_place_id=destination_id).first()
+    if entry:
+        memory_cache.set(key, (entry.distance, entry.duration, entry.updated_at))
+        if is_fresh(entry.updated_at, now):
+            record('database_hit')
+            return entry.distance, entry.duration
+        if is_servable_stale(entry.updated_at, now):
+            record('stale_hit')
+            refresh(origin, destination, fetch)
+            return entry.distance, entry.duration
+
+    record('miss')
+    distance, duration = fetch(origin, destination)
+    store(origin_id, destination_id, distance, duration)
+    return distance, duration
+
+
+def get_cached_distances(origin, destinations, fetch_many):
+    """
+    Retrieve distances and durations from one place to many places from the in-process cache, then from
+    the database with one query and only then from the routing backend with one matrix request.
+    * Expired entries are retrieved again together with the missing ones instead of being refreshed in the background.
+
+    :param origin: starting place - dictionary with 'place_id' key
+    :param destinations: list of end places - dictionaries with 'place_id' key
+    :param fetch_many: function retrieving distances and durations from one place to many places from the routing
+                       backend
+    :return: list of tuples of distance and duration objects in the order of destinations - None if no route was found
+    """
+    origin_id = origin['place_id']
+    now = timezone.now()
+    unique = {destination['place_id']: destination for destination in destinations}
+    results = {}
+    for destination_id in unique:
+        cached = memory_cache.get((origin_id, destination_id))
+        if cached and is_fresh(cached[2], now):
+            record('memory_hit')
+            results[destination_id] = cached[:2]
+
+    missing = unique.keys() - results.keys()
+    for entry in PlaceDistance.objects.filter(origin_place_id=origin_id, destination_place_id__in=missing):
+        memory_cache.set((origin_id, entry.destination_place_id), (entry.distance, entry.duration, entry.updated_at))
+        if is_fresh(entry.updated_at, now):
+            record('database_hit')
+            results[entry.destination_place_id] = entry.distance, entry.duration
+
+    missing = [destination for destination_id, destination in unique.items() if destination_id not in results]
+    if missing:
+        fetched = fetch_many(origin, missing)
+        found = {destination['place_id']: pair for destination, pair in zip(missing, fetched) if pair is not None}
+        PlaceDistance.objects.filter(origin_place_id=origin_id, destination_place_id__in=found).delete()
+        PlaceDistance.objects.bulk_create([
+            PlaceDistance(origin_place_id=origin_id, destination_place_id=destination_id,
+                          distance=distance, duration=duration)
+            for destination_id, (distance, duration) in found.items()
+        ], ignore_conflicts=True)
+        for destination_id, (distance, duration) in found.items():
+            record('miss')
+            memory_cache.set((origin_id, destination_id), (distance, duration, now))
+        results.update(found)
+    return [results.get(destination['place_id']) for destination in destinations]
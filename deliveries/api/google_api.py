@@ -1,24 +1,67 @@
-import math
+from deliveries.api.distance_cache import get_cached_distance, get_cached_distances
+from deliveries.routing import get_backend
+from helpers.enums import RoutingProfile
 
-import googlemaps
-from bpproject.settings import GOOGLE_API_KEY
 
-gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
+def place_location(place):
+    """
+    Convert a place to the location format of routing backends.
+
+    :param place: Place object
+    :return: dictionary with 'place_id', 'latitude' and 'longitude' keys
+    """
+    return {'place_id': place.place_id, 'latitude': place.coordinates.y, 'longitude': place.coordinates.x}
 
 
-def get_distance(origin_id, destination_id):
+def get_distance(origin, destination):
     """
-    Retrieve route distance and expected duration for cars from the Google Maps API.
+    Retrieve route distance and expected duration for cars between two places from the configured routing backend.
+    * Results of cacheable backends are cached per place pair in process memory and in the database.
 
-    :param origin_id: Google place ID of the starting location
-    :param destination_id: Google place ID of the end location
+    :param origin: starting place - dictionary with 'place_id' and optionally 'latitude' and 'longitude' keys
+    :param destination: end place - dictionary with 'place_id' and optionally 'latitude' and 'longitude' keys
     :return: tuple of distance and duration objects with numerical and string representations
     """
-    result = gmaps.distance_matrix(f'place_id:{origin_id}',
-                                   f'place_id:{destination_id}')
-    distance = result["rows"][0]["elements"][0]["distance"]  # in meters
-    duration = result["rows"][0]["elements"][0]["duration"]  # in seconds
-    return distance, duration
+    backend = get_backend()
+    if not backend.cacheable:
+        return backend.distance(origin, destination)
+    return get_cached_distance(origin, destination, backend.distance)
+
+
+def get_distances(origin, destinations):
+    """
+    Retrieve route distances and expected durations for cars from one place to many places from the configured
+    routing backend with one batched matrix request.
+    * Results of cacheable backends are cached per place pair in process memory and in the database.
+
+    :param origin: starting place - dictionary with 'place_id' and optionally 'latitude' and 'longitude' keys
+    :param destinations: list of end places - dictionaries with 'place_id' and optionally 'latitude' and 'longitude'
+                         keys
+    :return: list of tuples of distance and duration objects in the order of destinations - None if no route was found
+    """
+    backend = get_backend()
+    if not backend.cacheable:
+        return backend.distance_matrix(origin, destinations)
+    return get_cached_distances(origin, destinations, backend.distance_matrix)
+
+
+def get_distances_for_sort(delivery_dicts, latitude, longitude):
+    """
+    Get route distances between courier coordinates and pickup places for the purpose of sorting close deliveries.
+    * Route distances of all deliveries are retrieved from the configured routing backend at once.
+
+    :param delivery_dicts: list of Delivery dictionaries
+    :param latitude: current latitude of courier
+    :param longitude: current longitude of courier
+    :return: list of route distances for driving between coordinates and pick up place of each delivery -
+             positive integers in meters, math.inf if no route was found
+    """
+    origin = {
+        "latitude": latitude,
+        "longitude": longitude
+    }
+    destinations = [delivery_dict["pickup_place"] for delivery_dict in delivery_dicts]
+    return get_backend().distances(origin, destinations)
 
 
 def get_distance_for_sort(delivery_dict, latitude, longitude):
@@ -30,30 +73,16 @@ def get_distance_for_sort(delivery_dict, latitude, longitude):
     :param delivery_dict: Delivery dictionary
     :return: route distance for driving between coordinates and pick up place of delivery - positive integer in meters
     """
-    origin = {
-        "lat": latitude,
-        "lng": longitude
-    }
-    try:
-        result = gmaps.distance_matrix(origin,
-                                       f'place_id:{delivery_dict["pickup_place"]["place_id"]}')
-        distance = result["rows"][0]["elements"][0]["distance"]["value"]  # in meters
-    except KeyError:
-        distance = math.inf
-    return distance
+    return get_distances_for_sort([delivery_dict], latitude, longitude)[0]
 
 
-def get_route(origin_id, destination_id):
+def get_route(origin, destination, profile=RoutingProfile.DRIVING):
     """
-    Retrieve route of delivery from Google Maps directions API.
+    Retrieve route of delivery from the configured routing backend.
 
-    :param origin_id: Google place ID of the starting location
-    :param destination_id: Google place ID of the end location
+    :param origin: starting place - dictionary with 'place_id' and optionally 'latitude' and 'longitude' keys
+    :param destination: end place - dictionary with 'place_id' and optionally 'latitude' and 'longitude' keys
+    :param profile: travel mode of the route
     :return: Steps and polyline string as tuple
     """
-    result = gmaps.directions(f'place_id:{origin_id}', f'place_id:{destination_id}')
-    steps_array = result[0]["legs"][0]['steps']
-    steps = list(map(lambda x: x['start_location'], steps_array))
-    steps.append(steps_array[len(steps_array) - 1]['end_location'])
-    polyline = result[0]['overview_polyline']['points']
-    return steps, polyline
+    return get_backend().route(origin, destination, profile)
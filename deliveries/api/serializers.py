@@ -1,3 +1,5 @@
+import json
+
 from django.contrib.gis.geos import Point
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
@@ -92,7 +94,7 @@ class DeliverySerializer(serializers.ModelSerializer):
             delivery = Delivery.objects.create(
                 item=Item.objects.create(**item_data),
                 sender=self.context['sender'],
-                receiver=Person.objects.get_or_create(**receiver_data)[0],
+                receiver=Person.objects.resolve(**receiver_data),
                 receiver_account=Account.objects.filter(email=receiver_data['email']).first(),
                 pickup_place=Place.objects.get_or_create(**pickup_place_data,
                                                        defaults={'coordinates': pickup_place_coordinates})[0],
@@ -118,3 +120,24 @@ class SafeDeliverySerializer(serializers.ModelSerializer):
         fields = ['safe_id', 'created_at', 'item', 'pickup_place', 'delivery_place',
                   'state', 'expected_duration', 'route_distance', 'price']
         read_only_fields = ['safe_id', 'created_at', 'state', 'expected_duration', 'route_distance', 'price']
+
+
+class DeliveryTimelineSerializer(serializers.BaseSerializer):
+    """
+    Read only serializer of delivery history rows - returns the same data as DeliverySerializer without
+    touching the related tables.
+    """
+    def to_representation(self, instance):
+        """
+        Deserialize stored delivery data and add the role of the user.
+
+        :param instance: DeliveryTimeline instance
+        :return: JSON representation of the delivery
+        """
+        representation = json.loads(instance.payload)
+        representation['user_is'] = instance.role
+        photo = representation['item'].get('photo')
+        request = self.context.get('request')
+        if photo and request:
+            representation['item']['photo'] = request.build_absolute_uri(photo)
+        return representation
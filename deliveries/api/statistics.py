@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+from django.utils import timezone
+
+from accounts.models import Account
+from deliveries.models import DeliveryMonthlyStats
+from helpers.enums import DeliveryRole, DeliveryState
+
+
+def month_start(moment):
+    """
+    Truncate time to the first moment of its month in the current time zone - same as TruncMonth.
+
+    :param moment: aware datetime
+    :return: aware datetime of the start of the month
+    """
+    return timezone.localtime(moment).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def delivery_people(delivery, receiver_people=None):
+    """
+    Find people taking part in a delivery and their roles.
+    * Receiver is the person of the receiver account, the same as in the delivery history - the receiver typed in
+      by the sender is not counted if they have no account.
+
+    :param delivery: Delivery instance
+    :param receiver_people: dictionary of account IDs and their person IDs, the receiver account is retrieved
+                            if None
+    :return: list of (person ID, role) tuples
+    """
+    people = []
+    if delivery.sender_id:
+        people.append((delivery.sender_id, DeliveryRole.SENDER))
+    if delivery.receiver_account_id:
+        if receiver_people is None:
+            receiver_person_id = delivery.receiver_account.person_id
+        else:
+            receiver_person_id = receiver_people.get(delivery.receiver_account_id)
+        if receiver_person_id:
+            people.append((receiver_person_id, DeliveryRole.RECEIVER))
+    if delivery.courier_id and delivery.courier.person_id:
+        people.append((delivery.courier.person_id, DeliveryRole.COURIER))
+    return people
+
+
+def record_created(delivery):
+    """
+    Add a new delivery to the monthly statistics of its sender and receiver.
+
+    :param delivery: Delivery instance with price and route distance
+    """
+    month = month_start(delivery.created_at)
+    for person_id, role in delivery_people(delivery):
+        DeliveryMonthlyStats.add(person_id, month, role, count=1, total_price=Decimal(str(delivery.price or 0)),
+                                 total_distance=delivery.route_distance or 0)
+
+
+def record_created_many(deliveries):
+    """
+    Add new deliveries to the monthly statistics of their senders and receivers.
+    * Deliveries are summed per person, month and role first, so each statistics row is updated once.
+
+    :param deliveries: list of Delivery instances with price and route distance
+    """
+    receiver_people = dict(Account.objects.filter(id__in={delivery.receiver_account_id for delivery in deliveries})
+                           .values_list('id', 'person_id'))
+    totals = {}
+    for delivery in deliveries:
+        month = month_start(delivery.created_at)
+        for person_id, role in delivery_people(delivery, receiver_people):
+            count, total_price, total_distance = totals.get((person_id, month, role), (0, Decimal(0), 0))
+            totals[person_id, month, role] = (count + 1, total_price + Decimal(str(delivery.price or 0)),
+                                              total_distance + (delivery.route_distance or 0))
+    for (person_id, month, role), (count, total_price, total_distance) in totals.items():
+        DeliveryMonthlyStats.add(person_id, month, role, count=count, total_price=total_price,
+                                 total_distance=total_distance)
+
+
+def record_state_change(delivery):
+    """
+    Update monthly statistics after a delivery changed its state.
+    * Delivery is counted to the courier when they are assigned, and as delivered for everyone when it is delivered.
+
+    :param delivery: Delivery instance with the new state
+    """
+    month = month_start(delivery.created_at)
+    if delivery.state == DeliveryState.ASSIGNED and delivery.courier_id and delivery.courier.person_id:
+        DeliveryMonthlyStats.add(delivery.courier.person_id, month, DeliveryRole.COURIER, count=1,
+                                 total_price=Decimal(str(delivery.price or 0)),
+                                 total_distance=delivery.route_distance or 0)
+    if delivery.state == DeliveryState.DELIVERED:
+        for person_id, role in delivery_people(delivery):
+            DeliveryMonthlyStats.add(person_id, month, role, delivered_count=1)
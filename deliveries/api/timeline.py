@@ -0,0 +1,171 @@
+import json
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from accounts.models import Account, Person
+from couriers.models import Courier
+from deliveries.api.serializers import DeliverySerializer
+from deliveries.models import Delivery, DeliveryTimeline, Item, Place
+from helpers.enums import DeliveryRole
+from helpers.pagination import KeysetPagination
+
+# Models serialized in the payload of timeline rows and lookups of deliveries they are serialized in
+PAYLOAD_RELATIONS = {
+    Person: ('sender', 'receiver', 'courier__person'),
+    Account: ('courier',),
+    Courier: ('courier__courier',),
+    Item: ('item',),
+    Place: ('pickup_place', 'delivery_place'),
+}
+# Fields of accounts serialized in the payload, saves of other fields like last_login don't refresh it
+ACCOUNT_PAYLOAD_FIELDS = {'email', 'person', 'courier'}
+
+
+def delivery_roles(delivery):
+    """
+    Find users taking part in a delivery and their roles.
+    * Sender role takes precedence over receiver role, courier role is independent of both.
+
+    :param delivery: Delivery instance
+    :return: list of (account ID, role) tuples
+    """
+    roles = []
+    senders = set()
+    if delivery.sender_id:
+        senders = set(Account.objects.filter(person_id=delivery.sender_id).values_list('id', flat=True))
+        roles += [(account_id, DeliveryRole.SENDER) for account_id in senders]
+    if delivery.receiver_account_id and delivery.receiver_account_id not in senders:
+        roles.append((delivery.receiver_account_id, DeliveryRole.RECEIVER))
+    if delivery.courier_id:
+        roles.append((delivery.courier_id, DeliveryRole.COURIER))
+    return roles
+
+
+def update_timeline(delivery):
+    """
+    Rebuild timeline rows of a delivery from its current data.
+
+    :param delivery: Delivery instance
+    """
+    payload = json.dumps(DeliverySerializer(delivery).data, cls=JSONEncoder)
+    with transaction.atomic():
+        DeliveryTimeline.objects.filter(delivery=delivery).delete()
+        DeliveryTimeline.objects.bulk_create([
+            DeliveryTimeline(
+                account_id=account_id,
+                delivery=delivery,
+                role=role,
+                state=delivery.state,
+                price=delivery.price,
+                delivery_created_at=delivery.created_at,
+                payload=payload,
+            )
+            for account_id, role in delivery_roles(delivery)
+        ])
+
+
+def refresh_timelines(deliveries):
+    """
+    Rewrite payloads of timeline rows of deliveries from their current data, e.g. after the sender edited
+    their name.
+    * Roles, states and prices don't depend on the related objects, only payloads are rewritten.
+
+    :param deliveries: QuerySet of Delivery instances
+    """
+    rows = list(DeliveryTimeline.objects.filter(delivery__in=deliveries).only('id', 'delivery_id'))
+    if not rows:
+        return
+    deliveries = Delivery.objects.filter(id__in={row.delivery_id for row in rows}) \
+        .select_related('item', 'sender', 'receiver', 'pickup_place', 'delivery_place', 'courier__person',
+                        'courier__courier')
+    payloads = {delivery.id: json.dumps(DeliverySerializer(delivery).data, cls=JSONEncoder)
+                for delivery in deliveries}
+    now = timezone.now()
+    for row in rows:
+        row.payload = payloads[row.delivery_id]
+        # bulk_update skips auto_now, ETags of the history depend on updated_at
+        row.updated_at = now
+    DeliveryTimeline.objects.bulk_update(rows, ['payload', 'updated_at'], batch_size=500)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Courier)
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Place)
+def refresh_related(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Refresh timeline payloads of deliveries of an edited person, account, courier profile, item or place.
+    * New objects are not part of any delivery yet.
+    """
+    if created:
+        return
+    if sender is Account and update_fields is not None and not set(update_fields) & ACCOUNT_PAYLOAD_FIELDS:
+        return
+    condition = Q()
+    for lookup in PAYLOAD_RELATIONS[sender]:
+        condition |= Q(**{lookup: instance})
+    refresh_timelines(Delivery.objects.filter(condition))
+
+
+def create_timelines(deliveries):
+    """
+    Create timeline rows of new deliveries with one query for accounts of their senders and one insert.
+    * Deliveries have to be new - they have no courier and no timeline rows yet.
+
+    :param deliveries: list of Delivery instances with loaded related objects
+    :return: list of serialized deliveries in the order of deliveries
+    """
+    sender_ids = {delivery.sender_id for delivery in deliveries}
+    senders = {}
+    for person_id, account_id in Account.objects.filter(person_id__in=sender_ids).values_list('person_id', 'id'):
+        senders.setdefault(person_id, set()).add(account_id)
+    data = DeliverySerializer(deliveries, many=True).data
+    rows = []
+    for delivery, serialized in zip(deliveries, data):
+        payload = json.dumps(serialized, cls=JSONEncoder)
+        sender_accounts = senders.get(delivery.sender_id, set())
+        roles = [(account_id, DeliveryRole.SENDER) for account_id in sender_accounts]
+        if delivery.receiver_account_id and delivery.receiver_account_id not in sender_accounts:
+            roles.append((delivery.receiver_account_id, DeliveryRole.RECEIVER))
+        rows += [
+            DeliveryTimeline(
+                account_id=account_id,
+                delivery=delivery,
+                role=role,
+                state=delivery.state,
+                price=delivery.price,
+                delivery_created_at=delivery.created_at,
+                payload=payload,
+            )
+            for account_id, role in roles
+        ]
+    DeliveryTimeline.objects.bulk_create(rows)
+    return data
+
+
+def get_timeline(user, courier=False):
+    """
+    Retrieve the delivery history of a user with a single query.
+
+    :param user: Account instance
+    :param courier: True for deliveries of the courier, False for sent and received deliveries
+    :return: QuerySet of DeliveryTimeline instances, the newest first
+    """
+    # Conditions of the partial history indexes, so the pages are read in the order of the index
+    roles = Q(role=DeliveryRole.COURIER) if courier else Q(role__in=[DeliveryRole.SENDER, DeliveryRole.RECEIVER])
+    return DeliveryTimeline.objects.filter(roles, account=user) \
+        .only('role', 'payload', 'delivery_created_at', 'delivery_id', 'updated_at') \
+        .order_by('-delivery_created_at', '-delivery_id')
+
+
+class DeliveryHistoryPagination(KeysetPagination):
+    """
+    Keyset pagination of the delivery timeline, the newest deliveries first.
+    """
+    ordering = ('-delivery_created_at', '-delivery_id')
@@ -1,14 +1,16 @@
 from django.urls import path
 from deliveries.api.views import uptime, DeliveryStateView, DeliveriesStatisticsView, \
-    DeliveriesView, DeliveryDetailView, DeliveriesPreviewView
+    DeliveriesView, DeliveryDetailView, DeliveriesPreviewView, DeliveryTrackView, DeliveriesBulkView
 
 app_name = 'deliveries'
 
 urlpatterns = [
     path('uptime/', uptime, name="uptime"),
     path('statistics/', DeliveriesStatisticsView.as_view(), name="deliveries_statistics"),
+    path('bulk/', DeliveriesBulkView.as_view(), name="deliveries_bulk"),
     path('preview/', DeliveriesPreviewView.as_view(), name="deliveries_preview"),
     path('<str:safe_delivery_id>/state/', DeliveryStateView.as_view(), name="delivery_state"),
+    path('<str:delivery_id>/track/', DeliveryTrackView.as_view(), name="delivery_track"),
     path('<str:delivery_id>/', DeliveryDetailView.as_view(), name="delivery_detail"),
     path('', DeliveriesView.as_view(), name="deliveries"),
 ]
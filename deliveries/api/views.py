@@ -1,5 +1,5 @@
-import googlemaps.exceptions
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -9,21 +9,26 @@ from django.http import JsonResponse, Http404
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 
-from deliveries.api.emails import delivery_start_receiver_email, delivery_end_sender_email
-from deliveries.api.google_api import get_distance, get_route
-from deliveries.api.serializers import DeliverySerializer, SafeDeliverySerializer
-from deliveries.models import Delivery
-from django.db.models import Q
+from bpproject.settings import DELIVERY_BULK_MAX
+from deliveries.api.bulk import CSVParser, create_deliveries, read_csv
+from deliveries.api.emails import delivery_end_sender_email, delivery_start_receiver_email
+from deliveries.api.google_api import get_distance
+from deliveries.routing.base import RoutingError
+from deliveries.api.serializers import DeliverySerializer, SafeDeliverySerializer, DeliveryTimelineSerializer
+from deliveries.api.statistics import month_start, record_created, record_state_change
+from deliveries.api.timeline import get_timeline, update_timeline, DeliveryHistoryPagination
+from deliveries.models import Delivery, DeliveryMonthlyStats, DeliveryTrackSegment
 from django.core.exceptions import ValidationError
 from django.db.models import Case, Value, When
+from django.utils.cache import get_conditional_response
 import json
 from deliveries.permissions import CanChangeDeliveryState
-from helpers.functions import is_state_change_valid, calculate_price
-from django.db.models.functions import TruncMonth
-from django.db.models import Count
-import datetime
+from helpers.enums import DeliveryRole
+from helpers.functions import is_state_change_valid, calculate_price, make_etag, simplify
 from dateutil.relativedelta import relativedelta
-from routes.api.serializers import RouteSerializer
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+from jobs.queue import enqueue
 
 @api_view(['GET', ])
 def uptime(request):
@@ -35,24 +40,6 @@ def uptime(request):
     return JsonResponse({"psql": {"uptime": uptime}})
 
 
-def create_route(delivery):
-    """
-    Create a route entry for delivery.
-    :param delivery: Delivery object
-    """
-    steps, polyline = get_route(delivery.pickup_place.place_id, delivery.delivery_place.place_id)
-    data = {
-        'steps': steps,
-        'polyline': polyline
-    }
-    serializer = RouteSerializer(data=data)
-    if not serializer.is_valid():  # if we cant create a route than just return
-        return
-    route = serializer.save()
-    route.delivery = delivery
-    route.save()
-
-
 class DeliveriesView(GenericAPIView):
     """
     View that handles operations on deliveries.
@@ -60,26 +47,17 @@ class DeliveriesView(GenericAPIView):
     serializer_class = DeliverySerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
+    pagination_class = DeliveryHistoryPagination
 
     def get_queryset(self):
         """
         Get a queryset of deliveries from users history.
-        * Deliveries are annotated by users role in them - sender/receiver/courier
+        * Deliveries are read from the delivery timeline together with users role in them - sender/receiver/courier
 
-        :return: Query set with 100 deliveries
+        :return: Query set of deliveries, the newest first
         """
-        user = self.request.user
         courier = self.request.query_params.get('courier')
-        if courier:
-            deliveries = Delivery.objects.filter(courier=user)
-            deliveries = deliveries.annotate(user_is=Value('courier'))
-        else:
-            deliveries = Delivery.objects.filter(Q(sender=user.person) | Q(receiver_account=user))
-            deliveries = deliveries.annotate(user_is=Case(
-                When(sender=user.person, then=Value('sender')),
-                When(receiver_account=user, then=Value('receiver')),
-                default=Value('unknown'), ))
-        return deliveries[:100]
+        return get_timeline(self.request.user, courier=bool(courier))
 
     def post(self, request):
         """
@@ -91,32 +69,80 @@ class DeliveriesView(GenericAPIView):
         serializer = self.get_serializer(data=request.data, context={'sender': request.user.person})
         serializer.is_valid(raise_exception=True)
         try:
-            distance, duration = get_distance(serializer.validated_data["pickup_place"]["place_id"],
-                                              serializer.validated_data["delivery_place"]["place_id"])
+            distance, duration = get_distance(serializer.validated_data["pickup_place"],
+                                              serializer.validated_data["delivery_place"])
 
-        except googlemaps.exceptions.HTTPError:
-            return Response({"error": "Invalid place Id"}, status.HTTP_400_BAD_REQUEST)
+        except RoutingError as e:
+            return Response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
         delivery = serializer.create(serializer.validated_data)
         delivery.route_distance = distance["value"]
         delivery.expected_duration = duration["value"]
         delivery.price = calculate_price(distance["value"], delivery.item.size, delivery.item.weight)
         delivery.save()
+        update_timeline(delivery)
+        record_created(delivery)
+        # Route is created by the job worker and receiver email is sent once the delivery is committed
+        enqueue('create_route', delivery_id=str(delivery.id))
         delivery_start_receiver_email(delivery)
-        create_route(delivery)
         serialized_delivery = self.get_serializer(instance=delivery).data
         serialized_delivery['user_is'] = 'sender'
         return Response(serialized_delivery, status.HTTP_201_CREATED)
 
     def get(self, request):
         """
-        Retrieve a list of deliveries from the users history.
+        Retrieve a page of deliveries from the users history.
+        * Links to the next and previous pages are in the Link header of the response.
+        * ETag of the page is built from the rows of the page and their update times, so it changes whenever
+          a delivery of the page changes or the page shifts. Requests with a matching If-None-Match header get 304
+          without serializing the deliveries.
+
+        :param request: HTTP GET request with optional page_size and cursor query params.
+        :return: HTTP Response - 200 with deliveries data if success, 304 if not modified, 401 if not authenticated,
+                 404 if invalid cursor
+        """
+        deliveries = self.paginate_queryset(self.get_queryset())
+        etag = make_etag(request.user.pk, request.get_full_path(), self.paginator.has_next,
+                         self.paginator.has_previous,
+                         *((row.delivery_id, row.role, row.updated_at) for row in deliveries))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        serializer = DeliveryTimelineSerializer(deliveries, many=True, context=self.get_serializer_context())
+        response = self.get_paginated_response(serializer.data)
+        response['ETag'] = etag
+        return response
+
+
+class DeliveriesBulkView(APIView):
+    """
+    View to create many deliveries at once, e.g. by business senders.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
 
-        :param request: HTTP GET request with delivery ID in URL.
-        :return: HTTP Response - 200 with deliveries data if success, 401 if not authenticated
+    def post(self, request):
         """
-        deliveries = self.get_queryset()
-        serializer = self.get_serializer(deliveries, many=True)
-        return Response(serializer.data)
+        Create deliveries from a JSON array, a CSV body or an uploaded CSV file, they start in the 'ready' state.
+        * Rows have the same fields as the body of a new delivery, CSV columns have dotted names, e.g. item.name.
+        * Valid rows are created even if other rows are invalid, see create_deliveries.
+
+        :param request: HTTP POST request with a JSON array of deliveries, text/csv body or multipart form data
+                        with a CSV file in the file field
+        :return: HTTP Response - list of results of the rows with their index, status and the created delivery
+                 or errors - 201 if all rows were created, 207 if some of them, 400 if none of them or invalid body,
+                 401 if not authenticated
+        """
+        rows = read_csv(request.FILES['file']) if 'file' in request.FILES else request.data
+        if not isinstance(rows, list) or not 0 < len(rows) <= DELIVERY_BULK_MAX:
+            return Response({"error": f"Body must be a list of 1 to {DELIVERY_BULK_MAX} deliveries"},
+                            status.HTTP_400_BAD_REQUEST)
+        results = create_deliveries(rows, request.user.person)
+        created = sum(result['status'] == status.HTTP_201_CREATED for result in results)
+        if created == len(results):
+            return Response(results, status.HTTP_201_CREATED)
+        if created:
+            return Response(results, status.HTTP_207_MULTI_STATUS)
+        return Response(results, status.HTTP_400_BAD_REQUEST)
 
 
 class DeliveryDetailView(APIView):
@@ -143,15 +169,27 @@ class DeliveryDetailView(APIView):
         """
         Retrieve one delivery by its ID
         * Deliveries are annotated by users role in them - sender/receiver/courier
+        * ETag of the delivery is built from update times of the delivery and its related rows. Requests with
+          a matching If-None-Match header get 304 without reading and decrypting the delivery.
 
-        :return: Delivery object
+        :return: Delivery object, 304 if not modified
         """
         try:
-            delivery = self.get_object(delivery_id, request.user)
+            version = Delivery.objects.filter(id=delivery_id).values_list(
+                'updated_at', 'state', 'receiver_account_id', 'sender__updated_at', 'receiver__updated_at',
+                'item__updated_at', 'pickup_place__updated_at', 'delivery_place__updated_at', 'courier__updated_at',
+                'courier__person__updated_at', 'courier__courier__updated_at').first()
         except ValidationError as e:
             return Response({"error": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        if version is None:
+            raise Http404
+        etag = make_etag(request.user.pk, *version)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        delivery = self.get_object(delivery_id, request.user)
         serializer = self.serializer_class(delivery)
-        return Response(serializer.data)
+        return Response(serializer.data, headers={'ETag': etag})
 
 
 class DeliveryStateView(APIView):
@@ -201,10 +239,62 @@ class DeliveryStateView(APIView):
             delivery_end_sender_email(delivery)
         delivery.state = new_state
         delivery.save()
+        update_timeline(delivery)
+        record_state_change(delivery)
         serializer = self.serializer_class(delivery)
         return Response(serializer.data)
 
 
+class DeliveryTrackView(APIView):
+    """
+    View to replay the track of the courier of a delivery.
+    * Only the sender, receiver and courier of the delivery can replay its track.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self, delivery_id, user):
+        try:
+            delivery = Delivery.objects.get(id=delivery_id)
+        except Delivery.DoesNotExist:
+            raise Http404
+        if not (user.is_admin or user.id in (delivery.courier_id, delivery.receiver_account_id)
+                or (user.person_id is not None and user.person_id == delivery.sender_id)):
+            raise PermissionDenied
+        return delivery
+
+    def get(self, request, delivery_id):
+        """
+        Retrieve positions of the courier of a delivery ordered by time.
+        * The track is downsampled so that removed positions are at most resolution meters from the returned track.
+
+        :param request: HTTP GET request with optional resolution in meters as query param, full track by default
+        :return: HTTP Response - 200 with list of positions, 400 if invalid ID or resolution, 401 if not
+                 authenticated, 403 if the user is not part of the delivery, 404 if not found
+        """
+        try:
+            resolution = float(request.query_params.get('resolution', 0))
+        except ValueError:
+            resolution = -1
+        if not resolution >= 0:
+            return Response({"error": "Resolution must be a non-negative number of meters"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            delivery = self.get_object(delivery_id, request.user)
+        except ValidationError as e:
+            return Response({"error": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        paths = DeliveryTrackSegment.objects.filter(delivery=delivery).order_by('started_at') \
+            .values_list('path', flat=True)
+        positions = sorted({(timestamp, latitude, longitude) for path in paths
+                            for longitude, latitude, timestamp in path.coords})
+        positions = simplify([(latitude, longitude, timestamp) for timestamp, latitude, longitude in positions],
+                             resolution)
+        return Response([{
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': datetime.fromtimestamp(timestamp, dt_timezone.utc),
+        } for latitude, longitude, timestamp in positions])
+
+
 class DeliveriesStatisticsView(GenericAPIView):
     """
     View to retrieve statistics of deliveries for user.
@@ -213,31 +303,31 @@ class DeliveriesStatisticsView(GenericAPIView):
 
     def get_queryset(self):
         """
-        Retrieve monthly statistics of sent deliveries.
+        Retrieve monthly statistics of deliveries from the statistics rollup.
 
-        :return: query set annotated with the number of deliveries a user sent per month
+        :return: query set with the number of deliveries, delivered deliveries, their total price and total distance
+                 per month in which the user had the requested role - sender by default
         """
-        today = datetime.date.today()
         user = self.request.user
         months = self.request.query_params.get('months')
         try:
             months = int(months)
         except (ValueError, TypeError):
             months = 5
-        start = today - relativedelta(months=months)
-        today += datetime.timedelta(days=1)
-        stats = Delivery.objects.filter(sender=user.person, created_at__range=[start, today]) \
-            .annotate(month=TruncMonth('created_at')) \
-            .values('month') \
-            .annotate(count=Count('id')) \
-            .values('month', 'count')
+        role = self.request.query_params.get('role')
+        if role not in DeliveryRole.values:
+            role = DeliveryRole.SENDER
+        start = month_start(timezone.now() - relativedelta(months=months))
+        stats = DeliveryMonthlyStats.objects.filter(person=user.person, role=role, month__gte=start) \
+            .order_by('month') \
+            .values('month', 'count', 'delivered_count', 'total_price', 'total_distance')
         return stats
 
     def get(self, request):
         """
-        Retrieve number of sent deliveries for user per month.
+        Retrieve number of sent, received or delivered deliveries for user per month.
 
-        :param request: HTTP GET request with the amount of months as query param.
+        :param request: HTTP GET request with the amount of months and the role as query params.
         :return: HTTP Response - 200 with requested data, 401 unauthorized
         """
         stats = self.get_queryset()
@@ -266,9 +356,9 @@ class DeliveriesPreviewView(GenericAPIView):
         try:
             print(serializer.validated_data["pickup_place"]["place_id"],
                   serializer.validated_data["delivery_place"]["place_id"])
-            distance, duration = get_distance(serializer.validated_data["pickup_place"]["place_id"],
-                                              serializer.validated_data["delivery_place"]["place_id"])
+            distance, duration = get_distance(serializer.validated_data["pickup_place"],
+                                              serializer.validated_data["delivery_place"])
             price = calculate_price(distance["value"], size, weight)
             return Response({"distance": distance, "duration": duration, "price": price})
-        except googlemaps.exceptions.HTTPError:
-            return Response({"error": "Invalid place Id"}, status.HTTP_400_BAD_REQUEST)
+        except RoutingError as e:
+            return Response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
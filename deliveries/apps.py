@@ -5,3 +5,9 @@ class CoreConfig(AppConfig):
     """ Configuration for the deliveries app """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'deliveries'
+
+    def ready(self):
+        """
+        Connect refreshing of the delivery timeline to changes of the data serialized in it.
+        """
+        import deliveries.api.timeline  # noqa: F401
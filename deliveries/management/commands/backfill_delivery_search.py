@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Q, Subquery
+
+from deliveries.models import Delivery, Item, Place
+
+
+class Command(BaseCommand):
+    """
+    Copy pickup coordinates and item size to deliveries created before they were stored on the delivery.
+    """
+    help = 'Fill pickup coordinates and item size of deliveries used to search ready deliveries near couriers.'
+
+    def handle(self, *args, **options):
+        count = Delivery.objects.filter(Q(pickup_coordinates__isnull=True, pickup_place__isnull=False)
+                                        | Q(item_size__isnull=True, item__isnull=False)).update(
+            pickup_coordinates=Subquery(Place.objects.filter(pk=OuterRef('pickup_place_id')).values('coordinates')[:1]),
+            item_size=Subquery(Item.objects.filter(pk=OuterRef('item_id')).values('size')[:1]),
+        )
+        self.stdout.write(f'{count} deliveries updated')
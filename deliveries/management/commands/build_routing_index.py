@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bpproject.settings import ROUTING_GRAPH_PATH
+from deliveries.routing.road_graph import load_hierarchy
+from helpers.enums import RoutingProfile
+
+
+class Command(BaseCommand):
+    """
+    Precompute contraction hierarchies of the OSM extract used by the local routing backend.
+    """
+    help = 'Build the routing index of the OSM extract at ROUTING_GRAPH_PATH for the given profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profiles', nargs='*', default=[RoutingProfile.DRIVING.value],
+                            choices=RoutingProfile.values, help='Routing profiles to build the index for.')
+
+    def handle(self, *args, **options):
+        if not ROUTING_GRAPH_PATH:
+            raise CommandError('ROUTING_GRAPH_PATH is not set')
+        for profile in options['profiles']:
+            hierarchy = load_hierarchy(ROUTING_GRAPH_PATH, profile)
+            self.stdout.write(f'{profile}: {len(hierarchy.coordinates)} nodes, {len(hierarchy.arcs)} arcs')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from deliveries.models import Delivery, DeliveryMonthlyStats
+from helpers.enums import DeliveryRole, DeliveryState
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the monthly statistics rollup from all deliveries.
+    """
+    help = 'Recalculate monthly delivery statistics of all people.'
+
+    def handle(self, *args, **options):
+        person_fields = {
+            DeliveryRole.SENDER: 'sender',
+            DeliveryRole.RECEIVER: 'receiver_account__person',
+            DeliveryRole.COURIER: 'courier__person',
+        }
+        rows = []
+        for role, person_field in person_fields.items():
+            totals = Delivery.objects.filter(**{f'{person_field}__isnull': False}) \
+                .annotate(month=TruncMonth('created_at')) \
+                .values(person_field, 'month') \
+                .annotate(count=Count('id'),
+                          delivered_count=Count('id', filter=Q(state=DeliveryState.DELIVERED)),
+                          total_price=Sum('price'),
+                          total_distance=Sum('route_distance'))
+            rows += [DeliveryMonthlyStats(person_id=total[person_field], month=total['month'], role=role,
+                                          count=total['count'], delivered_count=total['delivered_count'],
+                                          total_price=total['total_price'] or 0,
+                                          total_distance=total['total_distance'] or 0)
+                     for total in totals]
+        with transaction.atomic():
+            DeliveryMonthlyStats.objects.all().delete()
+            DeliveryMonthlyStats.objects.bulk_create(rows, batch_size=1000)
+        self.stdout.write(f'{len(rows)} rows rebuilt')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from deliveries.api.timeline import update_timeline
+from deliveries.models import Delivery
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the delivery history read model, e.g. for deliveries created before it existed.
+    """
+    help = 'Rebuild delivery timeline rows of all deliveries.'
+
+    def handle(self, *args, **options):
+        count = 0
+        deliveries = Delivery.objects.select_related('item', 'sender', 'receiver', 'pickup_place', 'delivery_place',
+                                                     'courier__person', 'courier__courier')
+        for delivery in deliveries.iterator():
+            update_timeline(delivery)
+            count += 1
+        self.stdout.write(f'{count} deliveries rebuilt')
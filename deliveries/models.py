@@ -1,10 +1,13 @@
 import uuid
 import pgcrypto
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GistIndex
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
 
 from helpers.models import TrackingModel
 from accounts.models import Person, Account
-from helpers.enums import (SizeType, WeightType, DeliveryState)
+from helpers.enums import (SizeType, WeightType, DeliveryState, DeliveryRole, VEHICLE_SIZES)
 
 
 def upload_item_picture(instance, filename):
@@ -38,6 +41,14 @@ class Item(TrackingModel):
     class Meta:
         db_table = "item"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if not adding and (update_fields is None or 'size' in update_fields):
+            # Keep the size copied to deliveries of the item
+            self.delivery_set.exclude(item_size=self.size).update(item_size=self.size)
+
 
 class Place(TrackingModel):
     """ Model for location data - uses Google Maps API PlaceID as ID """
@@ -59,6 +70,9 @@ class Place(TrackingModel):
 class Delivery(TrackingModel):
     """
     Model to hold data of the delivery.
+    * Pickup coordinates and item size are copied from the pickup place and item, so ready deliveries near
+      a courier are found by one partial GiST index per vehicle type. They are copied again whenever
+      the pickup place or item of the delivery changes, and item size when the item is edited.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     sender = models.ForeignKey(Person, on_delete=models.RESTRICT, null=True, related_name='sender')
@@ -75,10 +89,172 @@ class Delivery(TrackingModel):
     route_distance = models.PositiveIntegerField(default=0, blank=True, null=True)  # in meters
     expected_duration = models.PositiveIntegerField(default=0, blank=True, null=True)  # in seconds
     price = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)  # in euros
+    pickup_coordinates = models.PointField(geography=True, srid=4326, null=True, editable=False,
+                                           spatial_index=False)  # pickup_place.coordinates
+    item_size = models.CharField(max_length=6, choices=SizeType.choices, null=True, editable=False)  # item.size
 
     class Meta:
         db_table = "delivery"
+        indexes = [
+            # Ready deliveries a vehicle type can carry - the query has to repeat the condition of the index
+            GistIndex(fields=['pickup_coordinates'], condition=Q(state=DeliveryState.READY),
+                      name='delivery_ready_idx'),
+            GistIndex(fields=['pickup_coordinates'],
+                      condition=Q(state=DeliveryState.READY, item_size__in=VEHICLE_SIZES[SizeType.MEDIUM]),
+                      name='delivery_ready_medium_idx'),
+            GistIndex(fields=['pickup_coordinates'],
+                      condition=Q(state=DeliveryState.READY, item_size__in=VEHICLE_SIZES[SizeType.SMALL]),
+                      name='delivery_ready_small_idx'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Pickup place and item the copied columns were taken from, deferred fields are not loaded
+        self.copied_from = (self.__dict__.get('pickup_place_id'), self.__dict__.get('item_id'))
 
     def __str__(self):
         return '{}'.format(self.created_at)
 
+    def save(self, *args, **kwargs):
+        copied = set()
+        pickup_place_id, item_id = self.copied_from
+        if self.pickup_coordinates is None or self.pickup_place_id != pickup_place_id:
+            self.pickup_coordinates = self.pickup_place.coordinates if self.pickup_place_id else None
+            copied.add('pickup_coordinates')
+        if self.item_size is None or self.item_id != item_id:
+            self.item_size = self.item.size if self.item_id else None
+            copied.add('item_size')
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and copied:
+            kwargs['update_fields'] = set(update_fields) | copied
+        super().save(*args, **kwargs)
+        self.copied_from = (self.pickup_place_id, self.item_id)
+
+
+class PlaceDistance(TrackingModel):
+    """
+    Model caching route distance and duration between two places retrieved from the routing backend.
+    * Entries expire DISTANCE_CACHE_TTL after they were last retrieved - updated_at.
+    """
+    origin_place_id = models.CharField(max_length=2000)
+    destination_place_id = models.CharField(max_length=2000)
+    distance = models.JSONField()  # {"text": ..., "value": meters}
+    duration = models.JSONField()  # {"text": ..., "value": seconds}
+
+    class Meta:
+        db_table = "place_distance"
+        constraints = [
+            models.UniqueConstraint(fields=['origin_place_id', 'destination_place_id'],
+                                    name='unique_place_distance_pair'),
+        ]
+
+    def __str__(self):
+        return '{} -> {}'.format(self.origin_place_id, self.destination_place_id)
+
+
+class DeliveryTimeline(TrackingModel):
+    """
+    Read model of the delivery history of users - one row per user and their role in a delivery.
+    * Rows are rebuilt whenever the delivery is created or changes state, payloads are rewritten when people,
+      accounts, courier profiles, items or places serialized in them are edited, see deliveries.api.timeline.
+    * Payload holds the serialized delivery and is encrypted on the database level.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='+')
+    delivery = models.ForeignKey(Delivery, on_delete=models.CASCADE, related_name='timeline')
+    role = models.CharField(max_length=8, choices=DeliveryRole.choices)
+    state = models.CharField(max_length=13, choices=DeliveryState.choices)
+    price = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)  # in euros
+    delivery_created_at = models.DateTimeField()
+    payload = pgcrypto.EncryptedTextField()  # JSON of DeliverySerializer
+
+    class Meta:
+        db_table = "delivery_timeline"
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'delivery', 'role'], name='unique_delivery_timeline_role'),
+        ]
+        indexes = [
+            # History pages are read in the order of these indexes, the role condition has to be repeated
+            # by the query, see get_timeline
+            models.Index(fields=['account', '-delivery_created_at', '-delivery'],
+                         condition=Q(role__in=[DeliveryRole.SENDER, DeliveryRole.RECEIVER]),
+                         name='delivery_timeline_history_idx'),
+            models.Index(fields=['account', '-delivery_created_at', '-delivery'],
+                         condition=Q(role=DeliveryRole.COURIER), name='delivery_timeline_courier_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.role, self.delivery_id)
+
+
+class DeliveryMonthlyStats(TrackingModel):
+    """
+    Rollup of deliveries of a person per month and their role in the deliveries.
+    * Rows are updated together with the deliveries, see deliveries.api.statistics.
+    * Month is the first moment of the month the deliveries were created in.
+    """
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='+')
+    month = models.DateTimeField()
+    role = models.CharField(max_length=8, choices=DeliveryRole.choices)
+    count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # in euros
+    total_distance = models.PositiveBigIntegerField(default=0)  # in meters
+
+    class Meta:
+        db_table = "delivery_monthly_stats"
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'month', 'role'], name='unique_delivery_monthly_stats'),
+        ]
+
+    def __str__(self):
+        return '{} {} {}'.format(self.person_id, self.month, self.role)
+
+    @classmethod
+    def add(cls, person_id, month, role, **values):
+        """
+        Atomically add values to the counters of a row, the row is created if it does not exist yet.
+
+        :param person_id: ID of the person
+        :param month: first moment of the month
+        :param role: role of the person in the deliveries
+        :param values: amounts added to the counters, e.g. count=1
+        """
+        rows = cls.objects.filter(person_id=person_id, month=month, role=role)
+        if rows.update(**{field: F(field) + value for field, value in values.items()}):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(person_id=person_id, month=month, role=role, **values)
+        except IntegrityError:  # created by a concurrent transaction in the meantime
+            rows.update(**{field: F(field) + value for field, value in values.items()})
+
+    @classmethod
+    def merge_people(cls, person, ids):
+        """
+        Add statistics of duplicate people to the statistics of the person they are merged into.
+
+        :param person: Person instance that is kept
+        :param ids: IDs of the merged people
+        """
+        for stats in cls.objects.filter(person_id__in=ids):
+            cls.add(person.pk, stats.month, stats.role, count=stats.count, delivered_count=stats.delivered_count,
+                    total_price=stats.total_price, total_distance=stats.total_distance)
+        cls.objects.filter(person_id__in=ids).delete()
+
+
+class DeliveryTrackSegment(TrackingModel):
+    """
+    Model holding a part of the track of the courier of a delivery - positions received over websockets
+    are written in bulk, one segment per delivery and flush.
+    * Z coordinates of the path are unix timestamps of the positions.
+    """
+    delivery = models.ForeignKey(Delivery, on_delete=models.CASCADE, related_name='track')
+    started_at = models.DateTimeField()
+    path = models.LineStringField(dim=3, srid=4326)
+
+    class Meta:
+        db_table = "delivery_track_segment"
+        indexes = [
+            models.Index(fields=['delivery', 'started_at'], name='delivery_track_idx'),
+        ]
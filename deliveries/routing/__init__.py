@@ -0,0 +1,22 @@
+import threading
+
+from django.utils.module_loading import import_string
+
+from bpproject.settings import ROUTING_BACKEND
+
+backend = None
+backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Retrieve the routing backend configured by the ROUTING_BACKEND setting.
+    * The backend is created once per process.
+
+    :return: RoutingBackend instance
+    """
+    global backend
+    with backend_lock:
+        if backend is None:
+            backend = import_string(ROUTING_BACKEND)()
+    return backend
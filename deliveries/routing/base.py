@@ -0,0 +1,58 @@
+from helpers.enums import RoutingProfile
+
+
+class RoutingError(Exception):
+    """
+    Raised when a routing backend can't answer a query, e.g. for an invalid place or when there is no route.
+    """
+
+
+class RoutingBackend:
+    """
+    Interface of routing backends answering distance, duration and route queries.
+    * Locations are dictionaries with a Google 'place_id' and/or 'latitude' and 'longitude' keys.
+    """
+    # Whether distances should be cached per place pair in front of the backend
+    cacheable = True
+
+    def distance(self, origin, destination):
+        """
+        Retrieve route distance and expected duration for cars between two locations.
+
+        :param origin: starting location
+        :param destination: end location
+        :return: tuple of distance and duration objects with numerical and string representations
+        """
+        raise NotImplementedError
+
+    def distance_matrix(self, origin, destinations):
+        """
+        Retrieve route distances and expected durations for cars from one location to many locations.
+
+        :param origin: starting location
+        :param destinations: list of end locations
+        :return: list of tuples of distance and duration objects with numerical and string representations
+                 in the order of destinations - None if no route was found
+        """
+        raise NotImplementedError
+
+    def distances(self, origin, destinations):
+        """
+        Retrieve route distances from one location to many locations.
+
+        :param origin: starting location
+        :param destinations: list of end locations
+        :return: list of route distances in meters in the order of destinations - math.inf if no route was found
+        """
+        raise NotImplementedError
+
+    def route(self, origin, destination, profile=RoutingProfile.DRIVING):
+        """
+        Retrieve route between two locations.
+
+        :param origin: starting location
+        :param destination: end location
+        :param profile: travel mode of the route
+        :return: Steps and polyline string as tuple
+        """
+        raise NotImplementedError
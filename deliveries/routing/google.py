@@ -0,0 +1,116 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import googlemaps
+from bpproject.settings import GOOGLE_API_KEY
+from deliveries.routing.base import RoutingBackend, RoutingError
+from helpers.enums import RoutingProfile
+
+# Google Distance Matrix accepts at most 25 destinations in a single request
+MAX_MATRIX_DESTINATIONS = 25
+
+
+def to_google_location(location):
+    """
+    Convert a location to the format accepted by the Google Maps API.
+
+    :param location: dictionary with a 'place_id' and/or 'latitude' and 'longitude' keys
+    :return: 'place_id:' string or coordinates dictionary
+    """
+    if location.get('place_id'):
+        return f'place_id:{location["place_id"]}'
+    return {"lat": location['latitude'], "lng": location['longitude']}
+
+
+class GoogleRoutingBackend(RoutingBackend):
+    """
+    Routing backend using the Google Maps Distance Matrix and Directions APIs.
+    """
+    def __init__(self):
+        self.gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
+
+    def distance(self, origin, destination):
+        try:
+            result = self.gmaps.distance_matrix(to_google_location(origin), to_google_location(destination))
+        except googlemaps.exceptions.HTTPError:
+            raise RoutingError('Invalid place Id')
+        distance = result["rows"][0]["elements"][0]["distance"]  # in meters
+        duration = result["rows"][0]["elements"][0]["duration"]  # in seconds
+        return distance, duration
+
+    def matrix_row(self, origin, destinations):
+        """
+        Retrieve route distances and durations from one origin to a chunk of destinations with a single
+        Distance Matrix request.
+
+        :param origin: origin in the format of the Google Maps API
+        :param destinations: list of destinations in the format of the Google Maps API, at most
+                             MAX_MATRIX_DESTINATIONS
+        :return: list of tuples of distance and duration objects in the order of destinations - None if no route
+                 was found
+        """
+        try:
+            result = self.gmaps.distance_matrix(origin, destinations)
+        except googlemaps.exceptions.HTTPError:
+            raise RoutingError('Invalid place Id')
+        pairs = []
+        for element in result["rows"][0]["elements"]:
+            try:
+                pairs.append((element["distance"], element["duration"]))  # in meters and seconds
+            except KeyError:
+                pairs.append(None)
+        return pairs
+
+    def distance_row(self, origin, destinations):
+        """
+        Retrieve route distances from one origin to a chunk of destinations with a single Distance Matrix request.
+
+        :param origin: origin in the format of the Google Maps API
+        :param destinations: list of destinations in the format of the Google Maps API, at most
+                             MAX_MATRIX_DESTINATIONS
+        :return: list of route distances in meters in the order of destinations - math.inf if no route was found
+        """
+        return [math.inf if pair is None else pair[0]["value"] for pair in self.matrix_row(origin, destinations)]
+
+    def map_chunks(self, row, origin, destinations):
+        """
+        Resolve destinations in one request, or in concurrent requests of MAX_MATRIX_DESTINATIONS destinations
+        when there are more of them.
+
+        :param row: method resolving a chunk of destinations - matrix_row or distance_row
+        :param origin: starting location
+        :param destinations: list of end locations
+        :return: concatenated results of the chunks
+        """
+        origin = to_google_location(origin)
+        destinations = [to_google_location(destination) for destination in destinations]
+        chunks = [destinations[i:i + MAX_MATRIX_DESTINATIONS]
+                  for i in range(0, len(destinations), MAX_MATRIX_DESTINATIONS)]
+        if not chunks:
+            return []
+        if len(chunks) == 1:
+            return row(origin, chunks[0])
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            rows = executor.map(lambda chunk: row(origin, chunk), chunks)
+        return [result for results in rows for result in results]
+
+    def distance_matrix(self, origin, destinations):
+        return self.map_chunks(self.matrix_row, origin, destinations)
+
+    def distances(self, origin, destinations):
+        """
+        Retrieve route distances from one location to many locations.
+        * Destinations are resolved in one request, or in concurrent requests of MAX_MATRIX_DESTINATIONS
+          destinations when there are more of them.
+        """
+        return self.map_chunks(self.distance_row, origin, destinations)
+
+    def route(self, origin, destination, profile=RoutingProfile.DRIVING):
+        result = self.gmaps.directions(to_google_location(origin), to_google_location(destination), mode=profile)
+        if not result:
+            raise RoutingError('No route between the places')
+        steps_array = result[0]["legs"][0]['steps']
+        steps = list(map(lambda x: x['start_location'], steps_array))
+        steps.append(steps_array[len(steps_array) - 1]['end_location'])
+        polyline = result[0]['overview_polyline']['points']
+        return steps, polyline
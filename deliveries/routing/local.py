@@ -0,0 +1,153 @@
+import math
+import threading
+
+from googlemaps.convert import encode_polyline
+
+from bpproject.settings import ROUTING_GRAPH_PATH
+from deliveries.models import Place
+from deliveries.routing.base import RoutingBackend, RoutingError
+from deliveries.routing.road_graph import load_hierarchy
+from helpers.enums import RoutingProfile
+
+STEP_TURN_ANGLE = 30  # in degrees, change of heading that starts a new step of a route
+
+
+def distance_text(meters):
+    """
+    Format distance the same way as the Google Maps API.
+
+    :param meters: distance in meters
+    :return: e.g. '850 m' or '12.3 km'
+    """
+    if meters < 1000:
+        return f'{round(meters)} m'
+    return f'{meters / 1000:.1f} km'
+
+
+def duration_text(seconds):
+    """
+    Format duration the same way as the Google Maps API.
+
+    :param seconds: duration in seconds
+    :return: e.g. '1 min' or '2 hours 5 mins'
+    """
+    minutes = max(1, round(seconds / 60))
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if hours:
+        parts.append(f'{hours} hour{"s" if hours > 1 else ""}')
+    if minutes or not hours:
+        parts.append(f'{minutes} min{"s" if minutes > 1 else ""}')
+    return ' '.join(parts)
+
+
+def heading(a, b):
+    """
+    Calculate approximate heading between two coordinates.
+
+    :return: heading in degrees
+    """
+    return math.degrees(math.atan2(b[1] - a[1], b[0] - a[0]))
+
+
+def turn_points(points):
+    """
+    Select points of a route where its heading changes - the start locations of its steps.
+
+    :param points: list of (latitude, longitude) tuples of the route
+    :return: list of selected points including the first and the last point
+    """
+    steps = [points[0]]
+    for previous, current, following in zip(points, points[1:], points[2:]):
+        change = abs(heading(previous, current) - heading(current, following)) % 360
+        if min(change, 360 - change) >= STEP_TURN_ANGLE:
+            steps.append(current)
+    if len(points) > 1:
+        steps.append(points[-1])
+    return steps
+
+
+class LocalRoutingBackend(RoutingBackend):
+    """
+    Routing backend answering queries in-process from a road graph loaded from the OSM extract at
+    ROUTING_GRAPH_PATH.
+    * The contraction hierarchy of each profile is built on first use and stored next to the extract,
+      use the build_routing_index command to precompute it.
+    """
+    cacheable = False
+
+    def __init__(self):
+        if not ROUTING_GRAPH_PATH:
+            raise RoutingError('ROUTING_GRAPH_PATH is not set')
+        self.hierarchies = {}
+        self.lock = threading.Lock()
+
+    def hierarchy(self, profile):
+        """
+        Retrieve contraction hierarchy of a routing profile.
+
+        :param profile: travel mode of the route
+        :return: ContractionHierarchy instance
+        """
+        with self.lock:
+            if profile not in self.hierarchies:
+                self.hierarchies[profile] = load_hierarchy(ROUTING_GRAPH_PATH, str(profile))
+        return self.hierarchies[profile]
+
+    @staticmethod
+    def coordinates(location):
+        """
+        Get coordinates of a location, places without coordinates are looked up in the database.
+
+        :param location: dictionary with a 'place_id' and/or 'latitude' and 'longitude' keys
+        :return: tuple of (latitude, longitude)
+        """
+        if location.get('latitude') is not None and location.get('longitude') is not None:
+            return float(location['latitude']), float(location['longitude'])
+        place = Place.objects.filter(place_id=location.get('place_id')).first()
+        if not place:
+            raise RoutingError('Invalid place Id')
+        return place.coordinates.y, place.coordinates.x
+
+    def node(self, location, hierarchy):
+        """
+        Find the graph node closest to a location.
+
+        :return: ID of the node
+        """
+        node = hierarchy.nearest(*self.coordinates(location))
+        if node is None:
+            raise RoutingError('Road graph is empty')
+        return node
+
+    def distance(self, origin, destination):
+        hierarchy = self.hierarchy(RoutingProfile.DRIVING)
+        duration, distance, _ = hierarchy.query(self.node(origin, hierarchy), self.node(destination, hierarchy))
+        if duration == math.inf:
+            raise RoutingError('No route between the places')
+        return ({"text": distance_text(distance), "value": round(distance)},
+                {"text": duration_text(duration), "value": round(duration)})
+
+    def distance_matrix(self, origin, destinations):
+        hierarchy = self.hierarchy(RoutingProfile.DRIVING)
+        targets = [self.node(destination, hierarchy) for destination in destinations]
+        results = hierarchy.one_to_many(self.node(origin, hierarchy), targets)
+        return [None if duration == math.inf else
+                ({"text": distance_text(distance), "value": round(distance)},
+                 {"text": duration_text(duration), "value": round(duration)})
+                for duration, distance in results]
+
+    def distances(self, origin, destinations):
+        hierarchy = self.hierarchy(RoutingProfile.DRIVING)
+        targets = [self.node(destination, hierarchy) for destination in destinations]
+        results = hierarchy.one_to_many(self.node(origin, hierarchy), targets)
+        return [distance if distance == math.inf else round(distance) for _, distance in results]
+
+    def route(self, origin, destination, profile=RoutingProfile.DRIVING):
+        hierarchy = self.hierarchy(profile)
+        _, _, path = hierarchy.query(self.node(origin, hierarchy), self.node(destination, hierarchy))
+        if not path:
+            raise RoutingError('No route between the places')
+        points = [hierarchy.coordinates[node] for node in path]
+        steps = [{"lat": lat, "lng": lng} for lat, lng in turn_points(points)]
+        return steps, encode_polyline(points)
@@ -0,0 +1,425 @@
+import heapq
+import math
+import os
+import pickle
+import xml.etree.ElementTree as ElementTree
+
+EARTH_RADIUS = 6371008.8  # in meters
+
+# Default speeds in km/h per OSM highway type, used when a way has no usable maxspeed tag
+DRIVING_SPEEDS = {
+    'motorway': 110, 'motorway_link': 60, 'trunk': 90, 'trunk_link': 50, 'primary': 70, 'primary_link': 40,
+    'secondary': 60, 'secondary_link': 40, 'tertiary': 50, 'tertiary_link': 30, 'unclassified': 40,
+    'residential': 30, 'living_street': 10, 'service': 15, 'road': 30,
+}
+BICYCLING_SPEEDS = {
+    'primary': 15, 'primary_link': 15, 'secondary': 15, 'secondary_link': 15, 'tertiary': 15, 'tertiary_link': 15,
+    'unclassified': 15, 'residential': 15, 'living_street': 10, 'service': 12, 'road': 15, 'cycleway': 18,
+    'path': 12, 'track': 12,
+}
+WALKING_SPEEDS = {
+    'primary': 5, 'primary_link': 5, 'secondary': 5, 'secondary_link': 5, 'tertiary': 5, 'tertiary_link': 5,
+    'unclassified': 5, 'residential': 5, 'living_street': 5, 'service': 5, 'road': 5, 'footway': 5,
+    'pedestrian': 5, 'path': 5, 'track': 5, 'steps': 3, 'cycleway': 5,
+}
+PROFILE_SPEEDS = {
+    'driving': DRIVING_SPEEDS,
+    'bicycling': BICYCLING_SPEEDS,
+    'walking': WALKING_SPEEDS,
+}
+
+WITNESS_SEARCH_LIMIT = 500  # maximum number of nodes settled by one witness search
+GRID_CELL_SIZE = 0.01  # in degrees, size of the cells of the nearest node index
+NEAREST_SEARCH_RADIUS = 50  # in cells, farther nodes are found by scanning the whole graph
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Calculate great-circle distance between two coordinates.
+
+    :return: distance in meters
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def parse_speed(value):
+    """
+    Parse the maxspeed tag of an OSM way.
+
+    :param value: value of the tag, e.g. '50' or '30 mph'
+    :return: speed in km/h or None if the value is not numeric
+    """
+    if not value:
+        return None
+    parts = value.split()
+    try:
+        speed = float(parts[0])
+    except ValueError:
+        return None
+    if len(parts) > 1 and parts[1] == 'mph':
+        speed *= 1.609344
+    return speed if speed > 0 else None
+
+
+def way_directions(tags, profile):
+    """
+    Decide in which directions a way can be travelled.
+
+    :param tags: dictionary of OSM tags of the way
+    :param profile: routing profile - driving, bicycling or walking
+    :return: tuple of booleans (forward, backward)
+    """
+    if profile == 'walking':
+        return True, True
+    oneway = tags.get('oneway')
+    if profile == 'bicycling' and tags.get('oneway:bicycle') == 'no':
+        return True, True
+    if oneway == '-1':
+        return False, True
+    if oneway in ('yes', 'true', '1') or tags.get('junction') == 'roundabout' or tags.get('highway') == 'motorway':
+        return True, False
+    return True, True
+
+
+class RoadGraph:
+    """
+    Directed road graph with travel durations and distances on its edges.
+    """
+    def __init__(self, coordinates, edges):
+        """
+        Initialize graph.
+
+        :param coordinates: list of (latitude, longitude) tuples of nodes, the index is the ID of the node
+        :param edges: list of (source, target, duration in seconds, distance in meters) tuples
+        """
+        self.coordinates = coordinates
+        self.edges = edges
+
+    @classmethod
+    def from_osm(cls, path, profile):
+        """
+        Load road graph from an OSM XML extract.
+
+        :param path: path to the .osm file
+        :param profile: routing profile - driving, bicycling or walking
+        :return: RoadGraph instance
+        """
+        speeds = PROFILE_SPEEDS[profile]
+        osm_nodes = {}
+        ways = []
+        way = None
+        for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == 'way':
+                    way = {'refs': [], 'tags': {}}
+                continue
+            if element.tag == 'node':
+                osm_nodes[element.get('id')] = (float(element.get('lat')), float(element.get('lon')))
+            elif way is not None and element.tag == 'nd':
+                way['refs'].append(element.get('ref'))
+            elif way is not None and element.tag == 'tag':
+                way['tags'][element.get('k')] = element.get('v')
+            elif element.tag == 'way':
+                if way['tags'].get('highway') in speeds:
+                    ways.append(way)
+                way = None
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+
+        indexes = {}
+        coordinates = []
+        edges = []
+
+        def index(osm_id):
+            if osm_id not in indexes:
+                indexes[osm_id] = len(coordinates)
+                coordinates.append(osm_nodes[osm_id])
+            return indexes[osm_id]
+
+        for way in ways:
+            tags = way['tags']
+            speed = speeds[tags['highway']]
+            if profile == 'driving':
+                speed = parse_speed(tags.get('maxspeed')) or speed
+            forward, backward = way_directions(tags, profile)
+            refs = [ref for ref in way['refs'] if ref in osm_nodes]
+            for a, b in zip(refs, refs[1:]):
+                u, v = index(a), index(b)
+                distance = haversine(*coordinates[u], *coordinates[v])
+                duration = distance / (speed / 3.6)
+                if forward:
+                    edges.append((u, v, duration, distance))
+                if backward:
+                    edges.append((v, u, duration, distance))
+        return cls(coordinates, edges)
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy index of a road graph answering fastest route queries.
+    """
+    def __init__(self, graph):
+        """
+        Build the index - nodes are contracted in the order of their edge difference.
+
+        :param graph: RoadGraph instance
+        """
+        self.coordinates = graph.coordinates
+        count = len(self.coordinates)
+        self.arcs = {}  # (source, target) -> (duration, distance, contracted middle node or -1)
+        outgoing = [{} for _ in range(count)]
+        incoming = [{} for _ in range(count)]
+
+        def add_arc(u, w, duration, distance, middle):
+            if u == w or ((u, w) in self.arcs and self.arcs[(u, w)][0] <= duration):
+                return
+            self.arcs[(u, w)] = (duration, distance, middle)
+            outgoing[u][w] = (duration, distance)
+            incoming[w][u] = (duration, distance)
+
+        for u, w, duration, distance in graph.edges:
+            add_arc(u, w, duration, distance, -1)
+
+        def witness_search(source, excluded, limit):
+            distances = {source: 0}
+            heap = [(0, source)]
+            settled = 0
+            while heap and settled < WITNESS_SEARCH_LIMIT:
+                duration, node = heapq.heappop(heap)
+                if duration > distances[node]:
+                    continue
+                if duration > limit:
+                    break
+                settled += 1
+                for target, (arc_duration, _) in outgoing[node].items():
+                    candidate = duration + arc_duration
+                    if target != excluded and candidate < distances.get(target, math.inf):
+                        distances[target] = candidate
+                        heapq.heappush(heap, (candidate, target))
+            return distances
+
+        def shortcuts(v):
+            found = []
+            for u, (in_duration, in_distance) in incoming[v].items():
+                targets = [(w, arc) for w, arc in outgoing[v].items() if w != u]
+                if not targets:
+                    continue
+                limit = in_duration + max(arc[0] for _, arc in targets)
+                witnesses = witness_search(u, v, limit)
+                for w, (out_duration, out_distance) in targets:
+                    if witnesses.get(w, math.inf) > in_duration + out_duration:
+                        found.append((u, w, in_duration + out_duration, in_distance + out_distance))
+            return found
+
+        contracted_neighbours = [0] * count
+
+        def priority(v):
+            return len(shortcuts(v)) - len(incoming[v]) - len(outgoing[v]) + contracted_neighbours[v]
+
+        self.rank = [0] * count
+        contracted = [False] * count
+        heap = [(priority(v), v) for v in range(count)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            current = priority(v)
+            if heap and current > heap[0][0]:  # lazy update of the priority
+                heapq.heappush(heap, (current, v))
+                continue
+            new_arcs = shortcuts(v)
+            for u in incoming[v]:
+                del outgoing[u][v]
+                contracted_neighbours[u] += 1
+            for w in outgoing[v]:
+                del incoming[w][v]
+                contracted_neighbours[w] += 1
+            incoming[v], outgoing[v] = {}, {}
+            for u, w, duration, distance in new_arcs:
+                add_arc(u, w, duration, distance, v)
+            contracted[v] = True
+            self.rank[v] = order
+            order += 1
+
+        # Forward searches only go up in the hierarchy, backward searches only go up in the reversed graph
+        self.up = [[] for _ in range(count)]
+        self.down = [[] for _ in range(count)]
+        for (u, w), (duration, distance, _) in self.arcs.items():
+            if self.rank[u] < self.rank[w]:
+                self.up[u].append((w, duration, distance))
+            else:
+                self.down[w].append((u, duration, distance))
+
+        self.grid = {}
+        for node, (lat, lng) in enumerate(self.coordinates):
+            self.grid.setdefault(self.cell(lat, lng), []).append(node)
+
+    @staticmethod
+    def cell(lat, lng):
+        """
+        Get the nearest node index cell containing the coordinates.
+
+        :return: tuple of (row, column)
+        """
+        return math.floor(lat / GRID_CELL_SIZE), math.floor(lng / GRID_CELL_SIZE)
+
+    @staticmethod
+    def ring(row, column, radius):
+        """
+        Iterate over the cells at the given distance from a cell.
+
+        :return: generator of (row, column) tuples
+        """
+        if radius == 0:
+            yield row, column
+            return
+        for c in range(column - radius, column + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, column - radius
+            yield r, column + radius
+
+    def nearest(self, lat, lng):
+        """
+        Find the graph node closest to the coordinates.
+
+        :return: ID of the node or None if the graph is empty
+        """
+        if not self.coordinates:
+            return None
+        row, column = self.cell(lat, lng)
+        best, best_distance, found_at = None, math.inf, None
+        for radius in range(NEAREST_SEARCH_RADIUS + 1):
+            for cell in self.ring(row, column, radius):
+                for node in self.grid.get(cell, ()):
+                    distance = haversine(lat, lng, *self.coordinates[node])
+                    if distance < best_distance:
+                        best, best_distance = node, distance
+            if best is not None:
+                # A node in the next ring can still be closer than the one found in this ring
+                if found_at is not None:
+                    break
+                found_at = radius
+        if best is None:
+            best = min(range(len(self.coordinates)), key=lambda node: haversine(lat, lng, *self.coordinates[node]))
+        return best
+
+    def search(self, source, arcs):
+        """
+        Run a complete upward Dijkstra search.
+
+        :param source: ID of the start node
+        :param arcs: upward arcs of the search direction - self.up or self.down
+        :return: dictionary of reached nodes and their (duration, distance, parent) labels
+        """
+        labels = {source: (0, 0, None)}
+        heap = [(0, source)]
+        while heap:
+            duration, node = heapq.heappop(heap)
+            if duration > labels[node][0]:
+                continue
+            distance = labels[node][1]
+            for target, arc_duration, arc_distance in arcs[node]:
+                candidate = duration + arc_duration
+                if candidate < labels.get(target, (math.inf,))[0]:
+                    labels[target] = (candidate, distance + arc_distance, node)
+                    heapq.heappush(heap, (candidate, target))
+        return labels
+
+    @staticmethod
+    def meet(forward, backward):
+        """
+        Find the node where a forward and a backward search meet on the fastest route.
+
+        :return: tuple of (duration, distance, node) - node is None if the searches don't meet
+        """
+        best = (math.inf, math.inf, None)
+        for node, (duration, distance, _) in forward.items():
+            if node in backward:
+                candidate = (duration + backward[node][0], distance + backward[node][1], node)
+                if candidate[0] < best[0]:
+                    best = candidate
+        return best
+
+    def unpack(self, u, w):
+        """
+        Expand an arc that may be a shortcut into nodes of the original graph.
+
+        :return: list of node IDs from u to w
+        """
+        path = [u]
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            middle = self.arcs[(a, b)][2]
+            if middle == -1:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return path
+
+    def query(self, source, target):
+        """
+        Find the fastest route between two nodes.
+
+        :return: tuple of (duration in seconds, distance in meters, list of node IDs) - duration is math.inf
+                 and the list is empty if there is no route
+        """
+        forward = self.search(source, self.up)
+        backward = self.search(target, self.down)
+        duration, distance, node = self.meet(forward, backward)
+        if node is None:
+            return math.inf, math.inf, []
+        packed = []
+        current = node
+        while current is not None:
+            packed.append(current)
+            current = forward[current][2]
+        packed.reverse()
+        current = backward[node][2]
+        while current is not None:
+            packed.append(current)
+            current = backward[current][2]
+        path = [packed[0]]
+        for u, w in zip(packed, packed[1:]):
+            path.extend(self.unpack(u, w)[1:])
+        return duration, distance, path
+
+    def one_to_many(self, source, targets):
+        """
+        Find fastest route durations and distances from one node to many nodes.
+        * The upward search space of the source is explored only once.
+
+        :return: list of (duration, distance) tuples in the order of targets - math.inf if there is no route
+        """
+        forward = self.search(source, self.up)
+        results = []
+        for target in targets:
+            duration, distance, _ = self.meet(forward, self.search(target, self.down))
+            results.append((duration, distance))
+        return results
+
+
+def load_hierarchy(path, profile):
+    """
+    Load the contraction hierarchy of an OSM extract, building and storing it next to the extract if it is missing
+    or older than the extract.
+
+    :param path: path to the .osm file
+    :param profile: routing profile - driving, bicycling or walking
+    :return: ContractionHierarchy instance
+    """
+    index_path = f'{path}.{profile}.ch'
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        with open(index_path, 'rb') as file:
+            return pickle.load(file)
+    hierarchy = ContractionHierarchy(RoadGraph.from_osm(path, profile))
+    with open(index_path, 'wb') as file:
+        pickle.dump(hierarchy, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return hierarchy
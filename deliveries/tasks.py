@@ -0,0 +1,28 @@
+from deliveries.api.emails import delivery_start_receiver_email
+from deliveries.models import Delivery
+from jobs.queue import task
+from routes.api.route_store import create_route
+
+
+@task('create_route')
+def create_route_task(delivery_id):
+    """
+    Create the route of a new delivery.
+
+    :param delivery_id: ID of the delivery
+    """
+    delivery = Delivery.objects.select_related('pickup_place', 'delivery_place').get(id=delivery_id)
+    create_route(delivery)
+
+
+@task('delivery_start_receiver_email')
+def delivery_start_receiver_email_task(delivery_id):
+    """
+    Inform the receiver of a new delivery.
+    * Queued for deliveries created in bulk, other new deliveries write the email directly.
+
+    :param delivery_id: ID of the delivery
+    """
+    delivery = Delivery.objects.select_related('sender', 'receiver', 'item', 'pickup_place',
+                                               'delivery_place').get(id=delivery_id)
+    delivery_start_receiver_email(delivery)
@@ -1,7 +1,28 @@
+import base64
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+
+from django.contrib.gis.geos import LineString, Point
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from accounts.models import Account
+from deliveries.api.distance_cache import get_cached_distance, get_cached_distances, memory_cache
+from deliveries.models import Delivery, DeliveryTimeline, DeliveryTrackSegment, Item, Place
+from deliveries.routing.road_graph import load_hierarchy
+from helpers.enums import SizeType
+from helpers.functions import simplify
+from jobs.models import Job
+
 sample_account = {
     "email": "test@test.com",
     "password": "Testovacie123",
@@ -86,6 +107,70 @@ class TestList(APITestCase):
         self.assertEqual(response.data[0]['state'], 'ready')
         self.assertEqual(response.data[0]['user_is'], 'sender')
 
+    def test_get_etag(self):
+        self.register()
+        self.authenticate()
+        self.post()
+        etag = self.client.get(reverse('core_api:deliveries'))['ETag']
+        response = self.client.get(reverse('core_api:deliveries'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.post()
+        response = self.client.get(reverse('core_api:deliveries'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+    def test_get_edited(self):
+        self.register()
+        self.authenticate()
+        self.post()
+        etag = self.client.get(reverse('core_api:deliveries'))['ETag']
+        self.client.patch(reverse('account_api:account_detail', kwargs={'account_id': 'me'}), {'first_name': 'Marian'})
+        item = Delivery.objects.get().item
+        item.name = 'Zelene ponozky'
+        item.save()
+        response = self.client.get(reverse('core_api:deliveries'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['sender']['first_name'], 'Marian')
+        self.assertEqual(response.data[0]['item']['name'], 'Zelene ponozky')
+
+    def test_get_queries(self):
+        self.register()
+        self.authenticate()
+        self.post()
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(reverse('core_api:deliveries'))
+        self.post()
+        self.post()
+        with CaptureQueriesContext(connection) as three:
+            response = self.client.get(reverse('core_api:deliveries'))
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(len(one), len(three))
+
+    def test_get_pages(self):
+        self.register()
+        self.authenticate()
+        for _ in range(3):
+            self.post()
+        response = self.client.get(reverse('core_api:deliveries'), {'page_size': 2})
+        self.assertEqual(len(response.data), 2)
+        next_page = re.search(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+        response = self.client.get(next_page)
+        self.assertEqual(len(response.data), 1)
+        self.assertNotIn('rel="next"', response['Link'])
+        self.assertIn('rel="prev"', response['Link'])
+
+    def test_get_invalid_cursor(self):
+        self.register()
+        self.authenticate()
+        self.post()
+        positions = [['2021-10-01T10:00:00+00:00'], ['yesterday', str(uuid.uuid4())],
+                     ['2021-10-01T10:00:00+00:00', 'abc'], [None, str(uuid.uuid4())]]
+        cursors = ['abc', *(base64.urlsafe_b64encode(json.dumps({'p': position, 'r': False}).encode()).decode()
+                            for position in positions)]
+        for cursor in cursors:
+            response = self.client.get(reverse('core_api:deliveries'), {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class TestDetail(APITestCase):
     def register(self):
@@ -113,6 +198,19 @@ class TestDetail(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['state'], 'ready')
 
+    def test_etag(self):
+        self.register()
+        self.authenticate()
+        delivery_id = self.post()
+        url = reverse('core_api:delivery_detail', kwargs={'delivery_id': delivery_id})
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Delivery.objects.get(id=delivery_id).save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
 
 class TestPreview(APITestCase):
     def register(self):
@@ -133,3 +231,253 @@ class TestPreview(APITestCase):
         self.authenticate()
         response = self.client.post(reverse('core_api:deliveries_preview'), sample_delivery)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestBulk(APITestCase):
+    """ Test creating deliveries in bulk """
+
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_post_json(self):
+        self.register()
+        self.authenticate()
+        rows = [sample_delivery, sample_delivery, {"item.name": "Ponozky"}]
+        response = self.client.post(reverse('core_api:deliveries_bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data], [201, 201, 400])
+        self.assertEqual(Delivery.objects.count(), 2)
+        self.assertEqual(DeliveryTimeline.objects.count(), 2)  # receiver is the sender
+        self.assertEqual(Job.objects.count(), 4)
+        response = self.client.get(reverse('core_api:deliveries'))
+        self.assertEqual(len(response.data), 2)
+
+    def test_post_csv(self):
+        self.register()
+        self.authenticate()
+        content = io.StringIO()
+        writer = csv.DictWriter(content, fieldnames=list(sample_delivery))
+        writer.writeheader()
+        writer.writerows([sample_delivery] * 3)
+        response = self.client.post(reverse('core_api:deliveries_bulk'), content.getvalue(), content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['delivery']['user_is'], 'sender')
+
+    def test_post_invalid(self):
+        self.register()
+        self.authenticate()
+        response = self.client.post(reverse('core_api:deliveries_bulk'), {"item.name": "Ponozky"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('core_api:deliveries_bulk'), [{}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Delivery.objects.count(), 0)
+
+
+class TestStatistics(APITestCase):
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self):
+        return self.client.post(reverse('core_api:deliveries'), sample_delivery).data
+
+    def test_get(self):
+        self.register()
+        self.authenticate()
+        deliveries = [self.post(), self.post()]
+        response = self.client.get(reverse('core_api:deliveries_statistics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['count'], 2)
+        self.assertEqual(response.data[0]['total_distance'], sum(d['route_distance'] for d in deliveries))
+        response = self.client.get(reverse('core_api:deliveries_statistics'), {'role': 'receiver'})
+        self.assertEqual(response.data[0]['count'], 2)
+        response = self.client.get(reverse('core_api:deliveries_statistics'), {'role': 'courier'})
+        self.assertEqual(len(response.data), 0)
+
+    def test_get_receiver_account(self):
+        receiver = dict(sample_account, email='receiver@test.com', first_name='Jan', last_name='Novak')
+        self.client.post(reverse('account_api:accounts'), receiver)
+        self.register()
+        self.authenticate()
+        # Sender types in the receiver differently than their account
+        delivery = dict(sample_delivery, **{'receiver.email': receiver['email']})
+        self.client.post(reverse('core_api:deliveries'), delivery)
+        self.assertNotEqual(Delivery.objects.get().receiver_id, Account.objects.get(email=receiver['email']).person_id)
+        response = self.client.post(reverse('account_api:token_obtain_pair'),
+                                    {'email': receiver['email'], 'password': receiver['password']})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        response = self.client.get(reverse('core_api:deliveries_statistics'), {'role': 'receiver'})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['count'], 1)
+
+
+class TestTrack(APITestCase):
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self):
+        return self.client.post(reverse('core_api:deliveries'), sample_delivery).data['id']
+
+    def test_get(self):
+        self.register()
+        self.authenticate()
+        delivery_id = self.post()
+        DeliveryTrackSegment.objects.bulk_create([
+            DeliveryTrackSegment(delivery_id=delivery_id, started_at='2021-10-01T10:00:10Z',
+                                 path=LineString([(17.1020, 48.1400, 1633082410), (17.1030, 48.1400, 1633082420)])),
+            DeliveryTrackSegment(delivery_id=delivery_id, started_at='2021-10-01T10:00:00Z',
+                                 path=LineString([(17.1000, 48.1400, 1633082400), (17.1010, 48.1400, 1633082405)])),
+        ])
+        url = reverse('core_api:delivery_track', kwargs={'delivery_id': delivery_id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([position['longitude'] for position in response.data], [17.1, 17.101, 17.102, 17.103])
+        response = self.client.get(url, {'resolution': 10})
+        self.assertEqual([position['longitude'] for position in response.data], [17.1, 17.103])
+        response = self.client.get(url, {'resolution': 'far'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials(HTTP_AUTHORIZATION='')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_simplify(self):
+        line = [(48.14, 17.10), (48.1401, 17.11), (48.14, 17.12), (48.15, 17.13)]
+        self.assertEqual(simplify(line, 50), [(48.14, 17.10), (48.14, 17.12), (48.15, 17.13)])
+        self.assertEqual(simplify(line, 0), line)
+        # The courier overshoots along the line and turns back - the turn is kilometres away from both ends
+        u_turn = [(48.0, 17.0, 0), (48.0, 17.05, 1), (48.0, 17.01, 2)]
+        self.assertEqual(simplify(u_turn, 10), u_turn)
+
+
+class TestCopiedColumns(TestCase):
+    """ Test pickup coordinates and item size copied to deliveries """
+    def place(self, place_id, latitude, longitude):
+        return Place.objects.create(place_id=place_id, formatted_address=place_id, country='Slovakia',
+                                    city='Presov', street_address=place_id, postal_code='85101',
+                                    coordinates=Point(longitude, latitude, srid=4326))
+
+    def test_save(self):
+        first = self.place('first', 49.0, 20.0)
+        second = self.place('second', 48.0, 17.0)
+        item = Item.objects.create(name='Ponozky', size=SizeType.SMALL)
+        delivery = Delivery.objects.create(pickup_place=first, delivery_place=second, item=item)
+        self.assertEqual(delivery.pickup_coordinates, first.coordinates)
+        self.assertEqual(delivery.item_size, SizeType.SMALL)
+
+        delivery = Delivery.objects.get(pk=delivery.pk)
+        delivery.pickup_place = second
+        delivery.item = Item.objects.create(name='Ponozky', size=SizeType.LARGE)
+        delivery.save(update_fields=['pickup_place', 'item'])
+        delivery = Delivery.objects.get(pk=delivery.pk)
+        self.assertEqual(delivery.pickup_coordinates, second.coordinates)
+        self.assertEqual(delivery.item_size, SizeType.LARGE)
+
+        delivery.item.size = SizeType.MEDIUM
+        delivery.item.save()
+        self.assertEqual(Delivery.objects.get(pk=delivery.pk).item_size, SizeType.MEDIUM)
+
+
+class TestDistanceCache(TestCase):
+    """ Test caching of distances between places """
+    def fetch(self, origin, destination):
+        self.fetch_count += 1
+        return {'text': '1 km', 'value': 1000}, {'text': '1 min', 'value': 60}
+
+    def test_cached(self):
+        self.fetch_count = 0
+        memory_cache.clear()
+        origin, destination = {'place_id': 'origin'}, {'place_id': 'destination'}
+        first = get_cached_distance(origin, destination, self.fetch)
+        memory_cache.clear()
+        second = get_cached_distance(origin, destination, self.fetch)
+        third = get_cached_distance(origin, destination, self.fetch)
+        self.assertEqual(self.fetch_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second, third)
+
+    def fetch_many(self, origin, destinations):
+        self.fetch_count += len(destinations)
+        return [({'text': '1 km', 'value': 1000}, {'text': '1 min', 'value': 60})] * (len(destinations) - 1) + [None]
+
+    def test_cached_many(self):
+        self.fetch_count = 0
+        memory_cache.clear()
+        origin = {'place_id': 'origin'}
+        destinations = [{'place_id': 'first'}, {'place_id': 'second'}, {'place_id': 'first'}]
+        first = get_cached_distances(origin, destinations, self.fetch_many)
+        memory_cache.clear()
+        second = get_cached_distances(origin, destinations, self.fetch_many)
+        self.assertEqual(first[0], first[2])
+        self.assertIsNone(first[1])
+        self.assertEqual(first, second)
+        self.assertEqual(self.fetch_count, 3)  # destination without a route is retrieved again
+
+
+sample_osm = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="48.00" lon="17.00"/>
+  <node id="2" lat="48.00" lon="17.01"/>
+  <node id="3" lat="48.01" lon="17.01"/>
+  <node id="4" lat="48.01" lon="17.00"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/><nd ref="1"/><tag k="highway" v="residential"/><tag k="oneway" v="yes"/></way>
+</osm>
+"""
+
+
+class TestRoadGraph(SimpleTestCase):
+    """ Test routing on a local road graph """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'sample.osm')
+        with open(self.path, 'w') as file:
+            file.write(sample_osm)
+
+    def test_oneway(self):
+        hierarchy = load_hierarchy(self.path, 'driving')
+        start, end = hierarchy.nearest(48.00, 17.00), hierarchy.nearest(48.01, 17.00)
+        _, distance_there, path_there = hierarchy.query(start, end)
+        _, distance_back, path_back = hierarchy.query(end, start)
+        self.assertEqual(len(path_there), 4)  # around the block, the direct street is one way
+        self.assertEqual(len(path_back), 2)
+        self.assertLess(distance_back, distance_there)
+
+    def test_one_to_many(self):
+        hierarchy = load_hierarchy(self.path, 'driving')
+        start = hierarchy.nearest(48.00, 17.00)
+        targets = [hierarchy.nearest(48.01, 17.00), hierarchy.nearest(48.00, 17.01)]
+        results = hierarchy.one_to_many(start, targets)
+        self.assertEqual([hierarchy.query(start, target)[:2] for target in targets], results)
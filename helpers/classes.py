@@ -1,32 +1,264 @@
+import logging
+import queue
+import smtplib
 import threading
+import time
+from collections import OrderedDict
 
-from django.core.mail import send_mail
-from django.utils.html import strip_tags
+from django.core.mail import get_connection
 
+from bpproject.settings import (EMAIL_BATCH_SIZE, EMAIL_IDLE_TIMEOUT, EMAIL_QUEUE_SIZE, EMAIL_QUEUE_TIMEOUT,
+                                EMAIL_RETRIES, EMAIL_RETRY_DELAY, EMAIL_WORKERS)
+from helpers.functions import html_email
 
-class EmailThread(threading.Thread):
+logger = logging.getLogger('poslito')
+
+
+class EmailDispatcher:
     """
-    Thread for sending emails without blocking rest of the application.
+    Shared pool of worker threads sending emails without blocking rest of the application.
+    * Emails wait in a bounded queue - once it is full, senders wait for up to queue_timeout seconds and the email
+      is dropped if there is still no room.
+    * Each worker keeps its SMTP connection open while there are emails to send and sends all queued emails
+      in batches of up to batch_size. The connection is closed after idle_timeout seconds without emails.
+    * Emails that fail are retried with a fresh connection up to retries times with exponential backoff.
     """
-    def __init__(self, subject, html_message, to_address, from_address):
+    def __init__(self, workers=EMAIL_WORKERS, queue_size=EMAIL_QUEUE_SIZE, batch_size=EMAIL_BATCH_SIZE,
+                 retries=EMAIL_RETRIES, retry_delay=EMAIL_RETRY_DELAY, queue_timeout=EMAIL_QUEUE_TIMEOUT,
+                 idle_timeout=EMAIL_IDLE_TIMEOUT):
+        """
+        Initialize dispatcher, workers are started with the first email.
+
+        :param workers: Number of worker threads
+        :param queue_size: Maximum number of emails waiting to be sent
+        :param batch_size: Maximum number of emails sent by a worker at once
+        :param retries: Number of retries of a failed email
+        :param retry_delay: Seconds to wait before the first retry
+        :param queue_timeout: Seconds to wait for room in a full queue
+        :param idle_timeout: Seconds a connection is kept open without emails to send
         """
-        Initialize email.
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue(queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker threads if they are not running yet.
+        """
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run, name=f'email-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def send(self, subject, html_message, to_address, from_address):
+        """
+        Queue an HTML email together with its plain text version.
 
         :param subject: Subject of the email
         :param html_message: HTML formatted message to send
         :param to_address: Receiver email address
         :param from_address: Sender email address, if None than default
+        :return: True if the email was queued, False if it was dropped because the queue is full
+        """
+        self.start()
+        try:
+            self.queue.put(html_email(subject, html_message, to_address, from_address), timeout=self.queue_timeout)
+        except queue.Full:
+            logger.error(f'Email queue is full, dropped email "{subject}"')
+            return False
+        return True
+
+    def join(self):
+        """
+        Wait until all queued emails are sent or dropped.
         """
-        self.subject = subject
-        self.html_message = html_message
-        self.plain_message = strip_tags(self.html_message)
-        self.to_address = to_address
-        self.from_address = from_address
-        threading.Thread.__init__(self)
+        self.queue.join()
 
     def run(self):
         """
-        Run the thread and send the email.
+        Take batches of emails from the queue and send them over a persistent connection.
+        """
+        connection = None
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.idle_timeout if connection is not None else None)]
+            except queue.Empty:
+                connection = self.close(connection)
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                connection = self.deliver(connection, batch)
+            except Exception:
+                # The worker has to keep running, otherwise the queue only fills up once all workers exited
+                logger.exception(f'Sending {len(batch)} emails failed')
+                connection = self.close(connection)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def deliver(self, connection, messages):
+        """
+        Send messages, reconnecting and retrying the ones that failed.
+
+        :param connection: Open email backend connection or None
+        :param messages: list of EmailMessage instances
+        :return: Open connection or None if the messages could not be sent
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                if connection is None:
+                    connection = get_connection()
+                    connection.open()
+                # One message per call, so only the messages that were not sent yet are retried
+                while messages:
+                    try:
+                        connection.send_messages(messages[:1])
+                    except (smtplib.SMTPException, OSError):
+                        raise
+                    except Exception:
+                        # Invalid message, e.g. a header with a newline, would fail again - it is dropped
+                        logger.exception(f'Dropped email "{messages[0].subject}"')
+                    messages = messages[1:]
+                return connection
+            except (smtplib.SMTPException, OSError) as e:
+                connection = self.close(connection)
+                if attempt == self.retries:
+                    logger.error(f'Sending {len(messages)} emails failed: {e}')
+                else:
+                    logger.warning(f'Sending {len(messages)} emails failed, retrying: {e}')
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        return None
+
+    @staticmethod
+    def close(connection):
+        """
+        Close a connection, ignoring errors of connections that were already dropped by the server.
+
+        :return: None
+        """
+        if connection is not None:
+            try:
+                connection.close()
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+
+class LRUCache:
+    """
+    Thread safe in-process cache that evicts the least recently used entries once it is full.
+    """
+    def __init__(self, max_size):
+        """
+        Initialize cache.
+
+        :param max_size: Maximum number of entries held by the cache
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Retrieve an entry and mark it as recently used.
+
+        :param key: Key of the entry
+        :param default: Value returned if the key is not cached
+        :return: Cached value or default
+        """
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self.entries[key]
+
+    def set(self, key, value):
+        """
+        Store an entry, evicting the least recently used one if the cache is full.
+
+        :param key: Key of the entry
+        :param value: Value to cache
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove an entry if it is cached.
+
+        :param key: Key of the entry
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TTLCache(LRUCache):
+    """
+    Thread safe in-process cache whose entries expire a fixed time after they were stored.
+    """
+    def __init__(self, max_size, ttl):
+        """
+        Initialize cache.
+
+        :param max_size: Maximum number of entries held by the cache
+        :param ttl: Number of seconds entries stay valid
+        """
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
         """
-        send_mail(self.subject, self.plain_message,  self.from_address, [self.to_address],
-                  html_message=self.html_message)
+        Retrieve an entry that has not expired yet.
+
+        :param key: Key of the entry
+        :param default: Value returned if the key is not cached or expired
+        :return: Cached value or default
+        """
+        entry = super().get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self.delete(key)
+            return default
+        return value
+
+    def set(self, key, value):
+        """
+        Store an entry valid for ttl seconds.
+
+        :param key: Key of the entry
+        :param value: Value to cache
+        """
+        super().set(key, (value, time.monotonic() + self.ttl))
+
+
+# Emails sent by this process
+email_dispatcher = EmailDispatcher()
@@ -10,6 +10,14 @@ class SizeType(models.TextChoices):
     LARGE = 'large'
 
 
+# Sizes of items each vehicle type is able to carry
+VEHICLE_SIZES = {
+    SizeType.SMALL: (SizeType.SMALL,),
+    SizeType.MEDIUM: (SizeType.SMALL, SizeType.MEDIUM),
+    SizeType.LARGE: (SizeType.SMALL, SizeType.MEDIUM, SizeType.LARGE),
+}
+
+
 class WeightType(models.TextChoices):
     """
     Weight categories used throughout the app.
@@ -34,3 +42,34 @@ class DeliveryState(models.TextChoices):
     DELIVERING = 'delivering'
     DELIVERED = 'delivered'
     UNDELIVERABLE = 'undeliverable'
+
+
+class DeliveryRole(models.TextChoices):
+    """
+    Enumeration of roles a user can have in a delivery.
+    """
+    SENDER = 'sender'
+    RECEIVER = 'receiver'
+    COURIER = 'courier'
+
+
+class RoutingProfile(models.TextChoices):
+    """
+    Travel modes routes can be planned for - same as the modes of the Google Maps directions API.
+    """
+    DRIVING = 'driving'
+    BICYCLING = 'bicycling'
+    WALKING = 'walking'
+
+
+class JobState(models.TextChoices):
+    """
+    Enumeration of possible background job states.
+
+    pending - job is waiting to be run or retried
+    done - job finished successfully
+    failed - job failed on every allowed attempt
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
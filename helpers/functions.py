@@ -1,5 +1,12 @@
+import hashlib
+import hmac
 import math
+import re
 
+from django.core.mail import EmailMultiAlternatives
+from django.utils.html import strip_tags
+
+from bpproject.settings import BLIND_INDEX_KEY
 from helpers.enums import DeliveryState, SizeType, WeightType
 
 
@@ -45,3 +52,98 @@ def calculate_price(distance, size, weight):
 
     return math.floor(price * 100) / 100
 
+
+def html_email(subject, html_message, to_address, from_address):
+    """
+    Build an HTML email together with its plain text version.
+
+    :param subject: Subject of the email
+    :param html_message: HTML formatted message to send
+    :param to_address: Receiver email address
+    :param from_address: Sender email address, if None than default
+    :return: EmailMultiAlternatives instance
+    """
+    message = EmailMultiAlternatives(subject, strip_tags(html_message), from_address, [to_address])
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def blind_index(value):
+    """
+    Calculate keyed hash of a value of an encrypted field, so it can be looked up without decrypting the column.
+
+    :param value: Plain text value of the field
+    :return: Hex digest of HMAC-SHA256 of the value, None if the value is None
+    """
+    if value is None:
+        return None
+    return hmac.new(BLIND_INDEX_KEY.encode(), str(value).encode(), hashlib.sha256).hexdigest()
+
+
+def person_fingerprint(email, first_name, last_name, phone_number):
+    """
+    Calculate keyed hash of the canonicalized identity of a person, so people can be matched without decrypting.
+    * Email and names are compared case insensitive and without extra whitespace, phone number by its digits.
+
+    :param email: Email of the person
+    :param first_name: First name of the person
+    :param last_name: Last name of the person
+    :param phone_number: Phone number of the person
+    :return: Hex digest of HMAC-SHA256 of the identity
+    """
+    identity = [
+        (email or '').strip().lower(),
+        ' '.join((first_name or '').split()).casefold(),
+        ' '.join((last_name or '').split()).casefold(),
+        re.sub(r'[^\d+]', '', phone_number or ''),
+    ]
+    return blind_index('\x1f'.join(identity))
+
+
+def simplify(points, tolerance):
+    """
+    Simplify a line by the Douglas-Peucker algorithm.
+    * Distances are measured in an equirectangular projection around the first point, which is precise enough
+      for lines of a city.
+    * Distance of a point is measured to the segment between the kept points, not to the line through them,
+      so points where the line overshoots and turns back are kept.
+
+    :param points: list of tuples starting with latitude and longitude, other values of the tuples are kept
+    :param tolerance: Maximum distance of removed points from the simplified line in meters
+    :return: list of the kept points, first and last point are always kept
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+    scale = math.cos(math.radians(points[0][0]))
+    projected = [(point[1] * scale * 111320, point[0] * 111320) for point in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        (x1, y1), (x2, y2) = projected[start], projected[end]
+        dx, dy = x2 - x1, y2 - y1
+        length = dx * dx + dy * dy
+        farthest, max_distance = None, tolerance
+        for i in range(start + 1, end):
+            x, y = projected[i]
+            # Projection of the point clamped to the segment
+            t = min(max(((x - x1) * dx + (y - y1) * dy) / length, 0), 1) if length else 0
+            distance = math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def make_etag(*versions):
+    """
+    Build a strong ETag of a response from the values its content depends on, e.g. IDs and update times.
+
+    :param versions: values identifying the version of the response
+    :return: quoted ETag
+    """
+    return '"{}"'.format(hashlib.sha256(repr(versions).encode()).hexdigest()[:32])
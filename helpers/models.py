@@ -1,4 +1,8 @@
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.db.models import FloatField, Func, Q
+
+from helpers.functions import blind_index
 
 
 class TrackingModel(models.Model):
@@ -12,3 +16,123 @@ class TrackingModel(models.Model):
     class Meta:
         abstract = True
         ordering = ('-created_at',)
+
+
+class KNNDistance(Func):
+    """
+    PostGIS <-> distance operator between a geography column and a point.
+    * Ordering by it walks the GiST index of the column from the nearest row instead of sorting all rows.
+    """
+    output_field = FloatField()
+
+    def __init__(self, expression, point, **extra):
+        """
+        :param expression: Name of the geography column or an expression
+        :param point: GEOS Point with SRID 4326
+        """
+        super().__init__(expression, **extra)
+        self.point = point
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f'{sql} <-> ST_GeogFromText(%s)', [*params, self.point.ewkt]
+
+
+class BlindIndexQuerySet(models.QuerySet):
+    """
+    QuerySet that routes equality lookups on encrypted fields through their blind index columns.
+    * Exact and in lookups of fields listed in the blind_indexes of the model are rewritten, also inside Q objects
+      and through relations to other models with blind indexes - e.g. person__email of an account.
+    * Other lookups and lookups compared to expressions are left as they are and decrypt the column.
+    """
+    def rewrite_lookup(self, lookup, value):
+        """
+        Replace an equality lookup on an encrypted field with a lookup on its blind index.
+
+        :param lookup: lookup path, e.g. email, email__in or person__email
+        :param value: value of the lookup
+        :return: tuple of the rewritten lookup and value
+        """
+        model = self.model
+        parts = lookup.split('__')
+        for i, part in enumerate(parts):
+            index = getattr(model, 'blind_indexes', {}).get(part)
+            if index:
+                path, operator = parts[:i] + [index], '__'.join(parts[i + 1:])
+                if hasattr(value, 'resolve_expression'):
+                    return lookup, value
+                if operator in ('', 'exact'):
+                    return '__'.join(path), blind_index(value)
+                if operator == 'in':
+                    return '__'.join(path + ['in']), [blind_index(item) for item in value]
+                return lookup, value
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return lookup, value
+            if not field.is_relation or field.related_model is None:
+                return lookup, value
+            model = field.related_model
+        return lookup, value
+
+    def rewrite_q(self, condition):
+        """
+        Replace equality lookups on encrypted fields inside a Q object, nested Q objects included.
+
+        :param condition: Q object
+        :return: rewritten copy of the Q object
+        """
+        rewritten = Q()
+        rewritten.connector = condition.connector
+        rewritten.negated = condition.negated
+        rewritten.children = [
+            self.rewrite_q(child) if isinstance(child, Q) else
+            self.rewrite_lookup(*child) if isinstance(child, tuple) else child
+            for child in condition.children
+        ]
+        return rewritten
+
+    def rewrite_lookups(self, args, kwargs):
+        """
+        Replace equality lookups on encrypted fields with lookups on their blind indexes.
+
+        :param args: positional conditions of filter, exclude or get - Q objects are rewritten
+        :param kwargs: keyword lookups of filter, exclude or get
+        :return: tuple of rewritten conditions and keyword lookups
+        """
+        args = [self.rewrite_q(arg) if isinstance(arg, Q) else arg for arg in args]
+        return args, dict(self.rewrite_lookup(lookup, value) for lookup, value in kwargs.items())
+
+    def filter(self, *args, **kwargs):
+        args, kwargs = self.rewrite_lookups(args, kwargs)
+        return super().filter(*args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        args, kwargs = self.rewrite_lookups(args, kwargs)
+        return super().exclude(*args, **kwargs)
+
+
+class BlindIndexModel(models.Model):
+    """
+    Abstract model that keeps blind indexes of its encrypted fields up to date.
+    * blind_indexes maps names of encrypted fields to names of their index fields.
+    """
+    blind_indexes = {}
+
+    class Meta:
+        abstract = True
+
+    def update_blind_indexes(self):
+        """
+        Calculate blind indexes from the current values of the encrypted fields.
+        """
+        for field, index in self.blind_indexes.items():
+            setattr(self, index, blind_index(getattr(self, field)))
+
+    def save(self, *args, **kwargs):
+        self.update_blind_indexes()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {index for field, index in self.blind_indexes.items()
+                                                            if field in update_fields}
+        super().save(*args, **kwargs)
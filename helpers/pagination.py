@@ -0,0 +1,137 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks to the position of the last row instead of counting an offset, so every page
+    costs the same regardless of how deep it is.
+    * Ordering has to be unique, e.g. ('-created_at', '-id').
+    * Body of the response stays a plain list, links to the next and previous pages are in the Link header.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 100
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        """
+        Retrieve page size selected by the client.
+
+        :param request: HTTP request with optional page size query param
+        :return: page size limited to max_page_size
+        """
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, instance, reverse):
+        """
+        Create an opaque cursor pointing at a row.
+
+        :param instance: model instance the page starts after
+        :param reverse: True if the cursor points to the previous page
+        :return: URL safe cursor string
+        """
+        position = [getattr(instance, field.lstrip('-')) for field in self.ordering]
+        # isoformat keeps microseconds which DjangoJSONEncoder would truncate
+        data = json.dumps({'p': position, 'r': reverse},
+                          default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        """
+        Read position and direction from a cursor.
+        * Position values are parsed by the ordering fields of the model, so a tampered cursor is rejected here
+          instead of failing in the query.
+
+        :param cursor: cursor string from the query params
+        :param model: model of the paginated rows
+        :return: tuple of position values and reverse flag
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values, reverse = data['p'], bool(data['r'])
+            if not isinstance(values, list) or len(values) != len(self.ordering) or None in values:
+                raise NotFound(self.invalid_cursor_message)
+            position = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                        for field, value in zip(self.ordering, values)]
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def seek(self, position, reverse):
+        """
+        Build condition selecting rows after a position in the ordering.
+
+        :param position: values of the ordering fields of the last row
+        :param reverse: True to select rows before the position instead
+        :return: Q object
+        """
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            equal = {other.lstrip('-'): value for other, value in zip(self.ordering[:i], position)}
+            condition |= Q(**equal, **{f'{name}__{"lt" if descending else "gt"}': position[i]})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        position, reverse = self.decode_cursor(cursor, queryset.model) if cursor else (None, False)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.seek(position, reverse))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.rows = rows
+        return rows
+
+    def get_link(self, instance, reverse):
+        """
+        Create URL of the page next to a row.
+
+        :param instance: first or last row of the current page
+        :param reverse: True for the previous page, False for the next page
+        :return: absolute URL
+        """
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(instance, reverse))
+
+    def get_paginated_response(self, data):
+        links = []
+        if self.has_next and self.rows:
+            links.append(f'<{self.get_link(self.rows[-1], False)}>; rel="next"')
+        if self.has_previous:
+            if self.rows:
+                links.append(f'<{self.get_link(self.rows[0], True)}>; rel="prev"')
+            else:
+                url = remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+                links.append(f'<{url}>; rel="prev"')
+        headers = {'Link': ', '.join(links)} if links else None
+        return Response(data, headers=headers)
@@ -0,0 +1,6 @@
+from django.contrib import admin
+from jobs.models import EmailOutbox, Job
+
+
+admin.site.register(Job)
+admin.site.register(EmailOutbox)
@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+    """
+    Configuration of the jobs app.
+    """
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'jobs'
+
+    def ready(self):
+        """
+        Register job handlers defined in the tasks module of every installed app.
+        """
+        autodiscover_modules('tasks')
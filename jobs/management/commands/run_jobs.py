@@ -0,0 +1,33 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from bpproject.settings import JOBS_BATCH_SIZE, JOBS_POLL_INTERVAL
+from jobs.queue import run_pending
+
+logger = logging.getLogger('poslito')
+
+
+class Command(BaseCommand):
+    """
+    Long running worker that processes background jobs.
+    """
+    help = 'Run pending background jobs, e.g. route creation and delivery emails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=JOBS_BATCH_SIZE,
+                            help='Maximum number of jobs claimed at once.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run pending jobs once and exit instead of polling.')
+
+    def handle(self, *args, **options):
+        logger.info('Job worker started')
+        while True:
+            close_old_connections()
+            count = run_pending(options['batch_size'])
+            if options['once'] and count < options['batch_size']:
+                break
+            if not count:
+                time.sleep(JOBS_POLL_INTERVAL)
@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from bpproject.settings import EMAIL_IDLE_TIMEOUT, EMAIL_OUTBOX_BATCH_SIZE, JOBS_POLL_INTERVAL
+from helpers.classes import EmailDispatcher
+from jobs.outbox import send_pending
+
+logger = logging.getLogger('poslito')
+
+
+class Command(BaseCommand):
+    """
+    Long running sender of emails from the email outbox.
+    """
+    help = 'Send pending emails from the email outbox over a persistent connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EMAIL_OUTBOX_BATCH_SIZE,
+                            help='Maximum number of emails claimed at once.')
+        parser.add_argument('--once', action='store_true',
+                            help='Send pending emails once and exit instead of polling.')
+
+    def handle(self, *args, **options):
+        logger.info('Email outbox sender started')
+        connection, idle_since = None, time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                count, connection = send_pending(options['batch_size'], connection)
+                if count:
+                    idle_since = time.monotonic()
+                elif connection is not None and time.monotonic() - idle_since >= EMAIL_IDLE_TIMEOUT:
+                    connection = EmailDispatcher.close(connection)
+                if options['once'] and count < options['batch_size']:
+                    break
+                if not count:
+                    time.sleep(JOBS_POLL_INTERVAL)
+        finally:
+            EmailDispatcher.close(connection)
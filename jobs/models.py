@@ -0,0 +1,57 @@
+import uuid
+import pgcrypto
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from helpers.enums import JobState
+from helpers.models import TrackingModel
+
+
+class Job(TrackingModel):
+    """
+    Model for background jobs processed by the job worker after the transaction that created them commits.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=7, choices=JobState.choices, default=JobState.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # job is not run before this time
+    last_error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        db_table = "job"
+        indexes = [
+            models.Index(fields=['available_at'], condition=Q(state=JobState.PENDING), name='job_pending_idx'),
+        ]
+
+    def __str__(self):
+        return '{} ({})'.format(self.name, self.state)
+
+
+class EmailOutbox(TrackingModel):
+    """
+    Model for emails written in the transaction that caused them and sent by the outbox sender after it commits.
+    * Recipient and context of the template hold personal data and are encrypted on the database level.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    subject = models.CharField(max_length=200)
+    template = models.CharField(max_length=200)
+    context = pgcrypto.EncryptedTextField()  # JSON of the template context
+    to_address = pgcrypto.EncryptedEmailField(max_length=60)
+    from_address = models.CharField(max_length=200, blank=True, null=True)
+    state = models.CharField(max_length=7, choices=JobState.choices, default=JobState.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # email is not sent before this time
+    last_error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        db_table = "email_outbox"
+        indexes = [
+            models.Index(fields=['available_at'], condition=Q(state=JobState.PENDING),
+                         name='email_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return '{} ({})'.format(self.subject, self.state)
@@ -0,0 +1,90 @@
+import json
+import logging
+import smtplib
+import traceback
+
+from django.core.mail import get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from bpproject.settings import EMAIL_OUTBOX, JOBS_MAX_ATTEMPTS
+from helpers.classes import EmailDispatcher, email_dispatcher
+from helpers.enums import JobState
+from helpers.functions import html_email
+from jobs.models import EmailOutbox
+from jobs.queue import retry_delay
+
+logger = logging.getLogger('poslito')
+
+
+def queue_email(subject, template, context, to_address, from_address=None):
+    """
+    Send an HTML email rendered from a template once the current transaction commits.
+    * With EMAIL_OUTBOX the email is written to the outbox in the current transaction and sent by the outbox
+      sender, otherwise it is rendered now and handed to the email workers after commit.
+    * Nothing is sent if the transaction rolls back.
+
+    :param subject: Subject of the email
+    :param template: Name of the HTML template of the email
+    :param context: JSON serializable context of the template
+    :param to_address: Receiver email address
+    :param from_address: Sender email address, if None than default
+    """
+    if EMAIL_OUTBOX:
+        EmailOutbox.objects.create(subject=subject, template=template, context=json.dumps(context),
+                                   to_address=to_address, from_address=from_address)
+    else:
+        message = render_to_string(template, context)
+        transaction.on_commit(lambda: email_dispatcher.send(subject, message, to_address, from_address))
+
+
+def render_email(email):
+    """
+    Render an outbox row into an email message.
+
+    :param email: EmailOutbox instance
+    :return: EmailMultiAlternatives instance
+    """
+    message = render_to_string(email.template, json.loads(email.context))
+    return html_email(email.subject, message, email.to_address, email.from_address)
+
+
+def send_pending(batch_size, connection=None):
+    """
+    Claim and send a batch of pending emails over one connection.
+    * Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so any number of senders can run side by side.
+    * Failed emails are retried until JOBS_MAX_ATTEMPTS is reached.
+
+    :param batch_size: Maximum number of emails to send
+    :param connection: Open email backend connection reused between batches, a new one is opened if None
+    :return: tuple of the number of claimed emails and the connection, None if it failed
+    """
+    with transaction.atomic():
+        emails = list(EmailOutbox.objects.select_for_update(skip_locked=True)
+                      .filter(state=JobState.PENDING, available_at__lte=timezone.now())
+                      .order_by('available_at')[:batch_size])
+        for email in emails:
+            email.attempts += 1
+            try:
+                if connection is None:
+                    connection = get_connection()
+                    connection.open()
+                connection.send_messages([render_email(email)])
+            except Exception as e:
+                email.last_error = traceback.format_exc()
+                if isinstance(e, (smtplib.SMTPException, OSError)):
+                    # Connection may be broken, the next email opens a new one
+                    connection = EmailDispatcher.close(connection)
+                if email.attempts >= JOBS_MAX_ATTEMPTS:
+                    email.state = JobState.FAILED
+                    logger.error(f'Email {email.id} failed: {email.last_error}')
+                else:
+                    email.available_at = timezone.now() + retry_delay(email.attempts)
+                    logger.warning(f'Email {email.id} failed, retrying at {email.available_at}')
+            else:
+                email.state = JobState.DONE
+                email.last_error = None
+            email.updated_at = timezone.now()
+        EmailOutbox.objects.bulk_update(emails, ['state', 'attempts', 'available_at', 'last_error', 'updated_at'])
+    return len(emails), connection
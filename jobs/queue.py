@@ -0,0 +1,122 @@
+import datetime
+import logging
+import traceback
+
+from django.db import transaction
+from django.utils import timezone
+
+from bpproject.settings import JOBS_LEASE_TIMEOUT, JOBS_MAX_ATTEMPTS, JOBS_RETRY_DELAY
+from helpers.enums import JobState
+from jobs.models import Job
+
+logger = logging.getLogger('poslito')
+
+handlers = {}
+
+
+def task(name):
+    """
+    Decorator registering a function as the handler of jobs with the given name.
+
+    :param name: Name of the job
+    :return: Decorator returning the function unchanged
+    """
+    def register(function):
+        handlers[name] = function
+        return function
+    return register
+
+
+def enqueue(name, **payload):
+    """
+    Create a job in the current transaction - it becomes visible to the worker only after the transaction commits.
+
+    :param name: Name of a registered job handler
+    :param payload: JSON serializable keyword arguments passed to the handler
+    :return: Created job instance
+    """
+    return Job.objects.create(name=name, payload=payload)
+
+
+def enqueue_many(name, payloads):
+    """
+    Create jobs with the same handler in the current transaction with one insert.
+
+    :param name: Name of a registered job handler
+    :param payloads: list of JSON serializable keyword arguments passed to the handler, one per job
+    :return: list of created job instances
+    """
+    return Job.objects.bulk_create([Job(name=name, payload=payload) for payload in payloads])
+
+
+def retry_delay(attempts):
+    """
+    Calculate exponential backoff before the next attempt of a failed job.
+
+    :param attempts: Number of attempts the job already had
+    :return: timedelta to wait before the next attempt
+    """
+    return datetime.timedelta(seconds=JOBS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def claim(batch_size):
+    """
+    Lease a batch of pending jobs in a short transaction.
+    * Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED only until the lease is committed, so any number
+      of workers can run side by side.
+    * Leased jobs become available again after JOBS_LEASE_TIMEOUT, so jobs of a worker that died are retried.
+
+    :param batch_size: Maximum number of jobs to claim
+    :return: list of claimed Job instances
+    """
+    with transaction.atomic():
+        jobs = list(Job.objects.select_for_update(skip_locked=True)
+                    .filter(state=JobState.PENDING, available_at__lte=timezone.now())
+                    .order_by('available_at')[:batch_size])
+        now = timezone.now()
+        for job in jobs:
+            job.attempts += 1
+            job.available_at = now + datetime.timedelta(seconds=JOBS_LEASE_TIMEOUT)
+            job.updated_at = now
+        Job.objects.bulk_update(jobs, ['attempts', 'available_at', 'updated_at'])
+    return jobs
+
+
+def run_job(job):
+    """
+    Run one claimed job in its own transaction and record its result. Failed jobs are retried until
+    JOBS_MAX_ATTEMPTS is reached.
+    * Job is marked as done in the transaction of the handler, so its result and the done state are committed
+      together.
+
+    :param job: Job instance claimed by claim
+    """
+    try:
+        with transaction.atomic():
+            handlers[job.name](**job.payload)
+            job.state = JobState.DONE
+            job.save()
+    except Exception:
+        job.state = JobState.PENDING
+        job.last_error = traceback.format_exc()
+        if job.attempts >= JOBS_MAX_ATTEMPTS:
+            job.state = JobState.FAILED
+            logger.error(f'Job {job.name} {job.id} failed: {job.last_error}')
+        else:
+            job.available_at = timezone.now() + retry_delay(job.attempts)
+            logger.warning(f'Job {job.name} {job.id} failed, retrying at {job.available_at}')
+        job.save()
+
+
+def run_pending(batch_size):
+    """
+    Claim and run a batch of pending jobs.
+    * No rows are locked while the handlers run, each job is committed as soon as it finishes.
+
+    :param batch_size: Maximum number of jobs to run
+    :return: Number of jobs that were run
+    """
+    jobs = claim(batch_size)
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
@@ -0,0 +1,85 @@
+from django.core import mail
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from helpers.enums import JobState
+from jobs.models import EmailOutbox, Job
+from jobs.outbox import queue_email, send_pending
+from jobs.queue import claim, enqueue, run_pending, task
+
+calls = []
+
+
+@task('sample_job')
+def sample_job(value):
+    calls.append(value)
+
+
+@task('failing_job')
+def failing_job():
+    raise ValueError('failed')
+
+
+class TestRunPending(TestCase):
+    """ Test running background jobs """
+
+    def setUp(self):
+        calls.clear()
+
+    def test_run(self):
+        enqueue('sample_job', value=1)
+        self.assertEqual(run_pending(10), 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.get().state, JobState.DONE)
+
+    def test_retry(self):
+        enqueue('failing_job')
+        run_pending(10)
+        job = Job.objects.get()
+        self.assertEqual(job.state, JobState.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('ValueError', job.last_error)
+        self.assertEqual(run_pending(10), 0)  # waiting for retry
+
+    def test_lease(self):
+        enqueue('sample_job', value=1)
+        self.assertEqual(len(claim(10)), 1)  # worker died while running the job
+        self.assertEqual(run_pending(10), 0)
+        Job.objects.update(available_at=timezone.now())  # lease expired
+        self.assertEqual(run_pending(10), 1)
+        job = Job.objects.get()
+        self.assertEqual(job.state, JobState.DONE)
+        self.assertEqual(job.attempts, 2)
+
+
+class TestEmailOutbox(TestCase):
+    """ Test sending emails from the email outbox """
+
+    def test_send(self):
+        queue_email('Email confirmation', 'emails/confirmation_email.html', {'url': 'https://poslito.sk/'},
+                    'test@test.com')
+        self.assertEqual(len(mail.outbox), 0)
+        count, connection = send_pending(10)
+        self.assertEqual(count, 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['test@test.com'])
+        self.assertEqual(EmailOutbox.objects.get().state, JobState.DONE)
+        self.assertEqual(send_pending(10, connection)[0], 0)
+
+    def test_rollback(self):
+        try:
+            with transaction.atomic():
+                queue_email('Email confirmation', 'emails/confirmation_email.html', {}, 'test@test.com')
+                raise ValueError('rollback')
+        except ValueError:
+            pass
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_retry(self):
+        queue_email('Missing', 'emails/missing.html', {}, 'test@test.com')
+        send_pending(10)
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.state, JobState.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('TemplateDoesNotExist', email.last_error)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from routes.models import Route
+from routes.models import Route, RouteGeometry
 
 
-admin.site.register(Route)
\ No newline at end of file
+admin.site.register(Route)
+admin.site.register(RouteGeometry)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.response import Response
+
+from bpproject.settings import ROUTES_CACHE_TTL
+from deliveries.models import Delivery
+from routes.models import Route, RouteCacheGeneration, RouteGeometry
+
+route_cache = caches['routes']
+
+
+def get_generation():
+    """
+    Retrieve the current generation of cached route responses from the database.
+    * Generation is kept in the database, so routes written by any process, e.g. by the job worker, invalidate
+      responses cached by all processes even with a per-process cache backend.
+    * Generation starts at a timestamp, so a lost generation row never reuses keys of an older generation.
+
+    :return: generation number
+    """
+    return RouteCacheGeneration.objects.get_or_create(pk=1, defaults={'generation': time.time_ns()})[0].generation
+
+
+def invalidate():
+    """
+    Start a new generation - responses cached in older generations are never read again and expire.
+    """
+    if not RouteCacheGeneration.objects.filter(pk=1).update(generation=F('generation') + 1,
+                                                            updated_at=timezone.now()):
+        RouteCacheGeneration.objects.get_or_create(pk=1, defaults={'generation': time.time_ns()})
+
+
+def cache_key(kind, request):
+    """
+    Build key of a cached response in the current generation.
+
+    :param kind: list or detail
+    :param request: HTTP request - the key depends on its absolute URL with query params
+    :return: cache key
+    """
+    url = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()[:32]
+    return f'routes:{get_generation()}:{kind}:{url}'
+
+
+def cached_response(request, kind, build):
+    """
+    Serve serialized routes from the cache, or build and cache the response if not cached.
+    * Only successful responses are cached together with their ETag, cached responses answer conditional GETs too.
+
+    :param request: HTTP GET request
+    :param kind: list or detail
+    :param build: function building the response
+    :return: HTTP Response
+    """
+    key = cache_key(kind, request)
+    entry = route_cache.get(key)
+    if entry is None:
+        response = build()
+        if response.status_code == status.HTTP_200_OK:
+            route_cache.set(key, (response['ETag'], response.data), ROUTES_CACHE_TTL)
+        return response
+    etag, data = entry
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    return Response(data, headers={'ETag': etag})
+
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+@receiver(post_save, sender=RouteGeometry)
+@receiver(post_delete, sender=RouteGeometry)
+@receiver(post_delete, sender=Delivery)
+def invalidate_routes(sender, instance, **kwargs):
+    """
+    Invalidate cached routes after a route was created, reassigned or deleted.
+    * Generation is bumped once the change is committed and visible to other processes, so the row is not locked
+      for the rest of the transaction and responses cached from the old data before the commit are not served.
+    """
+    transaction.on_commit(invalidate)
@@ -0,0 +1,39 @@
+from deliveries.api.google_api import get_route, place_location
+from helpers.enums import RoutingProfile
+from routes.models import Route, RouteGeometry
+
+
+def get_route_geometry(pickup_place, delivery_place, profile=RoutingProfile.DRIVING):
+    """
+    Retrieve geometry of the route between two places.
+    * Stored geometry is reused, the routing backend is called only for new place pairs.
+
+    :param pickup_place: Place object of the starting location
+    :param delivery_place: Place object of the end location
+    :param profile: travel mode of the route
+    :return: RouteGeometry object
+    """
+    geometry = RouteGeometry.objects.filter(pickup_place=pickup_place, delivery_place=delivery_place,
+                                            profile=profile).first()
+    if geometry:
+        return geometry
+    steps, polyline = get_route(place_location(pickup_place), place_location(delivery_place), profile)
+    geometry, _ = RouteGeometry.objects.get_or_create(pickup_place=pickup_place, delivery_place=delivery_place,
+                                                      profile=profile,
+                                                      defaults={'steps': steps, 'polyline': polyline})
+    return geometry
+
+
+def create_route(delivery):
+    """
+    Create a route entry for delivery.
+    * Geometry of routes between the same places is shared and retrieved from the routing backend only once.
+
+    :param delivery: Delivery object
+    """
+    if Route.objects.filter(delivery=delivery).exists():
+        return
+    geometry = get_route_geometry(delivery.pickup_place, delivery.delivery_place)
+    if not geometry:  # if we cant create a route than just return
+        return
+    Route.objects.create(delivery=delivery, geometry=geometry)
@@ -5,7 +5,10 @@ from routes.models import Route
 class RouteSerializer(serializers.ModelSerializer):
     """
     Model serializer for Route instances.
+    * Polyline is simplified at the tolerance in meters given in the context, full polyline by default.
     """
+    steps = serializers.JSONField(source="geometry.steps", read_only=True)
+    polyline = serializers.SerializerMethodField()
     start_address = serializers.CharField(source="delivery.pickup_place.formatted_address", read_only=True)
     destination_address = serializers.CharField(source="delivery.delivery_place.formatted_address", read_only=True)
 
@@ -13,3 +16,6 @@ class RouteSerializer(serializers.ModelSerializer):
         model = Route
         fields = ['id', 'steps', 'polyline', 'start_address', 'destination_address', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at', 'start_address', 'destination_address']
+
+    def get_polyline(self, route):
+        return route.geometry.get_polyline(self.context.get('tolerance', 0))
@@ -1,10 +1,11 @@
 from django.urls import path
 
-from routes.api.views import RouteViewSet
+from routes.api.views import RouteViewSet, RoutesNearView
 
 app_name = 'routes'
 
 urlpatterns = [
+    path('near/', RoutesNearView.as_view(), name="routes_near"),
     path('<str:pk>/', RouteViewSet.as_view({'get': 'retrieve'}), name="routes_detail"),
     path('', RouteViewSet.as_view({'get': 'list'}), name="routes"),
 ]
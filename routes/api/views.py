@@ -1,18 +1,161 @@
-from rest_framework import viewsets
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from rest_framework import status, viewsets
+from rest_framework.exceptions import ValidationError as APIValidationError
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from url_filter.integrations.drf import DjangoFilterBackend
 
+from bpproject.settings import ROUTES_NEAR_MAX, ROUTES_NEAR_MAX_RADIUS
+from helpers.enums import DeliveryState
+from helpers.functions import make_etag
+from routes.api.cache import cached_response
 from routes.api.serializers import RouteSerializer
 from routes.models import Route
 
+# Meters per pixel of a 256 pixel tile at zoom level 0 at the equator
+METERS_PER_PIXEL = 156543.03
+MAX_ZOOM = 24
+
 
 class RouteViewSet(viewsets.ModelViewSet):
     """
     Viewset to retrieve and list routes of deliveries.
     * Allows filtering and searching based on pickup and delivery addresses
+    * Responses have ETags built from update times of the routes and their geometries. Requests with a matching
+      If-None-Match header get 304 without serializing the routes.
+    * Polylines are simplified for the tolerance or zoom query param, see get_tolerance.
+    * Serialized routes and pages of routes are cached until a route changes, see routes.api.cache.
     """
-    queryset = Route.objects.all().order_by('-created_at')
+    queryset = Route.objects.select_related('geometry', 'delivery__pickup_place', 'delivery__delivery_place')\
+        .order_by('-created_at')
     serializer_class = RouteSerializer
     filter_backends = [DjangoFilterBackend]
     filter_fields = ['delivery']
     pagination_class = LimitOffsetPagination
+
+    def get_tolerance(self):
+        """
+        Get tolerance of simplified polylines from query params.
+        * Zoom is a web map zoom level, its tolerance is the size of one pixel at the equator.
+
+        :return: Tolerance in meters, 0 for full polylines
+        """
+        params = self.request.query_params
+        try:
+            if 'tolerance' in params:
+                tolerance = float(params['tolerance'])
+            elif 'zoom' in params:
+                zoom = int(params['zoom'])
+                tolerance = METERS_PER_PIXEL / 2 ** zoom if 0 <= zoom <= MAX_ZOOM else -1
+            else:
+                tolerance = 0
+        except ValueError:
+            tolerance = -1
+        if not tolerance >= 0:
+            raise APIValidationError({'error': f'Tolerance must be a non-negative number of meters and zoom '
+                                               f'an integer from 0 to {MAX_ZOOM}'})
+        return tolerance
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['tolerance'] = self.get_tolerance()
+        return context
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve one route, 304 if not modified.
+        """
+        return cached_response(request, 'detail', lambda: self.retrieve_route(request, *args, **kwargs))
+
+    def retrieve_route(self, request, *args, **kwargs):
+        """
+        Retrieve one route from the database, 304 if not modified.
+        """
+        try:
+            version = Route.objects.filter(pk=kwargs['pk']).values_list('updated_at', 'geometry__updated_at').first()
+        except ValidationError:
+            version = None
+        if version is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = make_etag(*version, self.get_tolerance())
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """
+        List a page of routes, 304 if not modified.
+        """
+        return cached_response(request, 'list', lambda: self.list_routes(request, *args, **kwargs))
+
+    def list_routes(self, request, *args, **kwargs):
+        """
+        List a page of routes from the database, 304 if not modified.
+        """
+        version = self.filter_queryset(self.get_queryset()).aggregate(
+            count=Count('id'), updated_at=Max('updated_at'), geometry_updated_at=Max('geometry__updated_at'))
+        etag = make_etag(request.get_full_path(), version['count'], version['updated_at'],
+                         version['geometry_updated_at'])
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+
+class RoutesNearView(APIView):
+    """
+    View to find deliveries whose route passes near a point, e.g. to consolidate pickups or respond to incidents.
+    * Routes are searched by ST_DWithin on the GiST index of route paths, distances are calculated only for
+      the routes found.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        List routes of deliveries passing within a radius of coordinates given as query params, ordered by distance.
+
+        :param request: HTTP GET request with query params:
+                        longitude and latitude of the point - example: /?lon=52,25486&lat=24,6589 ,
+                        radius in meters,
+                        optional state - comma separated states of the deliveries, assigned and delivering by default,
+                        optional limit - maximum number of routes, ROUTES_NEAR_MAX by default.
+        :return: HTTP Response - 200 with list of route IDs, delivery IDs, states and distances in meters,
+                 400 if invalid query params, 401 if not authenticated, 403 if not staff
+        """
+        try:
+            longitude = float(request.query_params.get('lon', '').replace(',', '.'))
+            latitude = float(request.query_params.get('lat', '').replace(',', '.'))
+            radius = float(request.query_params.get('radius', ''))
+            limit = int(request.query_params.get('limit', ROUTES_NEAR_MAX))
+        except ValueError:
+            return Response({'error': "Invalid lat, lon, radius or limit parameter"}, status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 <= radius <= ROUTES_NEAR_MAX_RADIUS
+                and 0 < limit <= ROUTES_NEAR_MAX):
+            return Response({'error': "Parameter lat, lon, radius or limit out of range"},
+                            status.HTTP_400_BAD_REQUEST)
+        states = request.query_params.get('state', f'{DeliveryState.ASSIGNED},{DeliveryState.DELIVERING}').split(',')
+        if not set(states) <= set(DeliveryState.values):
+            return Response({'error': f"State must be one of {', '.join(DeliveryState.values)}"},
+                            status.HTTP_400_BAD_REQUEST)
+        point = Point(longitude, latitude, srid=4326)
+        routes = Route.objects.filter(delivery__state__in=states, geometry__path__dwithin=(point, D(m=radius)))\
+            .annotate(distance=Distance('geometry__path', point)).order_by('distance')\
+            .values('id', 'delivery_id', 'delivery__state', 'distance')[:limit]
+        return Response([{
+            'route_id': route['id'],
+            'delivery_id': route['delivery_id'],
+            'state': route['delivery__state'],
+            'distance': route['distance'].m,
+        } for route in routes])
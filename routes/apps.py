@@ -5,3 +5,9 @@ class RoutesConfig(AppConfig):
     """ Configuration for the routes app """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'routes'
+
+    def ready(self):
+        """
+        Connect invalidation of the route cache to model changes.
+        """
+        import routes.api.cache  # noqa: F401
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from routes.models import RouteGeometry
+
+
+class Command(BaseCommand):
+    """
+    Decode polylines of route geometries stored before their paths and simplified polylines were stored.
+    """
+    help = 'Fill paths and simplified polylines of route geometries, with --all also after changing ROUTE_TOLERANCES.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild all route geometries')
+
+    def handle(self, *args, **options):
+        geometries = RouteGeometry.objects.all()
+        if not options['all']:
+            geometries = geometries.filter(path__isnull=True)
+        count = 0
+        for geometry in geometries.iterator():
+            geometry.path = None
+            geometry.save(update_fields=['path', 'simplified', 'updated_at'])
+            count += 1
+        self.stdout.write(f'{count} route geometries updated')
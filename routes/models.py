@@ -1,18 +1,89 @@
 import uuid
-from deliveries.models import Delivery
+from django.contrib.gis.db import models
+from django.contrib.gis.geos import LineString
+from googlemaps.convert import decode_polyline, encode_polyline
+
+from bpproject.settings import ROUTE_TOLERANCES
+from deliveries.models import Delivery, Place
+from helpers.enums import RoutingProfile
+from helpers.functions import simplify
 from helpers.models import TrackingModel
-from django.db import models
+
+
+class RouteGeometry(TrackingModel):
+    """
+    Model for geometry of a route between two places.
+    * Shared by all routes with the same pickup place, delivery place and routing profile.
+    * The encoded polyline is decoded once into path on save, together with polylines simplified
+      at each of ROUTE_TOLERANCES meters.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    pickup_place = models.ForeignKey(Place, on_delete=models.RESTRICT, related_name='+')
+    delivery_place = models.ForeignKey(Place, on_delete=models.RESTRICT, related_name='+')
+    profile = models.CharField(max_length=9, choices=RoutingProfile.choices, default=RoutingProfile.DRIVING)
+    polyline = models.TextField()
+    steps = models.JSONField()
+    path = models.LineStringField(geography=True, srid=4326, null=True, editable=False)
+    # Tolerance in meters -> polyline simplified by the Douglas-Peucker algorithm
+    simplified = models.JSONField(default=dict, editable=False)
+
+    class Meta:
+        db_table = "route_geometry"
+        constraints = [
+            models.UniqueConstraint(fields=['pickup_place', 'delivery_place', 'profile'],
+                                    name='unique_route_geometry_places_profile'),
+        ]
+
+    def __str__(self):
+        return '{} -> {} ({})'.format(self.pickup_place_id, self.delivery_place_id, self.profile)
+
+    def save(self, *args, **kwargs):
+        if self.path is None and self.polyline:
+            points = [(point['lat'], point['lng']) for point in decode_polyline(self.polyline)]
+            if len(points) == 1:
+                # Line needs two points
+                points = points * 2
+            self.path = LineString([(longitude, latitude) for latitude, longitude in points], srid=4326)
+            self.simplified = {str(tolerance): encode_polyline(simplify(points, tolerance))
+                               for tolerance in ROUTE_TOLERANCES}
+        super().save(*args, **kwargs)
+
+    def get_polyline(self, tolerance=0):
+        """
+        Get polyline of the route simplified as much as a tolerance allows.
+
+        :param tolerance: Maximum distance of the returned polyline from the route in meters
+        :return: encoded polyline simplified at the largest stored tolerance not above tolerance, full polyline if
+                 there is none
+        """
+        stored = [key for key in self.simplified if float(key) <= tolerance]
+        if not stored:
+            return self.polyline
+        return self.simplified[max(stored, key=float)]
 
 
 class Route(TrackingModel):
     """ Model for route data """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     delivery = models.ForeignKey(Delivery, on_delete=models.SET_NULL, null=True, related_name='delivery')
-    polyline = models.CharField(max_length=2000)
-    steps = models.JSONField()
+    geometry = models.ForeignKey(RouteGeometry, on_delete=models.RESTRICT, related_name='routes')
 
     class Meta:
         db_table = "route"
 
     def __str__(self):
         return self.created_at
+
+
+class RouteCacheGeneration(TrackingModel):
+    """
+    Generation of cached route responses shared by all processes - single row, see routes.api.cache.
+    """
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1, editable=False)
+    generation = models.BigIntegerField()
+
+    class Meta:
+        db_table = "route_cache_generation"
+
+    def __str__(self):
+        return '{}'.format(self.generation)
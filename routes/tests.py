@@ -1,8 +1,16 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from googlemaps.convert import decode_polyline
 from django.utils.http import urlencode
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from accounts.models import Account
+from jobs.queue import run_pending
+from routes.api.cache import route_cache
+from routes.models import Route, RouteGeometry
+
 sample_account = {
     "email": "test@test.com",
     "password": "Testovacie123",
@@ -57,6 +65,7 @@ class TestFilter(APITestCase):
         self.register()
         self.authenticate()
         self.client.post(reverse('core_api:deliveries'), sample_delivery)
+        run_pending(10)  # routes are created by the job worker
 
     def test_no_filter(self):
         self.post()
@@ -79,3 +88,184 @@ class TestFilter(APITestCase):
         self.assertEqual(len(response.data), 0)
 
 
+class TestSharedGeometry(APITestCase):
+    """ Test reusing route geometry between the same places """
+
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_shared_geometry(self):
+        self.register()
+        self.authenticate()
+        self.client.post(reverse('core_api:deliveries'), sample_delivery)
+        self.client.post(reverse('core_api:deliveries'), sample_delivery)
+        run_pending(10)
+        self.assertEqual(Route.objects.count(), 2)
+        self.assertEqual(RouteGeometry.objects.count(), 1)
+        response = self.client.get(reverse('routes_api:routes'))
+        self.assertEqual(response.data[0]['polyline'], response.data[1]['polyline'])
+
+
+class TestCache(APITestCase):
+    """ Test caching of serialized routes """
+
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self):
+        self.client.post(reverse('core_api:deliveries'), sample_delivery)
+        run_pending(10)
+
+    def test_cached_list(self):
+        self.register()
+        self.authenticate()
+        self.post()
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(reverse('routes_api:routes'))
+        with CaptureQueriesContext(connection) as second:
+            cached = self.client.get(reverse('routes_api:routes'))
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertLess(len(second), len(first))
+        response = self.client.get(reverse('routes_api:routes'), HTTP_IF_NONE_MATCH=cached['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post()
+        response = self.client.get(reverse('routes_api:routes'))
+        self.assertEqual(len(response.data), 2)
+
+    def test_invalidated_by_other_process(self):
+        self.register()
+        self.authenticate()
+        self.post()
+        self.client.get(reverse('routes_api:routes'))
+        # Route is created by another process, e.g. the job worker - changes of its cache are not seen here
+        entries, expire_info = dict(route_cache._cache), dict(route_cache._expire_info)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post()
+        route_cache._cache.clear()
+        route_cache._cache.update(entries)
+        route_cache._expire_info.clear()
+        route_cache._expire_info.update(expire_info)
+        response = self.client.get(reverse('routes_api:routes'))
+        self.assertEqual(len(response.data), 2)
+
+
+class TestSimplified(APITestCase):
+    """ Test polylines simplified for the zoom level of a map """
+
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self):
+        self.register()
+        self.authenticate()
+        self.client.post(reverse('core_api:deliveries'), sample_delivery)
+        run_pending(10)
+
+    def test_path(self):
+        self.post()
+        geometry = RouteGeometry.objects.get()
+        self.assertEqual(len(geometry.path), len(decode_polyline(geometry.polyline)))
+        self.assertEqual(len(geometry.simplified), 4)
+
+    def test_zoom(self):
+        self.post()
+        full = self.client.get(reverse('routes_api:routes'))
+        overview = self.client.get(f'{reverse("routes_api:routes")}?{urlencode({"zoom": 5})}')
+        self.assertEqual(overview.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(overview.data[0]['polyline']), len(full.data[0]['polyline']))
+        self.assertNotEqual(overview['ETag'], full['ETag'])
+        response = self.client.get(f'{reverse("routes_api:routes")}?{urlencode({"tolerance": 0})}')
+        self.assertEqual(response.data[0]['polyline'], full.data[0]['polyline'])
+
+    def test_bad_zoom(self):
+        self.post()
+        response = self.client.get(f'{reverse("routes_api:routes")}?{urlencode({"zoom": "far"})}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestNear(APITestCase):
+    """ Test searching routes passing near a point """
+
+    def register(self):
+        self.client.post(reverse('account_api:accounts'), sample_account)
+
+    def authenticate(self):
+        credentials = {
+            "password": sample_account['password'],
+            "email": sample_account['email'],
+        }
+        response = self.client.post(reverse('account_api:token_obtain_pair'), credentials)
+        token = response.data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self):
+        self.register()
+        self.authenticate()
+        self.client.post(reverse('core_api:deliveries'), sample_delivery)
+        run_pending(10)
+
+    def near(self, **params):
+        query = {
+            "lat": sample_delivery['pickup_place.latitude'],
+            "lon": sample_delivery['pickup_place.longitude'],
+            "radius": 1000,
+        }
+        query.update(params)
+        return self.client.get(f'{reverse("routes_api:routes_near")}?{urlencode(query)}')
+
+    def test_near(self):
+        self.post()
+        Account.objects.update(is_staff=True)
+        response = self.near(state='ready')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['route_id'], Route.objects.get().id)
+        self.assertLess(response.data[0]['distance'], 1000)
+        response = self.near()
+        self.assertEqual(len(response.data), 0)
+
+    def test_bad_params(self):
+        self.post()
+        Account.objects.update(is_staff=True)
+        response = self.near(radius='far')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.near(state='lost')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_not_staff(self):
+        self.post()
+        response = self.near(state='ready')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)